@@ -1,64 +1,622 @@
 """Main module."""
 
+import asyncio
+import contextlib
 import logging
 import os
+import threading
 import time
-from typing import Union
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Dict,
+    Generator,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+    Union,
+)
 
-import pandas as pd
-from fw_client import FWClient
+from . import profiling, utils
+from .snapshot import (
+    admission,
+    download,
+    incremental,
+    journal,
+    metrics,
+    ordering,
+    project_index,
+    report,
+    retry,
+    scheduler,
+    snapshot,
+    snapshot_utils,
+    throttle,
+)
 
-from . import utils
-from .snapshot import snapshot
+if TYPE_CHECKING:
+    import pandas as pd
+
+    from .snapshot.async_snapshot import AsyncSnapshotter
 
 log = logging.getLogger(__name__)
 SNAPSHOT_TIMEOUT = 10 * 60  # ten min
 
+# The steps of the loops waiting on snapshots, carried out by either engine
+RETRY = "retry"
+POLL = "poll"
+SLEEP = "sleep"
+
 
 def process_report_for_retry(
-    report_path: os.PathLike, client: FWClient
-) -> pd.DataFrame:
+    report_path: os.PathLike, snapshotter: snapshot.Snapshotter
+) -> Tuple[List[str], "pd.DataFrame"]:
     """Process a snapshot report to retry failed snapshots
 
+    The unfinished snapshots in the report are refreshed first, concurrently, so
+    that any of them that failed since the report was written are retried too.
+
     Args:
         report_path: path to a snapshot report
-        client: A flywheel client object
+        snapshotter: the snapshotter to refresh the snapshots with
     Returns:
-        A list of project ids to retry
+        A list of project ids to retry, and the refreshed report
     """
-    df = pd.read_csv(report_path)
-    df = utils.refresh_nonfailed_snapshots(df, client)
-    df = utils.filter_completed_and_failed_snapshots(df)
-    projects_to_retry = df["project_id"].tolist()
-    return projects_to_retry
+    df = utils.read_report(report_path)
+    # The report already has the labels of its projects, so they are not fetched
+    utils.seed_project_cache(df, snapshotter.projects)
+    df = utils.refresh_nonfailed_snapshots(df, snapshotter)
+    projects_to_retry = utils.select_projects_to_retry(df)
+    log.info(f"{len(projects_to_retry)} of {len(df)} snapshots in report to retry")
+    return projects_to_retry, df
 
 
-def wait_for_snapshots(snapshotter: snapshot.Snapshotter) -> int:
-    """Wait for snapshots to reach an end state, complete or failed
+async def process_report_for_retry_async(
+    report_path: os.PathLike, snapshotter: "AsyncSnapshotter"
+) -> Tuple[List[str], "pd.DataFrame"]:
+    """Process a snapshot report to retry failed snapshots on the asyncio engine
+
+    Takes the same arguments as `process_report_for_retry`.
+    """
+    df = await asyncio.to_thread(utils.read_report, report_path)
+    utils.seed_project_cache(df, snapshotter.projects)
+    records = utils.records_to_refresh(df)
+    await snapshotter.refresh_statuses(records)
+    df = utils.apply_statuses(df, records)
+    projects_to_retry = utils.select_projects_to_retry(df)
+    log.info(f"{len(projects_to_retry)} of {len(df)} snapshots in report to retry")
+    return projects_to_retry, df
+
+
+def load_last_snapshots(
+    incremental_mode: bool, previous_report: Optional[os.PathLike]
+) -> Optional[Dict[str, snapshot_utils.SnapshotRecord]]:
+    """Loads the last snapshot of each project for an incremental run
+
+    Returns:
+        the last completed snapshot of each project in the previous report, or None
+        if the snapshotter should get them from the API instead
+    """
+    if not incremental_mode or not previous_report:
+        return None
+    return incremental.load_last_snapshots(previous_report)
+
+
+def load_estimator(
+    longest_first: bool, previous_report: Optional[os.PathLike]
+) -> Optional[ordering.CostEstimator]:
+    """Returns the estimator to order snapshots by, if they are ordered
+
+    Returns:
+        an estimator of the snapshot durations, from the previous report if set
+    """
+    if not longest_first:
+        return None
+    durations = ordering.load_durations(previous_report) if previous_report else {}
+    return ordering.CostEstimator(durations)
+
+
+def make_admission_window(
+    max_active_snapshots: int, adapt_active_snapshots: bool
+) -> Optional[admission.AdmissionWindow]:
+    """Returns the limit on the snapshots left unfinished at once, 0 for no limit"""
+    if not max_active_snapshots:
+        return None
+    return admission.AdmissionWindow(
+        max_active_snapshots, adaptive=adapt_active_snapshots
+    )
+
+
+def make_retry_queue(max_snapshot_retries: int) -> Optional[retry.RetryQueue]:
+    """Returns the queue of failed snapshots to retry in the run, 0 for no retries"""
+    if not max_snapshot_retries:
+        return None
+    return retry.RetryQueue(max_snapshot_retries)
+
+
+def make_report_writer(output_file_path: os.PathLike) -> report.ReportWriter:
+    """Returns the writer of the run's report, in the format of its extension
+
+    A JSONL report is appended to as snapshots change, rather than rewritten.  A
+    Parquet report is written as CSV instead when pyarrow is not installed.
+    """
+    output_format = report.report_format(output_file_path)
+    if output_format == report.PARQUET and not report.parquet_available():
+        log.warning("Parquet reports need the pyarrow package, writing a CSV report")
+        output_file_path = os.path.splitext(output_file_path)[0] + ".csv"
+    return report.ReportWriter(output_file_path, append=output_format == report.JSONL)
+
+
+def make_downloader(
+    download_dir: Optional[os.PathLike],
+    api_key: str,
+    max_workers: int,
+    run_metrics: metrics.Metrics,
+) -> Optional[download.SnapshotDownloader]:
+    """Returns the downloader of completed snapshots, if they are downloaded"""
+    if not download_dir:
+        return None
+    return download.SnapshotDownloader(
+        download.make_client(api_key, max_workers),
+        download_dir,
+        max_workers=max_workers,
+        run_metrics=run_metrics,
+    )
+
+
+def finish_downloads(
+    downloader: Optional[download.SnapshotDownloader], return_state: int
+) -> int:
+    """Waits for the snapshots still downloading, once every snapshot is final
+
+    Returns:
+        the state to return from the run, 1 if a snapshot could not be downloaded
+    """
+    if downloader is None:
+        return return_state
+    with downloader.metrics.phase("download"):
+        downloader.close()
+    if downloader.errors:
+        log.warning(f"Unable to download {len(downloader.errors)} snapshot(s)")
+        return 1
+    return return_state
+
+
+def open_project_index(
+    project_index_path: Optional[os.PathLike],
+) -> Optional[project_index.ProjectIndex]:
+    """Returns the index to record the projects found in, if one is wanted"""
+    if not project_index_path:
+        return None
+    return project_index.ProjectIndex(project_index_path)
+
+
+def use_project_index(
+    snapshotter, previous_project_index: Optional[os.PathLike]
+) -> None:
+    """Hands the projects of a previous run's index to a snapshotter of either engine
 
     Args:
-        snapshotter: A snapshotter object with snapshots to wait on
+        snapshotter: the snapshotter of the run
+        previous_project_index: If set, the path of the index
+    """
+    if not previous_project_index:
+        return
+    indexed_filter, projects = project_index.load_project_index(previous_project_index)
+    snapshotter.use_project_index(indexed_filter, projects)
+
+
+def wait_steps(
+    snapshotter, poll_scheduler: scheduler.PollScheduler, report_writer=None
+) -> Generator[Tuple[str, Any], Any, int]:
+    """Yields the steps of waiting for snapshots to reach an end state
+
+    The waiting loop of both engines, which carry out each step, a `RETRY`,
+    `POLL` or `SLEEP` and its argument, and send back its result.
+
+    Args:
+        snapshotter: A snapshotter object with snapshots to wait on, either engine
+        poll_scheduler: The scheduler deciding when each snapshot is polled
+        report_writer: If set, rewrites the snapshot report as snapshots progress
 
     Returns:
         int: 0 if completed, 1 if timed out
     """
+    run_metrics = snapshotter.metrics
+    for record in snapshotter.snapshots:
+        if not record.is_final():
+            poll_scheduler.schedule(record)
+
     start = time.time()
     while time.time() - start < SNAPSHOT_TIMEOUT:
-        snapshotter.update_snapshots()
         if snapshotter.is_finished():
             # Finished includes "complete" or "failed", just any end state.
             return 0
-        time.sleep(10)
+        with run_metrics.phase("retry"):
+            retried = yield RETRY, None
+        if retried:
+            reschedule(poll_scheduler, snapshotter.snapshots.pending())
+            continue
+        due = poll_scheduler.pop_due()
+        if due:
+            run_metrics.increment("polls", len(due))
+            with run_metrics.phase("poll"):
+                yield POLL, due
+            reschedule(poll_scheduler, due)
+            if report_writer:
+                with run_metrics.phase("report"):
+                    report_writer.maybe_flush(snapshotter.snapshots)
+            continue
+        remaining = SNAPSHOT_TIMEOUT - (time.time() - start)
+        with run_metrics.phase("sleep"):
+            next_in = min(
+                poll_scheduler.next_poll_in(), snapshotter.next_retry_in(), remaining
+            )
+            yield SLEEP, max(0, next_in)
     # Timeout was reached before snapshots were finished
     return 1
 
 
+def poll_steps(
+    snapshotter,
+    poll_scheduler: scheduler.PollScheduler,
+    stopped: Callable[[], bool],
+) -> Generator[Tuple[str, Any], Any, None]:
+    """Yields the steps of polling the unfinished snapshots until stopped
+
+    Like `wait_steps`, for the polling done while triggering in a window.
+
+    Args:
+        snapshotter: A snapshotter object with snapshots to poll, either engine
+        poll_scheduler: The scheduler deciding when each snapshot is polled
+        stopped: returns True once polling should stop
+    """
+    while not stopped():
+        for record in snapshotter.snapshots.pending():
+            poll_scheduler.schedule(record)
+        due = poll_scheduler.pop_due()
+        if due:
+            snapshotter.metrics.increment("polls", len(due))
+            yield POLL, due
+            reschedule(poll_scheduler, due)
+            continue
+        yield SLEEP, min(poll_scheduler.next_poll_in(), admission.WINDOW_POLL_INTERVAL)
+
+
+def carry_out(
+    steps: Generator[Tuple[str, Any], Any, Any],
+    actions: Dict[str, Callable[[Any], Any]],
+) -> Any:
+    """Carries out the steps of a loop, sending each the result of its action
+
+    Args:
+        steps: the steps, e.g. of `wait_steps`
+        actions: the function carrying out each kind of step, on its argument
+
+    Returns:
+        the value the steps returned
+    """
+    try:
+        step, argument = next(steps)
+        while True:
+            step, argument = steps.send(actions[step](argument))
+    except StopIteration as finished:
+        return finished.value
+    finally:
+        steps.close()
+
+
+async def carry_out_async(
+    steps: Generator[Tuple[str, Any], Any, Any],
+    actions: Dict[str, Callable[[Any], Awaitable[Any]]],
+) -> Any:
+    """Like `carry_out`, awaiting the coroutine functions carrying out the steps"""
+    try:
+        step, argument = next(steps)
+        while True:
+            step, argument = steps.send(await actions[step](argument))
+    except StopIteration as finished:
+        return finished.value
+    finally:
+        steps.close()
+
+
+def wait_for_snapshots(
+    snapshotter: snapshot.Snapshotter,
+    poll_scheduler: Optional[scheduler.PollScheduler] = None,
+    report_writer: Optional[report.ReportWriter] = None,
+) -> int:
+    """Wait for snapshots to reach an end state, complete or failed
+
+    Each snapshot is polled on its own backoff schedule rather than all at once.
+    Failed snapshots are triggered again as their retry backoff passes, and their
+    retries polled in turn.
+
+    Args:
+        snapshotter: A snapshotter object with snapshots to wait on
+        poll_scheduler: The scheduler deciding when each snapshot is polled
+        report_writer: If set, rewrites the snapshot report as snapshots progress
+
+    Returns:
+        int: 0 if completed, 1 if timed out
+    """
+    if poll_scheduler is None:
+        poll_scheduler = scheduler.PollScheduler()
+    steps = wait_steps(snapshotter, poll_scheduler, report_writer)
+    return carry_out(
+        steps,
+        {
+            RETRY: lambda _: snapshotter.retry_failed_snapshots(),
+            POLL: snapshotter.update_snapshots,
+            SLEEP: time.sleep,
+        },
+    )
+
+
+async def wait_for_snapshots_async(
+    snapshotter: "AsyncSnapshotter",
+    poll_scheduler: Optional[scheduler.PollScheduler] = None,
+    report_writer: Optional[report.ReportWriter] = None,
+) -> int:
+    """Wait for the snapshots of an `AsyncSnapshotter` to reach an end state
+
+    Takes the same arguments as `wait_for_snapshots`.
+    """
+    if poll_scheduler is None:
+        poll_scheduler = scheduler.PollScheduler()
+    steps = wait_steps(snapshotter, poll_scheduler, report_writer)
+    return await carry_out_async(
+        steps,
+        {
+            RETRY: lambda _: snapshotter.retry_failed_snapshots(),
+            POLL: snapshotter.update_snapshots,
+            SLEEP: asyncio.sleep,
+        },
+    )
+
+
+@contextlib.contextmanager
+def polling_in_background(
+    snapshotter: snapshot.Snapshotter, poll_scheduler: scheduler.PollScheduler
+) -> Iterator[None]:
+    """Polls the unfinished snapshots on a thread of its own while the block runs
+
+    Used while triggering in a window, as the window only moves when snapshots
+    are seen to finish.  Nothing is polled if the snapshotter has no window.
+
+    Args:
+        snapshotter: A snapshotter object with snapshots to poll
+        poll_scheduler: The scheduler deciding when each snapshot is polled
+    """
+    if snapshotter.window is None:
+        yield
+        return
+    stopped = threading.Event()
+    steps = poll_steps(snapshotter, poll_scheduler, stopped.is_set)
+    poller = threading.Thread(
+        target=carry_out,
+        args=(steps, {POLL: snapshotter.update_snapshots, SLEEP: stopped.wait}),
+        name="Poller",
+        daemon=True,
+    )
+    poller.start()
+    try:
+        yield
+    finally:
+        stopped.set()
+        poller.join()
+
+
+@contextlib.asynccontextmanager
+async def polling_in_background_async(
+    snapshotter: "AsyncSnapshotter", poll_scheduler: scheduler.PollScheduler
+) -> AsyncIterator[None]:
+    """Polls the unfinished snapshots of an `AsyncSnapshotter` while the block runs
+
+    Like `polling_in_background`, on a task of its own.
+    """
+    if snapshotter.window is None:
+        yield
+        return
+    steps = poll_steps(snapshotter, poll_scheduler, lambda: False)
+    poller = asyncio.create_task(
+        carry_out_async(
+            steps, {POLL: snapshotter.update_snapshots, SLEEP: asyncio.sleep}
+        )
+    )
+    try:
+        yield
+    finally:
+        poller.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await poller
+
+
+def reschedule(poll_scheduler: scheduler.PollScheduler, polled: List) -> None:
+    """Queues the next poll of every polled snapshot that has not finished"""
+    for record in polled:
+        if not record.is_final():
+            poll_scheduler.schedule(record)
+
+
+def save_metrics(
+    snapshotter,
+    metrics_path: Optional[os.PathLike],
+    prometheus_path: Optional[os.PathLike] = None,
+) -> None:
+    """Writes the metrics of a run, with the final status of its snapshots
+
+    Args:
+        snapshotter: the snapshotter of the run, either engine
+        metrics_path: If set, the path of the JSON metrics file
+        prometheus_path: If set, the path of the Prometheus textfile
+    """
+    snapshotter.metrics.record_snapshots(snapshotter.snapshots)
+    snapshotter.metrics.record_connections(snapshotter.connection_stats())
+    if metrics_path:
+        snapshotter.metrics.write_json(metrics_path)
+    if prometheus_path:
+        snapshotter.metrics.write_prometheus(prometheus_path)
+
+
+def finish_run(
+    snapshotter,
+    return_state: int,
+    metrics_path: Optional[os.PathLike],
+    prometheus_path: Optional[os.PathLike] = None,
+) -> int:
+    """Waits for the downloads, writes the metrics and closes the journal of a run
+
+    Called however the run ends, on either engine, so nothing is left open when
+    there is nothing to retry or triggering raised.
+
+    Args:
+        snapshotter: the snapshotter of the run, either engine
+        return_state: the state the run would return
+        metrics_path: If set, the path of the JSON metrics file
+        prometheus_path: If set, the path of the Prometheus textfile
+
+    Returns:
+        the state to return from the run, 1 if a snapshot could not be downloaded
+    """
+    try:
+        return_state = finish_downloads(snapshotter.downloader, return_state)
+        save_metrics(snapshotter, metrics_path, prometheus_path)
+    finally:
+        if snapshotter.journal:
+            snapshotter.journal.close()
+    return return_state
+
+
+def snapshot_projects(
+    snapshotter: snapshot.Snapshotter,
+    project_filter: str,
+    retry_failed: Union[None, os.PathLike],
+    output_file_path: os.PathLike,
+    resumed: List[snapshot_utils.SnapshotRecord],
+    previous_project_index: Optional[os.PathLike],
+    max_polls_per_second: float,
+) -> int:
+    """Triggers the snapshots of a run, then waits for them and writes the report
+
+    Args:
+        snapshotter: the snapshotter of the run
+        project_filter: the project filter to trigger snapshots on
+        retry_failed: If set, the path to a snapshot report to retry failed
+            snapshots of instead
+        output_file_path: the path to save the snapshot report to
+        resumed: the snapshots of the run being resumed, if any
+        previous_project_index: If set, the project index of a previous run
+        max_polls_per_second: the most snapshot status requests to send per second
+
+    Returns:
+        0 if successful, 1 if not
+    """
+    snapshotter.resume(resumed)
+    use_project_index(snapshotter, previous_project_index)
+    if retry_failed:
+        with snapshotter.metrics.phase("reconcile"):
+            projects_to_retry, _ = process_report_for_retry(retry_failed, snapshotter)
+        if not projects_to_retry:
+            log.info("No failed snapshots to retry")
+            return 0
+
+    poll_scheduler = scheduler.PollScheduler(max_polls_per_second=max_polls_per_second)
+    with snapshotter.metrics.phase("trigger"):
+        with polling_in_background(snapshotter, poll_scheduler):
+            if retry_failed:
+                snapshotter.trigger_snapshots_on_list(projects_to_retry)
+            else:
+                snapshotter.trigger_snapshots_on_filter(project_filter)
+
+    if snapshotter.errors:
+        log.warning(
+            f"Unable to trigger snapshots on {len(snapshotter.errors)} project(s)"
+        )
+
+    report_writer = make_report_writer(output_file_path)
+    return_state = wait_for_snapshots(snapshotter, poll_scheduler, report_writer)
+    report_writer.flush(snapshotter.snapshots)
+    return return_state
+
+
+async def snapshot_projects_async(
+    snapshotter: "AsyncSnapshotter",
+    project_filter: str,
+    retry_failed: Union[None, os.PathLike],
+    output_file_path: os.PathLike,
+    resumed: List[snapshot_utils.SnapshotRecord],
+    previous_project_index: Optional[os.PathLike],
+    max_polls_per_second: float,
+) -> int:
+    """Triggers and waits for the snapshots of a run on the asyncio engine
+
+    Takes the same arguments as `snapshot_projects`.
+    """
+    snapshotter.resume(resumed)
+    use_project_index(snapshotter, previous_project_index)
+    if retry_failed:
+        with snapshotter.metrics.phase("reconcile"):
+            projects_to_retry, _ = await process_report_for_retry_async(
+                retry_failed, snapshotter
+            )
+        if not projects_to_retry:
+            log.info("No failed snapshots to retry")
+            return 0
+
+    poll_scheduler = scheduler.PollScheduler(max_polls_per_second=max_polls_per_second)
+    with snapshotter.metrics.phase("trigger"):
+        async with polling_in_background_async(snapshotter, poll_scheduler):
+            if retry_failed:
+                await snapshotter.trigger_snapshots_on_list(projects_to_retry)
+            else:
+                await snapshotter.trigger_snapshots_on_filter(project_filter)
+
+    if snapshotter.errors:
+        log.warning(
+            f"Unable to trigger snapshots on {len(snapshotter.errors)} project(s)"
+        )
+
+    report_writer = make_report_writer(output_file_path)
+    return_state = await wait_for_snapshots_async(
+        snapshotter, poll_scheduler, report_writer
+    )
+    report_writer.flush(snapshotter.snapshots)
+    return return_state
+
+
+@profiling.profiled
 def run(
     api_key: str,
     project_filter: str,
     batch_name: str,
     output_file_path: os.PathLike,
     retry_failed: Union[None, os.PathLike],
+    max_workers: int = 1,
+    engine: str = "threads",
+    http2: bool = False,
+    max_polls_per_second: float = scheduler.MAX_POLLS_PER_SECOND,
+    max_requests_per_second: float = throttle.MAX_REQUESTS_PER_SECOND,
+    journal_path: Optional[os.PathLike] = None,
+    resume_journal: Optional[os.PathLike] = None,
+    incremental_mode: bool = False,
+    longest_first: bool = False,
+    max_active_snapshots: int = 0,
+    adapt_active_snapshots: bool = False,
+    max_snapshot_retries: int = 0,
+    download_dir: Optional[os.PathLike] = None,
+    previous_report: Optional[os.PathLike] = None,
+    shard_index: int = 0,
+    shard_count: int = 1,
+    metrics_path: Optional[os.PathLike] = None,
+    prometheus_path: Optional[os.PathLike] = None,
+    project_index_path: Optional[os.PathLike] = None,
+    previous_project_index: Optional[os.PathLike] = None,
+    profile_dir: Optional[os.PathLike] = None,
 ) -> int:
     """
     Run the sitewide snapshot gear.
@@ -68,30 +626,142 @@ def run(
 
     Args:
         api_key: a flywheel instance api key
-        project_filter: the project filter to use
+        project_filter: the project filter to use, finder filters, project IDs and
+            lookup paths separated by ";"
         batch_name: the name of the snapshot batch
-        output_file_path: the path to save the snapshot report to
-        retry_failed: If set, the path to a snapshot report to retry failed snapshots
+        output_file_path: the path to save the snapshot report to, a .csv, .jsonl
+            or .parquet file
+        retry_failed: If set, the path to a snapshot report to retry failed
+            snapshots, in any of the report formats
+        max_workers: the number of snapshots to trigger concurrently
+        engine: "threads" to use `snapshot.Snapshotter`, or "asyncio" to use
+            `async_snapshot.AsyncSnapshotter`
+        http2: If True, the asyncio engine sends requests over HTTP/2 when it can
+        max_polls_per_second: the most snapshot status requests to send per second
+        max_requests_per_second: the most Flywheel API requests to send per second
+        journal_path: If set, the path to journal snapshots and status changes to
+        resume_journal: If set, the journal of a previous run to resume.  Projects
+            it already snapshotted are skipped and its unfinished snapshots polled
+        incremental_mode: If True, projects matching the filter are skipped, and
+            reported as "skipped", when unchanged since their last completed snapshot
+        longest_first: If True, snapshots of the projects matching the filter are
+            triggered longest expected first
+        max_active_snapshots: If set, the most snapshots left pending or in
+            progress at once.  The next project is triggered as soon as one
+            finishes
+        adapt_active_snapshots: If True, the most snapshots left unfinished at
+            once shrinks when snapshots fail, and grows back as they complete
+        max_snapshot_retries: the times a failed snapshot of a project is triggered
+            again within the run, after a growing backoff.  0 for no retries
+        download_dir: If set, the directory to download every snapshot to, as
+            soon as it completes
+        previous_report: If set, a snapshot report to find the last snapshot of each
+            project in, rather than asking the snapshot listing endpoint.  Also
+            gives the durations "longest_first" estimates snapshots from
+        shard_index: the shard of projects to snapshot, from 0 to `shard_count - 1`
+        shard_count: the number of gear jobs the projects are partitioned between
+        metrics_path: If set, the path to write the run's API call metrics to
+        prometheus_path: If set, the path to also write the metrics to in the
+            Prometheus text format
+        project_index_path: If set, the path to index the projects matching the
+            filter at, for later runs to reuse
+        previous_project_index: If set, the project index of a previous run.  Its
+            projects are cached, and enumerated instead of querying the finder if
+            it was made with the same filter and the run is not incremental
+        profile_dir: If set, the directory to write a profile of the run to
 
     Returns:
         0 if successful, 1 if not
 
     """
+    # Load the journal to resume before opening the new one, in case they're the same
+    resumed = journal.load_journal(resume_journal) if resume_journal else []
+    run_metrics = metrics.Metrics()
+    snapshotter_options = dict(
+        max_workers=max_workers,
+        max_requests_per_second=max_requests_per_second,
+        incremental=incremental_mode,
+        last_snapshots=load_last_snapshots(incremental_mode, previous_report),
+        shard_index=shard_index,
+        shard_count=shard_count,
+        estimator=load_estimator(longest_first, previous_report),
+        window=make_admission_window(max_active_snapshots, adapt_active_snapshots),
+        retry_queue=make_retry_queue(max_snapshot_retries),
+        run_metrics=run_metrics,
+        index=open_project_index(project_index_path),
+        snapshot_journal=journal.Journal(journal_path) if journal_path else None,
+        downloader=make_downloader(download_dir, api_key, max_workers, run_metrics),
+    )
+    run_options = dict(
+        project_filter=project_filter,
+        retry_failed=retry_failed,
+        output_file_path=output_file_path,
+        resumed=resumed,
+        previous_project_index=previous_project_index,
+        max_polls_per_second=max_polls_per_second,
+    )
+    if engine == "asyncio":
+        return asyncio.run(
+            run_async(
+                api_key,
+                batch_name,
+                snapshotter_options,
+                run_options,
+                metrics_path=metrics_path,
+                prometheus_path=prometheus_path,
+                http2=http2,
+            )
+        )
 
-    snapshotter = snapshot.Snapshotter(api_key, batch_name)
-
-    if retry_failed:
-        projects_to_retry = process_report_for_retry(
-            retry_failed, snapshotter.snapshot_client
+    if http2:
+        log.info("HTTP/2 is only used by the asyncio engine")
+    snapshotter = snapshot.Snapshotter(api_key, batch_name, **snapshotter_options)
+    return_state = 1
+    try:
+        return_state = snapshot_projects(snapshotter, **run_options)
+    finally:
+        return_state = finish_run(
+            snapshotter, return_state, metrics_path, prometheus_path
         )
-        if not projects_to_retry:
-            log.info("No failed snapshots to retry")
-            return 0
+    return return_state
+
+
+async def run_async(
+    api_key: str,
+    batch_name: str,
+    snapshotter_options: dict,
+    run_options: dict,
+    metrics_path: Optional[os.PathLike] = None,
+    prometheus_path: Optional[os.PathLike] = None,
+    http2: bool = False,
+) -> int:
+    """Run the sitewide snapshot gear on the asyncio engine
+
+    Args:
+        api_key: a flywheel instance api key
+        batch_name: the name of the snapshot batch
+        snapshotter_options: the options of the snapshotter, shared by both engines
+        run_options: the arguments of `snapshot_projects_async`
+        metrics_path: If set, the path to write the run's API call metrics to
+        prometheus_path: If set, the path to also write the metrics to in the
+            Prometheus text format
+        http2: If True, requests are sent over HTTP/2 when they can be
 
-        snapshotter.trigger_snapshots_on_list(projects_to_retry)
-    else:
-        snapshotter.trigger_snapshots_on_filter(project_filter)
+    Returns:
+        0 if successful, 1 if not
+    """
+    # Imported lazily so the threaded engine does not load httpx
+    from .snapshot import async_snapshot
 
-    return_state = wait_for_snapshots(snapshotter)
-    snapshotter.save_snapshot_report(output_file_path)
+    snapshotter = async_snapshot.AsyncSnapshotter(
+        api_key, batch_name, http2=http2, **snapshotter_options
+    )
+    return_state = 1
+    try:
+        async with snapshotter:
+            return_state = await snapshot_projects_async(snapshotter, **run_options)
+    finally:
+        return_state = finish_run(
+            snapshotter, return_state, metrics_path, prometheus_path
+        )
     return return_state
@@ -0,0 +1,48 @@
+"""Merges the snapshot reports of sharded gear runs into a single report.
+
+The merged report can be passed to the "retry failed" input of the gear:
+
+    python -m fw_gear_sitewide_snapshot.merge -o snapshot_report.csv shard_*.csv
+
+Reports of any format can be merged, into a report of the format of the output's
+extension.
+"""
+
+import argparse
+import logging
+import sys
+from typing import List, Optional
+
+from .snapshot import report
+
+log = logging.getLogger(__name__)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """Merges the reports given on the command line
+
+    Returns:
+        0 if successful, 1 if not
+    """
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("reports", nargs="+", help="the snapshot reports to merge")
+    parser.add_argument(
+        "-o",
+        "--output",
+        default="snapshot_report.csv",
+        help="the path of the merged report (default: %(default)s)",
+    )
+    args = parser.parse_args(argv)
+
+    try:
+        rows = report.merge_reports(args.reports, args.output)
+    except (OSError, ValueError) as e:
+        log.error(f"Unable to merge reports: {e}")
+        return 1
+    log.info(f"Merged {len(args.reports)} reports into {args.output}, {rows} rows")
+    return 0
+
+
+if __name__ == "__main__":  # pragma: no cover
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    sys.exit(main())
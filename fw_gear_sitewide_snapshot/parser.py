@@ -5,23 +5,25 @@ import os
 from flywheel_gear_toolkit import GearToolkitContext
 
 from . import utils
+from .snapshot import journal, metrics, project_index
 
 
 # This function mainly parses gear_context's config.json file and returns relevant
 # inputs and options.
 def parse_config(
     gear_context: GearToolkitContext,
-) -> (str, str, os.PathLike, str, str):
+) -> (str, str, os.PathLike, str, str, dict):
     """Parses necessary items out of the context object
 
     Args:
         gear_context (GearToolkitContext): The gear context object
     Returns:
-        project_filter (str): The project filter
+        project_filter (str): The project filter, one or more targets separated by ";"
         batch_name (str): The snapshot batch name
         retry_failed (os.Pathlike): Path of previous gear output report to retry failed snapshots on
         api_key (str): Flywheel API key
         save_file_out (str): Output path for the snapshot report
+        options (dict): Optional keyword arguments for `main.run`
 
     """
 
@@ -30,6 +32,40 @@ def parse_config(
     retry_failed = gear_context.get_input_path("retry failed")
     api_key = utils.get_api_key(gear_context.config_json)
     output_path = gear_context.output_dir
-    save_file_out = output_path / "snapshot_report.csv"
+    report_format = gear_context.config.get("report format", "csv")
+    save_file_out = output_path / f"snapshot_report.{report_format}"
+    options = {
+        "max_workers": gear_context.config.get("max workers", 1),
+        "engine": gear_context.config.get("engine", "threads"),
+        "http2": gear_context.config.get("http2", False),
+        "max_polls_per_second": gear_context.config.get("max polls per second", 10),
+        "max_requests_per_second": gear_context.config.get(
+            "max requests per second", 20
+        ),
+        "journal_path": output_path / journal.JOURNAL_FILENAME,
+        "resume_journal": gear_context.get_input_path("resume journal"),
+        "incremental_mode": gear_context.config.get("incremental", False),
+        "longest_first": gear_context.config.get("longest first", False),
+        "max_active_snapshots": gear_context.config.get("max active snapshots", 0),
+        "adapt_active_snapshots": gear_context.config.get(
+            "adapt active snapshots", False
+        ),
+        "max_snapshot_retries": gear_context.config.get("max snapshot retries", 0),
+        "download_dir": gear_context.config.get("download directory") or None,
+        "previous_report": gear_context.get_input_path("previous report"),
+        "shard_index": gear_context.config.get("shard index", 0),
+        "shard_count": gear_context.config.get("shard count", 1),
+        "metrics_path": output_path / metrics.METRICS_FILENAME,
+        "prometheus_path": (
+            output_path / metrics.PROMETHEUS_FILENAME
+            if gear_context.config.get("prometheus metrics", False)
+            else None
+        ),
+        "project_index_path": output_path / project_index.PROJECT_INDEX_FILENAME,
+        "previous_project_index": gear_context.get_input_path("project index"),
+        "profile_dir": (
+            output_path if gear_context.config.get("profile", False) else None
+        ),
+    }
 
-    return project_filter, batch_name, retry_failed, api_key, save_file_out
+    return project_filter, batch_name, retry_failed, api_key, save_file_out, options
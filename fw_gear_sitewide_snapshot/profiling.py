@@ -0,0 +1,176 @@
+"""Opt-in profiling of gear runs."""
+
+import collections
+import cProfile
+import functools
+import logging
+import os
+import pstats
+import sys
+import threading
+import tracemalloc
+from pathlib import Path
+from typing import Any, Callable, Optional
+
+log = logging.getLogger("GearProfiler")
+
+PSTATS_FILENAME = "profile.pstats"
+SUMMARY_FILENAME = "profile.txt"
+STACKS_FILENAME = "profile_stacks.txt"
+MEMORY_FILENAME = "profile_memory.txt"
+
+SAMPLE_INTERVAL = 0.01  # seconds
+TRACEMALLOC_FRAMES = 10
+TOP_FUNCTIONS = 50
+TOP_ALLOCATORS = 25
+# Growth in traced memory over the last allocation snapshot that takes another
+PEAK_GROWTH = 1.1
+
+
+class StackSampler(threading.Thread):
+    """Samples the stacks of every thread of the process at a fixed interval
+
+    `cProfile` only sees the thread it is enabled on, so the snapshot workers
+    of the threaded engine are profiled by sampling instead.  Stacks are counted
+    in the collapsed format read by flamegraph.pl and speedscope.
+
+    While tracemalloc is tracing, the allocations are also snapshotted whenever
+    the traced memory grows past `PEAK_GROWTH` times the last snapshot's, so that
+    `peak_memory` holds the allocations near the peak rather than at the end.
+
+    Params:
+        interval: the seconds between samples
+    """
+
+    def __init__(self, interval: float = SAMPLE_INTERVAL):
+        super().__init__(name="StackSampler", daemon=True)
+        self.interval = interval
+        self.stacks = collections.Counter()
+        self.peak_memory: Optional[tracemalloc.Snapshot] = None
+        self.peak_size = 0
+        self._stopped = threading.Event()
+
+    def run(self) -> None:
+        while not self._stopped.wait(self.interval):
+            self.sample()
+            self.sample_memory()
+
+    def sample(self) -> None:
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == self.ident:
+                continue
+            functions = []
+            while frame is not None:
+                code = frame.f_code
+                module = os.path.basename(code.co_filename)
+                functions.append(f"{module}:{code.co_name}:{frame.f_lineno}")
+                frame = frame.f_back
+            thread = names.get(ident, str(ident))
+            self.stacks[";".join([thread, *reversed(functions)])] += 1
+
+    def sample_memory(self) -> None:
+        """Snapshots the allocations if the traced memory grew well past the last"""
+        if not tracemalloc.is_tracing():
+            return
+        size, _ = tracemalloc.get_traced_memory()
+        if self.peak_memory is None or size > self.peak_size * PEAK_GROWTH:
+            self.peak_memory = tracemalloc.take_snapshot()
+            self.peak_size = size
+
+    def stop(self) -> None:
+        self._stopped.set()
+        self.join()
+        self.sample_memory()
+
+    def write(self, path: os.PathLike) -> None:
+        """Writes the sampled stacks, one "frame;frame;... count" line per stack"""
+        with open(path, "w", encoding="utf-8") as stacks_file:
+            for stack, count in self.stacks.most_common():
+                stacks_file.write(f"{stack} {count}\n")
+
+
+class Profiler:
+    """Profiles the block it wraps and writes the results to a directory
+
+    Writes:
+        profile.pstats: the `cProfile` stats of the calling thread, for
+            `pstats`, snakeviz and the like
+        profile.txt: the functions of the calling thread with the most
+            cumulative time
+        profile_stacks.txt: the sampled stacks of every thread, collapsed
+        profile_memory.txt: the peak traced memory and the top allocators
+            near it
+
+    Params:
+        output_dir: the directory to write the profile to
+        sample_interval: the seconds between stack samples
+    """
+
+    def __init__(
+        self, output_dir: os.PathLike, sample_interval: float = SAMPLE_INTERVAL
+    ):
+        self.output_dir = Path(output_dir)
+        self.profile = cProfile.Profile()
+        self.sampler = StackSampler(sample_interval)
+
+    def __enter__(self) -> "Profiler":
+        tracemalloc.start(TRACEMALLOC_FRAMES)
+        self.sampler.start()
+        self.profile.enable()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.profile.disable()
+        self.sampler.stop()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        try:
+            self.write(peak)
+        except OSError as e:
+            log.warning(f"Unable to write the profile to {self.output_dir}: {e}")
+
+    def write(self, peak: int) -> None:
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        self.profile.dump_stats(self.output_dir / PSTATS_FILENAME)
+        with open(self.output_dir / SUMMARY_FILENAME, "w", encoding="utf-8") as f:
+            stats = pstats.Stats(self.profile, stream=f)
+            stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(TOP_FUNCTIONS)
+        self.sampler.write(self.output_dir / STACKS_FILENAME)
+
+        # Allocations of this module and of tracemalloc itself are noise
+        memory = self.sampler.peak_memory.filter_traces(
+            [
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, __file__),
+            ]
+        )
+        with open(self.output_dir / MEMORY_FILENAME, "w", encoding="utf-8") as f:
+            f.write(f"Peak traced memory: {peak / 2**20:.1f} MiB\n\n")
+            f.write(
+                f"Top {TOP_ALLOCATORS} allocators at the highest sampled "
+                f"{self.sampler.peak_size / 2**20:.1f} MiB:\n"
+            )
+            for stat in memory.statistics("traceback")[:TOP_ALLOCATORS]:
+                f.write(f"\n{stat.size / 2**10:.1f} KiB in {stat.count} blocks\n")
+                f.write("\n".join(stat.traceback.format(most_recent_first=True)))
+                f.write("\n")
+        log.info(f"Wrote the run's profile to {self.output_dir}")
+
+
+def profiled(func: Callable[..., Any]) -> Callable[..., Any]:
+    """Profiles calls of a function given a `profile_dir` keyword argument
+
+    The argument is still passed on to the function.  Without it, or if it is
+    None, the function is called as is, so profiling costs nothing when off.
+    """
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        profile_dir: Optional[os.PathLike] = kwargs.get("profile_dir")
+        if profile_dir is None:
+            return func(*args, **kwargs)
+        with Profiler(profile_dir):
+            return func(*args, **kwargs)
+
+    return wrapper
@@ -0,0 +1,103 @@
+import logging
+import threading
+import time
+from typing import Callable
+
+from . import snapshot_utils
+
+log = logging.getLogger("SnapshotAdmission")
+
+# The longest polling sleeps while triggering in a window, so that the snapshots
+# just triggered are soon polled and free their room once they finish
+WINDOW_POLL_INTERVAL = 0.1  # seconds
+# Seconds a full window waits for a snapshot to finish before it stops holding
+# snapshots back, so that snapshots stuck on the server cannot stall the run
+STALL_TIMEOUT = 10 * 60
+
+
+class AdmissionWindow:
+    """A limit on the snapshots left unfinished on the server at once
+
+    A snapshot may only be triggered while fewer than `limit` snapshots are
+    pending or in progress, counting the ones being triggered.  With `adaptive`
+    set, the limit is cut by `decrease_factor` whenever a snapshot fails, and
+    grows back by one for every `limit` snapshots that complete, up to
+    `max_active`.  If the window stays full for `stall_timeout` seconds, snapshots
+    are let through until one finishes.  Thread-safe.
+
+    Params:
+        max_active: the most snapshots unfinished at once
+        adaptive: if True, the limit adapts to the snapshots that fail
+        min_active: the lowest the limit can shrink
+        decrease_factor: the multiplier applied to the limit when a snapshot fails
+        stall_timeout: the seconds the window stays full before it opens
+        clock: a monotonic clock returning seconds
+    """
+
+    def __init__(
+        self,
+        max_active: int,
+        adaptive: bool = False,
+        min_active: int = 1,
+        decrease_factor: float = 0.5,
+        stall_timeout: float = STALL_TIMEOUT,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.max_active = max(min_active, max_active)
+        self.adaptive = adaptive
+        self.min_active = min_active
+        self.decrease_factor = decrease_factor
+        self.limit = float(self.max_active)
+        # Snapshots being triggered, not yet counted as unfinished
+        self.admitting = 0
+        self.stall_timeout = stall_timeout
+        self.clock = clock
+        # When a snapshot was last admitted or finished
+        self._moved = clock()
+        self._stalled = False
+        self._lock = threading.Lock()
+
+    def try_admit(self, active: int) -> bool:
+        """Lets one more snapshot be triggered if there is room, returning True if so
+
+        Args:
+            active: the snapshots currently unfinished
+        """
+        with self._lock:
+            if active + self.admitting < int(self.limit):
+                self._moved = self.clock()
+            elif not self._is_stalled():
+                return False
+            self.admitting += 1
+            return True
+
+    def _is_stalled(self) -> bool:
+        if self.clock() - self._moved < self.stall_timeout:
+            return False
+        if not self._stalled:
+            log.warning(
+                f"No snapshot finished in {self.stall_timeout} seconds, triggering "
+                "snapshots without waiting for room in the window"
+            )
+            self._stalled = True
+        return True
+
+    def release(self) -> None:
+        """Marks an admitted snapshot as triggered, or as failing to trigger"""
+        with self._lock:
+            self.admitting -= 1
+
+    def record_final(self, status: snapshot_utils.SnapshotState) -> None:
+        """Moves the window on, adjusting its limit to the state a snapshot reached"""
+        with self._lock:
+            self._moved = self.clock()
+            self._stalled = False
+            if not self.adaptive:
+                return
+            previous = int(self.limit)
+            if status == snapshot_utils.SnapshotState.failed:
+                self.limit = max(self.min_active, self.limit * self.decrease_factor)
+            elif status == snapshot_utils.SnapshotState.complete:
+                self.limit = min(self.max_active, self.limit + 1 / self.limit)
+            if int(self.limit) != previous:
+                log.debug(f"Allowing {int(self.limit)} unfinished snapshots")
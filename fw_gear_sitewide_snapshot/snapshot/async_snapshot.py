@@ -0,0 +1,487 @@
+import asyncio
+import functools
+import logging
+import time
+from typing import AsyncIterator, Iterable, List, Optional, Tuple, Union
+
+import httpx
+from fw_client.config import FWClientConfig
+
+from . import (
+    base,
+    incremental,
+    metrics,
+    pipeline,
+    project_index,
+    snapshot_store,
+    snapshot_utils,
+    targets,
+    transport,
+)
+
+log = logging.getLogger("TriggerSnapshotsAsync")
+
+FINDER_PAGE_SIZE = 250
+LEAN_FINDER_HEADERS = {
+    "X-Accept-Feature": ", ".join(project_index.LEAN_FINDER_FEATURES)
+}
+
+
+class AsyncSnapshotter(base.BaseSnapshotter):
+    """An asyncio version of `snapshot.Snapshotter`
+
+    Every trigger and status request is multiplexed on a single event loop through
+    one `httpx.AsyncClient`, with at most `max_workers` requests in flight.
+
+    Params:
+        api_key: a flywheel api key
+        batch_name: a name to associate with this batch of snapshots
+        http2: if True, requests are multiplexed over HTTP/2 connections, when the
+            h2 package is installed
+        options: the options of `base.BaseSnapshotter`
+    """
+
+    def __init__(self, api_key: str, batch_name="", http2: bool = False, **options):
+        super().__init__(batch_name, **options)
+        config = FWClientConfig(
+            api_key=api_key,
+            client_name="Snapshotter",
+            client_version="0.1",
+        )
+        if http2 and not transport.http2_available():
+            log.warning("HTTP/2 needs the h2 package, falling back to HTTP/1.1")
+            http2 = False
+        # Every connection a worker may need is kept alive between its requests
+        pool_size = transport.pool_size(self.max_workers)
+        self.client = httpx.AsyncClient(
+            base_url=config.baseurl,
+            headers={"Authorization": f"scitran-user {config.api_key}"},
+            timeout=httpx.Timeout(
+                transport.READ_TIMEOUT, connect=transport.CONNECT_TIMEOUT
+            ),
+            limits=httpx.Limits(
+                max_connections=pool_size, max_keepalive_connections=pool_size
+            ),
+            http2=http2,
+        )
+        self.connections = transport.ConnectionStats()
+        self.snapshot_url = config.snapshot_url or config.baseurl
+        # Wakes the triggers waiting for room in the admission window, made on
+        # first use so that it belongs to the running event loop
+        self._window_moved: Optional[asyncio.Condition] = None
+        self._waiting_for_admission = 0
+
+    async def __aenter__(self) -> "AsyncSnapshotter":
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.aclose()
+
+    async def aclose(self) -> None:
+        """Closes the underlying HTTP client"""
+        await self.client.aclose()
+
+    async def request(
+        self, endpoint: str, method: str, url: str, **kwargs
+    ) -> Union[dict, list]:
+        """Sends a request once the throttle allows it and returns the JSON body
+
+        Args:
+            endpoint: the name of the endpoint, for the metrics
+            method: the HTTP method
+            url: the URL, absolute or relative to the site
+            kwargs: the `httpx.AsyncClient.request` options
+        """
+        send = self.metrics.timed_async(endpoint, self._send)
+        response = await self.throttle.call_async(send, method, url, **kwargs)
+        return response.json() if response.content else None
+
+    async def _send(self, method: str, url: str, **kwargs) -> httpx.Response:
+        response = await self.client.request(
+            method, url, extensions={"trace": self.connections.trace}, **kwargs
+        )
+        response.raise_for_status()
+        return response
+
+    def connection_stats(self) -> dict:
+        """Returns the connections opened and the requests sent over them"""
+        return self.connections.to_dict()
+
+    async def trigger_snapshots_on_list(self, projects: List) -> None:
+        """Trigger snapshots on a list of project ids
+
+        Args:
+            projects: a list of project ids
+        """
+        projects = [p for p in projects if self.wanted(p)]
+        await self.run_concurrently(self.make_snapshot_on_id, projects)
+
+    async def trigger_snapshots_on_filter(self, project_filter) -> None:
+        """Trigger snapshots on projects matching a filter
+
+        The filter may have several targets, finder filters, project IDs and
+        lookup paths, separated by semicolons.  A project matched by more than one
+        is snapshotted once.
+
+        Args:
+            project_filter: the filter to use
+        """
+        plan = targets.plan_targets(project_filter)
+
+        async def projects() -> AsyncIterator[dict]:
+            async for project in self.find_projects(plan):
+                if self.wanted(project.get("_id")):
+                    yield project
+
+        if self.estimator:
+            ordered = self.order_longest_first([p async for p in projects()])
+            found = pipeline.iterate_async(ordered)
+        else:
+            found = projects()
+        # Finder pages are fetched while the workers trigger snapshots, with a
+        # bounded number of projects held at once, unless they are ordered
+        await pipeline.drain(
+            found,
+            functools.partial(self._call_and_record_errors, self.trigger_on_found),
+            self.max_workers,
+        )
+        self.log_triggered()
+
+    async def trigger_on_found(self, project: dict) -> None:
+        """Triggers a snapshot on a project from the finder, unless it is skipped"""
+        if self.incremental and await self.skip_if_unchanged(project):
+            return
+        log.debug(f"Filter triggered snapshot on project {project.get('label')}")
+        await self.make_snapshot_on_project(project)
+
+    async def last_snapshot(
+        self, project_id: str
+    ) -> Optional[snapshot_utils.SnapshotRecord]:
+        """Returns the last completed snapshot of a project, None if it has none"""
+        if self.last_snapshots is not None:
+            return self.last_snapshots.get(project_id)
+        snapshots = await self.request(
+            metrics.LIST_SNAPSHOTS,
+            "GET",
+            f"{self.snapshot_url}/snapshot/projects/{project_id}/snapshots",
+        )
+        return incremental.parse_snapshot_list(snapshots)
+
+    async def skip_if_unchanged(self, project: dict) -> bool:
+        """Records a project as skipped if it is unchanged since its last snapshot
+
+        Returns:
+            True if the project was skipped, False if it needs a snapshot
+        """
+        if incremental.modified_time(project) is None:
+            return False
+        last_snapshot = await self.last_snapshot(project.get("_id"))
+        return self.skip_unchanged(project, last_snapshot)
+
+    def find_projects(self, plan: targets.TargetPlan) -> AsyncIterator[dict]:
+        """Returns the projects of a plan's targets, recording them in the index
+
+        Each filter is queried in turn, then the projects given by ID or path that
+        no filter found are resolved, and every project is returned once.  The
+        projects of a previous run's index are reused if it was made with the
+        same targets, rather than querying the finder.
+
+        Args:
+            plan: the filters and projects to find
+        """
+        reused = self.reused_projects(plan)
+        if reused is None:
+            found = self.match_targets(plan)
+        else:
+            found = pipeline.iterate_async(reused)
+        if self.index:
+            found = self.index.record_async(found, plan.key, self.indexed_targets(plan))
+        return found
+
+    async def match_targets(self, plan: targets.TargetPlan) -> AsyncIterator[dict]:
+        """Yields the projects of a plan's targets, each for the first that matched"""
+        async for target, project in self.query_targets(plan):
+            if self.matches.match(project, target):
+                yield project
+
+    async def query_targets(
+        self, plan: targets.TargetPlan
+    ) -> AsyncIterator[Tuple[str, dict]]:
+        """Yields the projects of each target of a plan, with the target
+
+        A project given by ID or path is only resolved if no target before it
+        matched the project.
+        """
+        for project_filter in plan.filters:
+            async for project in self.iter_find(project_filter):
+                yield project_filter, project
+        for target in self.targets_to_resolve(plan):
+            project = await self.resolve_project(target)
+            if project is not None:
+                yield target, project
+
+    async def resolve_project(self, target: str) -> Optional[dict]:
+        """Gets a project given by ID or lookup path
+
+        An error is logged and recorded in `self.errors`, like an error
+        triggering a snapshot.
+
+        Returns:
+            the project, None if it could not be found
+        """
+        try:
+            if snapshot_utils.string_matches_id(target):
+                return await self.get_project(target)
+            return await self.lookup(target)
+        except Exception as e:
+            log.error(f"Unable to find project {target}: {e}")
+            self.record_error(target, e)
+            return None
+
+    async def iter_find(self, project_filter: str) -> AsyncIterator[dict]:
+        """Yields the projects matching a finder filter, one page at a time
+
+        Args:
+            project_filter: the filter to use
+        """
+        params = {"limit": FINDER_PAGE_SIZE}
+        if project_filter:
+            params["filter"] = project_filter
+        if self.estimator:
+            # The size of each project, to estimate its snapshot by
+            params["stats"] = "true"
+        while True:
+            results = await self.request(
+                metrics.FIND,
+                "GET",
+                "/api/projects",
+                params=params,
+                headers=LEAN_FINDER_HEADERS,
+            )
+            if isinstance(results, dict):
+                results = results.get("results", [])
+            if not results:
+                break
+            for project in results:
+                yield project
+            params["after_id"] = results[-1]["_id"]
+
+    async def run_concurrently(self, func, items) -> None:
+        """Awaits a coroutine function on every item, recording errors per item
+
+        At most `max_workers` items are processed at once, like the worker
+        threads of `snapshot.Snapshotter`, rather than a coroutine per item.
+
+        Args:
+            func: the coroutine function to call on each item
+            items: the items to call the function on
+        """
+        await pipeline.drain(
+            pipeline.iterate_async(items),
+            functools.partial(self._call_and_record_errors, func),
+            self.max_workers,
+        )
+
+    async def _call_and_record_errors(self, func, item) -> None:
+        """Awaits a coroutine function on an item, logging and recording any error"""
+        try:
+            await func(item)
+        except Exception as e:
+            self.log_error(item, e)
+
+    async def get_project(self, project_id: str) -> dict:
+        """Gets a project by ID"""
+        return await self.request(
+            metrics.GET_PROJECT, "GET", f"/api/projects/{project_id}"
+        )
+
+    async def lookup(self, path: str) -> dict:
+        """Resolves a group/project path to a project"""
+        return await self.request(
+            metrics.LOOKUP, "POST", "/api/lookup", json={"path": path.split("/")}
+        )
+
+    async def make_snapshot_on_project(self, project: Union[str, dict]) -> dict:
+        """Make a snapshot on a project
+
+        Args:
+            project: the project to make a snapshot on.  Can be a project ID, a project
+                lookup path, or a project dict from the finder.
+
+        Returns:
+            the snapshot response
+        """
+        if isinstance(project, str):
+            if snapshot_utils.string_matches_id(project):
+                if project in self.projects:
+                    return await self.make_snapshot_on_id(project)
+                # Ensure the project exists before snapshotting it
+                project = await self.get_project(project)
+            else:
+                project = await self.lookup(project)
+
+        return await self.make_snapshot_on_id(self.remember_project(project))
+
+    async def make_snapshot_on_id(self, project_id: str) -> dict:
+        """Make a snapshot on a project given a project ID
+
+        Args:
+            project_id: the ID of the project
+
+        Returns:
+            the snapshot response
+        """
+        log.debug(f"creating snapshot on {project_id}")
+        await self.wait_for_admission()
+        try:
+            response = await self.trigger(project_id)
+            await self.log_snapshot(response)
+        finally:
+            self.release_admission()
+        return response
+
+    async def trigger(self, project_id: str) -> dict:
+        """Sends the request triggering a snapshot on a project"""
+        return await self.request(
+            metrics.TRIGGER,
+            "POST",
+            f"{self.snapshot_url}/snapshot/projects/{project_id}/snapshots",
+        )
+
+    async def wait_for_admission(self) -> None:
+        """Waits until the admission window has room for one more snapshot
+
+        Like `snapshot.Snapshotter.wait_for_admission`.
+        """
+        if self.window is None:
+            return
+        if self._window_moved is None:
+            self._window_moved = asyncio.Condition()
+        waiting = time.monotonic()
+        async with self._window_moved:
+            self._waiting_for_admission += 1
+            try:
+                while not self.try_admit():
+                    try:
+                        await asyncio.wait_for(
+                            self._window_moved.wait(), self.window.stall_timeout
+                        )
+                    except asyncio.TimeoutError:
+                        pass
+            finally:
+                self._waiting_for_admission -= 1
+        self.metrics.increment("window_wait_seconds", time.monotonic() - waiting)
+
+    def window_moved(self) -> None:
+        """Wakes the triggers waiting for room in the admission window
+
+        Notifying takes the condition's lock, so it is left to a task of its own.
+        """
+        if self._waiting_for_admission:
+            asyncio.get_running_loop().create_task(self._notify_window_moved())
+
+    async def _notify_window_moved(self) -> None:
+        async with self._window_moved:
+            self._window_moved.notify_all()
+
+    async def log_snapshot(
+        self,
+        response: dict,
+        retrying: Optional[snapshot_store.CompactSnapshot] = None,
+    ) -> None:
+        """Logs a snapshot response and adds it to the snapshot list
+
+        Args:
+            response: the response from the flywheel API
+            retrying: the failed snapshot this snapshot retries, if any
+        """
+        record = snapshot_utils.SnapshotRecord(**response)
+        project = self.projects.get(record.project_id)
+        if project is None:
+            project = self.projects.add(await self.get_project(record.project_id))
+        self.add_snapshot(record, project, retrying)
+
+    async def update_snapshot(self, record: base.Snapshot) -> None:
+        """Fetches the status of a single snapshot and updates it in place
+
+        Errors are logged and leave the status unchanged, so that the snapshot is
+        simply checked again on the next poll.
+        """
+        detail = await self.fetch_status(record)
+        if detail is not None:
+            self.record_status(record, detail.status, detail.finished)
+
+    async def refresh_statuses(
+        self, records: List[snapshot_utils.SnapshotRecord]
+    ) -> None:
+        """Fetches the status of snapshots that are not part of this run
+
+        Like `snapshot.Snapshotter.refresh_statuses`.
+        """
+        await self.run_concurrently(self.refresh_status, records)
+
+    async def refresh_status(self, record: snapshot_utils.SnapshotRecord) -> None:
+        """Sets the status of a snapshot that is not part of this run"""
+        detail = await self.fetch_status(record)
+        if detail is not None:
+            record.status = detail.status
+
+    async def fetch_status(
+        self, record: base.Snapshot
+    ) -> Optional[snapshot_utils.SnapshotStatus]:
+        """Returns the status of a snapshot, None if it could not be fetched"""
+        try:
+            detail = await self.request(
+                metrics.STATUS,
+                "GET",
+                f"{self.snapshot_url}/snapshot/projects/{record.project_id}"
+                f"/snapshots/{record.id}/detail",
+                timeout=snapshot_utils.STATUS_REQUEST_TIMEOUT,
+            )
+        except Exception as e:
+            log.warning(f"Unable to update the status of snapshot {record.id}: {e}")
+            return None
+        return snapshot_utils.SnapshotStatus.parse_obj(detail)
+
+    async def retry_failed_snapshots(self) -> int:
+        """Triggers again the failed snapshots whose backoff has passed
+
+        Returns:
+            the number of snapshots retried
+        """
+        due = self.admit_retries()
+        await self.run_concurrently(self.retry_snapshot, due)
+        return len(due)
+
+    async def retry_snapshot(self, record: snapshot_store.CompactSnapshot) -> None:
+        """Triggers a new snapshot on the project of a failed snapshot
+
+        The new snapshot takes the place of the failed one in the snapshot list.
+        The window must have admitted it.  A trigger request that fails counts as
+        an attempt, and is retried again after a backoff while attempts are left.
+
+        Args:
+            record: the failed snapshot
+        """
+        try:
+            try:
+                response = await self.trigger(record.project_id)
+            except Exception as e:
+                if self.retry_again(record, e):
+                    return
+                raise
+            await self.log_snapshot(response, retrying=record)
+        finally:
+            self.release_admission()
+
+    async def update_snapshots(
+        self, snapshots: Optional[Iterable[base.Snapshot]] = None
+    ) -> None:
+        """Fetches updates on the status of the snapshots in the snapshot list and updates them in place
+
+        Args:
+            snapshots: the snapshots to update, defaults to every unfinished snapshot
+        """
+        await asyncio.gather(
+            *(self.update_snapshot(s) for s in self.snapshots_to_update(snapshots))
+        )
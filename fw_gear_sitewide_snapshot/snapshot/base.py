@@ -0,0 +1,443 @@
+import datetime
+import logging
+import math
+import os
+import threading
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Mapping,
+    Optional,
+    Union,
+)
+
+from . import (
+    admission,
+    download,
+    incremental,
+    journal,
+    metrics,
+    ordering,
+    project_cache,
+    project_index,
+    report,
+    retry,
+    shard,
+    snapshot_store,
+    snapshot_utils,
+    targets,
+    throttle,
+)
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+log = logging.getLogger("TriggerSnapshots")
+
+Snapshot = Union[snapshot_utils.SnapshotRecord, snapshot_store.CompactSnapshot]
+
+
+class BaseSnapshotter:
+    """The state and bookkeeping shared by the snapshotters of both engines
+
+    `snapshot.Snapshotter` calls the Flywheel API on worker threads, and
+    `async_snapshot.AsyncSnapshotter` on an event loop.  Everything else, which
+    projects are triggered, the snapshot list, the journal, the admission window
+    and the retries, is kept here.
+
+    Params:
+        batch_name: a name to associate with this batch of snapshots
+        max_workers: the number of projects to trigger snapshots on, or snapshots
+            to refresh the status of, concurrently
+        max_requests_per_second: the most Flywheel API requests to send per second
+        snapshot_journal: if set, the journal to record snapshots and status changes in
+        incremental: if True, projects matching a filter are skipped when unchanged
+            since their last completed snapshot
+        last_snapshots: the last completed snapshot of each project, by project ID,
+            from a previous report.  If not set, incremental runs get them from the
+            snapshot listing endpoint
+        shard_index: the shard of projects this snapshotter triggers snapshots on
+        shard_count: the number of shards the projects are partitioned into
+        run_metrics: the metrics to record API calls in, a new one if not set
+        index: if set, the index to record the projects found by the finder in
+        estimator: if set, projects matching a filter are triggered longest
+            expected snapshot first, as estimated by it
+        window: if set, the limit on the snapshots left unfinished at once.  The
+            snapshots must be polled while triggering, for the window to move
+        retry_queue: if set, the queue of failed snapshots to trigger again, within
+            its retry budget
+        downloader: if set, downloads every snapshot as soon as it completes
+    """
+
+    def __init__(
+        self,
+        batch_name="",
+        max_workers: int = 1,
+        max_requests_per_second: float = throttle.MAX_REQUESTS_PER_SECOND,
+        snapshot_journal: Optional[journal.Journal] = None,
+        incremental: bool = False,
+        last_snapshots: Optional[Dict[str, snapshot_utils.SnapshotRecord]] = None,
+        shard_index: int = 0,
+        shard_count: int = 1,
+        run_metrics: Optional[metrics.Metrics] = None,
+        index: Optional[project_index.ProjectIndex] = None,
+        estimator: Optional[ordering.CostEstimator] = None,
+        window: Optional[admission.AdmissionWindow] = None,
+        retry_queue: Optional[retry.RetryQueue] = None,
+        downloader: Optional[download.SnapshotDownloader] = None,
+    ):
+        shard.validate_shard(shard_index, shard_count)
+        self.batch_name = batch_name
+        self.max_workers = max(1, max_workers)
+        self.metrics = run_metrics or metrics.Metrics()
+        # Shared by every API call so that rate limits apply across workers
+        self.throttle = throttle.Throttle(
+            max_requests_per_second=max_requests_per_second,
+            max_concurrency=self.max_workers,
+            metrics=self.metrics,
+        )
+        # Project labels and groups, shared by the finder, validation and logging
+        self.projects = project_cache.ProjectCache()
+        self.snapshots = snapshot_store.SnapshotStore()
+        self.journal = snapshot_journal
+        # Projects already snapshotted by the run being resumed
+        self.resumed_projects = set()
+        self.incremental = incremental
+        self.last_snapshots = last_snapshots
+        self.shard_index = shard_index
+        self.shard_count = shard_count
+        self.index = index
+        # The projects of a previous run's index, and the filter they matched
+        self.indexed_filter = None
+        self.indexed_projects = []
+        self.estimator = estimator
+        # The seconds the snapshot of each project is expected to take
+        self.estimates = {}
+        # The target of the project filter that matched each project
+        self.matches = targets.ProjectMatches()
+        self.window = window
+        self.retry_queue = retry_queue
+        self.downloader = downloader
+        # Projects that a snapshot could not be triggered on, and the error raised
+        self.errors = []
+        self._lock = threading.Lock()
+
+    def in_shard(self, project_id: str) -> bool:
+        """Returns True if a project belongs to this snapshotter's shard"""
+        return shard.project_in_shard(project_id, self.shard_index, self.shard_count)
+
+    def wanted(self, project_id: str) -> bool:
+        """Returns True if a project is to be snapshotted by this snapshotter
+
+        Projects of other shards, and projects the resumed run already
+        snapshotted, are not.
+        """
+        if project_id in self.resumed_projects:
+            log.debug(f"Skipping project {project_id}, snapshot already triggered")
+            return False
+        return self.in_shard(project_id)
+
+    def use_project_index(self, indexed_filter: str, projects: List[dict]) -> None:
+        """Caches the projects of a previous run's index, for reuse by the finder
+
+        Args:
+            indexed_filter: the filter the indexed projects matched
+            projects: the indexed projects
+        """
+        for project in projects:
+            self.projects.add(project)
+        self.indexed_filter = indexed_filter
+        self.indexed_projects = projects
+
+    def reused_projects(self, plan: targets.TargetPlan) -> Optional[Iterator[dict]]:
+        """Returns the projects of a previous run's index, if it has a plan's targets
+
+        Returns:
+            the indexed projects, or None if the finder must be queried
+        """
+        if not project_index.reusable(self.indexed_filter, plan.key, self.incremental):
+            return None
+        log.info(f"Reusing the {len(self.indexed_projects)} indexed projects")
+        return self.matches.restore(self.indexed_projects, plan.key)
+
+    def indexed_targets(self, plan: targets.TargetPlan) -> Optional[Mapping[str, str]]:
+        """Returns the target of each project to index, if the plan has several"""
+        return self.matches.targets if plan.is_batch() else None
+
+    def targets_to_resolve(self, plan: targets.TargetPlan) -> Iterator[str]:
+        """Yields the projects given by ID or path that no target before matched
+
+        Only read once the plan's filters were queried.
+        """
+        for target in plan.projects:
+            if self.matches.covers(target):
+                log.debug(f"Project {target} was already found")
+                continue
+            yield target
+
+    def order_longest_first(self, projects: Iterable) -> List:
+        """Returns projects in the order to trigger them, longest expected first
+
+        Every project is found before the first one is triggered.
+
+        Args:
+            projects: the projects from the finder
+        """
+        projects = list(projects)
+        self.estimates = self.estimator.estimate(projects)
+        return ordering.longest_first(projects, self.estimates)
+
+    def log_triggered(self) -> None:
+        """Logs the projects of a filter that were not triggered"""
+        self.matches.log_duplicates()
+        if self.incremental:
+            skipped = self.snapshots.count(snapshot_utils.SnapshotState.skipped)
+            log.info(f"Skipped {skipped} projects unchanged since their last snapshot")
+
+    def skip_unchanged(
+        self, project: Any, last_snapshot: Optional[snapshot_utils.SnapshotRecord]
+    ) -> bool:
+        """Records a project as skipped if it is unchanged since its last snapshot
+
+        Args:
+            project: a project from the finder
+            last_snapshot: the last completed snapshot of the project, if any
+
+        Returns:
+            True if the project was skipped, False if it needs a snapshot
+        """
+        if not incremental.is_unchanged(project, last_snapshot):
+            return False
+
+        info = self.projects.add(project)
+        record = incremental.skipped_record(last_snapshot, self.batch_name)
+        record.project_label = info.label
+        record.group_label = info.group
+        log.debug(f"Skipping project {info.label}, unchanged since its last snapshot")
+        self.add_record(record)
+        return True
+
+    def record_error(self, item: Any, error: Exception) -> None:
+        """Records a project that a snapshot could not be triggered on"""
+        with self._lock:
+            self.errors.append((item, error))
+
+    def log_error(self, item: Any, error: Exception) -> None:
+        """Logs and records an error triggering a snapshot on a project"""
+        label = item.get("label") if hasattr(item, "get") else item
+        log.error(f"Unable to trigger snapshot on project {label}: {error}")
+        self.record_error(item, error)
+
+    def remember_project(self, project: Any) -> str:
+        """Caches a project about to be snapshotted
+
+        Args:
+            project: an SDK project or a project dict, either way with an "_id"
+
+        Returns:
+            the ID of the project
+        """
+        project_id = project.get("_id")
+
+        if not project_id:
+            raise ValueError(f"no project ID found for project {project}")
+
+        self.projects.add(project)
+        return project_id
+
+    def add_snapshot(
+        self,
+        record: snapshot_utils.SnapshotRecord,
+        project: project_cache.ProjectInfo,
+        retrying: Optional[snapshot_store.CompactSnapshot] = None,
+    ) -> None:
+        """Labels a newly triggered snapshot and adds it to the snapshot list
+
+        Args:
+            record: the snapshot
+            project: the project of the snapshot
+            retrying: the failed snapshot this snapshot retries, if any
+        """
+        record.project_label = project.label
+        record.group_label = project.group
+        record.batch_label = self.batch_name
+        if retrying is not None:
+            record.attempt = retrying.attempt + 1
+            record.history = [*retrying.history, retrying.id]
+        self.add_record(record, replaces=retrying)
+
+    def add_record(
+        self,
+        record: snapshot_utils.SnapshotRecord,
+        replaces: Optional[snapshot_store.CompactSnapshot] = None,
+    ) -> None:
+        """Adds a snapshot record to the snapshot list and the journal
+
+        Args:
+            record: the snapshot
+            replaces: the failed snapshot it retries, which it takes the place of
+        """
+        if record.estimated_seconds is None:
+            record.estimated_seconds = self.estimates.get(record.project_id)
+        if not record.matched_filter:
+            record.matched_filter = self.matches.get(record.project_id)
+        if replaces is None:
+            self.snapshots.add(record)
+        else:
+            self.snapshots.replace(replaces, record)
+        if self.journal:
+            self.journal.record_snapshot(record)
+
+    def resume(self, records: Iterable[snapshot_utils.SnapshotRecord]) -> None:
+        """Resumes a previous run from the snapshots it journaled
+
+        The projects of these snapshots are not snapshotted again, and only the
+        unfinished snapshots are polled.
+
+        Args:
+            records: the snapshots loaded from the previous run's journal
+        """
+        for record in records:
+            self.projects.add(
+                {
+                    "_id": record.parents.project,
+                    "label": record.project_label,
+                    "group": record.group_label,
+                }
+            )
+            self.resumed_projects.add(record.parents.project)
+            self.snapshots.add(record)
+            if (
+                self.downloader
+                and record.status == snapshot_utils.SnapshotState.complete
+            ):
+                self.downloader.submit(record)
+            if self.journal:
+                self.journal.record_snapshot(record)
+        log.info(f"Resumed {len(self.resumed_projects)} previously triggered snapshots")
+
+    def snapshots_to_update(
+        self, snapshots: Optional[Iterable[Snapshot]] = None
+    ) -> List[Snapshot]:
+        """Returns the unfinished snapshots to poll, of every snapshot if not given"""
+        if snapshots is None:
+            snapshots = self.snapshots.pending()
+        return [s for s in snapshots if not s.is_final()]
+
+    def record_status(
+        self,
+        record: Snapshot,
+        status: snapshot_utils.SnapshotState,
+        finished: Optional[datetime.datetime] = None,
+    ) -> None:
+        """Sets the status of a snapshot, journaling it and moving the window
+
+        Args:
+            record: the snapshot
+            status: its new status
+            finished: when the snapshot finished, if the server says
+        """
+        if not self.snapshots.set_status(record, status, finished):
+            return
+        if self.journal:
+            self.journal.record_status(record)
+        if self.window and status.is_final():
+            self.window.record_final(status)
+            self.window_moved()
+        if self.downloader and status == snapshot_utils.SnapshotState.complete:
+            self.downloader.submit(record)
+        if (
+            self.retry_queue is not None
+            and status == snapshot_utils.SnapshotState.failed
+            and isinstance(record, snapshot_store.CompactSnapshot)
+            and self.retry_queue.offer(record)
+        ):
+            self.metrics.increment("snapshot_retries")
+            log.info(
+                f"Snapshot {record.id} on project {record.project_id} failed, "
+                f"retrying it (attempt {record.attempt + 1})"
+            )
+
+    def try_admit(self) -> bool:
+        """Returns True if the admission window has room for one more snapshot
+
+        The snapshot takes the room, which `release_admission` gives back once it
+        was triggered.
+        """
+        if self.window is None:
+            return True
+        return self.window.try_admit(self.snapshots.pending_count())
+
+    def release_admission(self) -> None:
+        """Gives back the room a snapshot took in the admission window"""
+        if self.window:
+            self.window.release()
+            self.window_moved()
+
+    def window_moved(self) -> None:
+        """Wakes the triggers waiting for room in the admission window
+
+        Called whenever a snapshot finishes or gives back its room, so that each
+        engine can wake its waiting triggers the way it waits.
+        """
+
+    def admit_retries(self) -> List[snapshot_store.CompactSnapshot]:
+        """Returns the failed snapshots to trigger again, now their backoff passed
+
+        A retry does not wait for room in the admission window, which only moves
+        as snapshots are polled, but is postponed until there is room.
+        """
+        if self.retry_queue is None:
+            return []
+        due = []
+        for record in self.retry_queue.pop_due():
+            if self.try_admit():
+                due.append(record)
+            else:
+                self.retry_queue.postpone(record)
+        return due
+
+    def retry_again(
+        self, record: snapshot_store.CompactSnapshot, error: Exception
+    ) -> bool:
+        """Queues a retry again after its trigger failed, if retries are left
+
+        Returns:
+            True if the snapshot will be retried
+        """
+        if not self.retry_queue.offer_again(record):
+            return False
+        log.warning(
+            f"Unable to retry snapshot {record.id} on project {record.project_id}, "
+            f"retrying it later: {error}"
+        )
+        return True
+
+    def next_retry_in(self) -> float:
+        """Returns the seconds until the next failed snapshot is retried"""
+        if self.retry_queue is None:
+            return math.inf
+        return self.retry_queue.next_retry_in()
+
+    def is_finished(self) -> bool:
+        """Returns True if all snapshots are finished, False otherwise
+
+        Failed snapshots waiting for a retry are not finished.
+        """
+        if self.retry_queue is not None and len(self.retry_queue):
+            return False
+        return self.snapshots.pending_count() == 0
+
+    def save_snapshot_report(self, report_path: os.PathLike) -> None:
+        """Saves the snapshot report to a CSV file"""
+        report.write_report(self.snapshots, report_path)
+
+    def reports_to_df(self) -> "pd.DataFrame":
+        """Converts the snapshot reports to a dataframe"""
+        import pandas as pd
+
+        return pd.DataFrame([s.to_row() for s in self.snapshots])
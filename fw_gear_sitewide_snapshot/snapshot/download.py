@@ -0,0 +1,222 @@
+import base64
+import hashlib
+import logging
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import TYPE_CHECKING, List, Optional, Tuple
+
+from . import metrics, snapshot_utils, transport
+
+if TYPE_CHECKING:
+    from fw_client import FWClient
+    from requests import Response
+
+log = logging.getLogger("SnapshotDownloads")
+
+# Bytes read from a download, and hashed, at a time
+CHUNK_SIZE = 1024 * 1024
+PART_SUFFIX = ".part"
+CHECKSUM_SUFFIX = ".sha256"
+SNAPSHOT_SUFFIX = ".snapshot"
+
+
+class ChecksumError(Exception):
+    """A downloaded snapshot does not match the checksum the server sent"""
+
+
+def download_endpoint(project_id: str, snapshot_id: str) -> str:
+    return f"/snapshot/projects/{project_id}/snapshots/{snapshot_id}/download"
+
+
+def make_client(api_key: str, max_workers: int) -> "FWClient":
+    """Returns a FWClient for downloads, with a pool of its own
+
+    Downloads hold their connection for as long as they stream, so they do not
+    share the pool of the requests that trigger and poll snapshots.
+    """
+    from fw_client import FWClient
+
+    client = FWClient(
+        api_key=api_key,
+        client_name="SnapshotDownloader",
+        client_version="0.1",
+        connect_timeout=transport.CONNECT_TIMEOUT,
+        read_timeout=transport.READ_TIMEOUT,
+    )
+    transport.SharedTransport(max_workers).mount(client)
+    return client
+
+
+def expected_sha256(response: "Response") -> Optional[str]:
+    """Returns the hex SHA-256 of the whole snapshot, from a `Digest` header
+
+    Args:
+        response: a download response, with e.g. `Digest: sha-256=<base64>`
+    """
+    for digest in response.headers.get("Digest", "").split(","):
+        algorithm, _, value = digest.strip().partition("=")
+        if algorithm.lower() == "sha-256" and value:
+            return base64.b64decode(value).hex()
+    return None
+
+
+def hash_file(path: os.PathLike) -> "hashlib._Hash":
+    """Returns the SHA-256 of a file, read a chunk at a time"""
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as part_file:
+        for chunk in iter(lambda: part_file.read(CHUNK_SIZE), b""):
+            sha256.update(chunk)
+    return sha256
+
+
+class SnapshotDownloader:
+    """Downloads completed snapshots to a directory, in the background
+
+    Each snapshot streams to `<project ID>_<snapshot ID>.snapshot.part` a chunk at
+    a time, so memory stays bounded however large the snapshot.  The part file
+    is renamed once the download completes and matches the SHA-256 the server
+    sent, which is written next to it in the format of `sha256sum`.  A part file
+    left by an interrupted download is resumed with a range request, and a
+    snapshot already downloaded is not downloaded again.
+
+    Params:
+        client: the FWClient to download with
+        download_dir: the directory to download snapshots to
+        max_workers: the number of snapshots to download concurrently
+        run_metrics: the metrics to record downloads in, a new one if not set
+    """
+
+    def __init__(
+        self,
+        client: "FWClient",
+        download_dir: os.PathLike,
+        max_workers: int = 1,
+        run_metrics: Optional[metrics.Metrics] = None,
+    ):
+        self.client = client
+        self.download_dir = download_dir
+        os.makedirs(download_dir, exist_ok=True)
+        self.executor = ThreadPoolExecutor(
+            max_workers=max(1, max_workers), thread_name_prefix="Download"
+        )
+        self.metrics = run_metrics or metrics.Metrics()
+        self.futures: List[Future] = []
+        # Snapshots that could not be downloaded, and the error raised
+        self.errors = []
+        self._submitted = set()
+        self._lock = threading.Lock()
+
+    def path(self, project_id: str, snapshot_id: str) -> str:
+        """Returns the path a snapshot is downloaded to"""
+        return os.path.join(
+            self.download_dir, f"{project_id}_{snapshot_id}{SNAPSHOT_SUFFIX}"
+        )
+
+    def submit(self, record: snapshot_utils.SnapshotRecord) -> None:
+        """Queues the download of a completed snapshot, once per snapshot"""
+        with self._lock:
+            if record.id in self._submitted:
+                return
+            self._submitted.add(record.id)
+            self.futures.append(
+                self.executor.submit(
+                    self._download_and_record_errors, record.project_id, record.id
+                )
+            )
+
+    def _download_and_record_errors(self, project_id: str, snapshot_id: str) -> None:
+        try:
+            self.download(project_id, snapshot_id)
+        except Exception as e:
+            log.error(f"Unable to download snapshot {snapshot_id}: {e}")
+            self.metrics.increment("download_failures")
+            with self._lock:
+                self.errors.append((snapshot_id, e))
+
+    def download(self, project_id: str, snapshot_id: str) -> str:
+        """Downloads a snapshot, resuming a partial download of it
+
+        A resumed download that fails its checksum is downloaded again from the
+        start, once.
+
+        Returns:
+            the path of the downloaded snapshot
+        """
+        path = self.path(project_id, snapshot_id)
+        if os.path.exists(path) and os.path.exists(path + CHECKSUM_SUFFIX):
+            log.debug(f"Snapshot {snapshot_id} was already downloaded")
+            return path
+        part_path = path + PART_SUFFIX
+        resuming = os.path.exists(part_path)
+        try:
+            sha256, resumed = self._stream(project_id, snapshot_id, part_path)
+        except ChecksumError:
+            if not resuming:
+                raise
+            log.warning(f"Downloading snapshot {snapshot_id} again from the start")
+            sha256, resumed = self._stream(project_id, snapshot_id, part_path)
+        os.replace(part_path, path)
+        with open(path + CHECKSUM_SUFFIX, "w", encoding="utf-8") as checksum_file:
+            checksum_file.write(f"{sha256}  {os.path.basename(path)}\n")
+        self.metrics.increment("downloads")
+        if resumed:
+            self.metrics.increment("downloads_resumed")
+        log.info(f"Downloaded snapshot {snapshot_id} to {path}")
+        return path
+
+    def _stream(
+        self, project_id: str, snapshot_id: str, part_path: str
+    ) -> Tuple[str, bool]:
+        """Streams a snapshot to its part file, from where the part file ends
+
+        Returns:
+            the hex SHA-256 of the snapshot, and whether a part file was resumed
+        """
+        offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        headers = {"Range": f"bytes={offset}-"} if offset else {}
+        response = self.metrics.timed(metrics.DOWNLOAD, self.client.get)(
+            download_endpoint(project_id, snapshot_id),
+            headers=headers,
+            stream=True,
+            raw=True,
+        )
+        with response:
+            if offset and response.status_code == 416:
+                # The part file is no prefix of the snapshot, so start over
+                os.remove(part_path)
+                return self._stream(project_id, snapshot_id, part_path)
+            response.raise_for_status()
+            if response.status_code != 206:
+                # The server sent the whole snapshot, not the range asked for
+                offset = 0
+            sha256 = hash_file(part_path) if offset else hashlib.sha256()
+            with open(part_path, "ab" if offset else "wb") as part_file:
+                for chunk in response.iter_content(CHUNK_SIZE):
+                    part_file.write(chunk)
+                    sha256.update(chunk)
+                    self.metrics.increment("downloaded_bytes", len(chunk))
+            expected = expected_sha256(response)
+        if expected and sha256.hexdigest() != expected:
+            # A corrupt part file must not be resumed
+            os.remove(part_path)
+            raise ChecksumError(
+                f"snapshot {snapshot_id} has SHA-256 {sha256.hexdigest()}, "
+                f"expected {expected}"
+            )
+        return sha256.hexdigest(), bool(offset)
+
+    def wait(self) -> None:
+        """Waits for every queued download to finish"""
+        while True:
+            with self._lock:
+                pending = [f for f in self.futures if not f.done()]
+            if not pending:
+                return
+            for future in pending:
+                future.result()
+
+    def close(self) -> None:
+        """Waits for the downloads, then stops the download workers"""
+        self.wait()
+        self.executor.shutdown()
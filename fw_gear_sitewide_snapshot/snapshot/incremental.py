@@ -0,0 +1,140 @@
+import datetime
+import logging
+import os
+from typing import TYPE_CHECKING, Any, Dict, Iterable, Optional, Union
+
+from pydantic.datetime_parse import parse_datetime
+
+from . import report, snapshot_utils
+
+if TYPE_CHECKING:
+    from fw_client import FWClient
+
+log = logging.getLogger("IncrementalSnapshots")
+
+# Report statuses of rows pointing at a project's last completed snapshot: a
+# skipped row carries the snapshot that was still current
+LAST_SNAPSHOT_STATES = (
+    snapshot_utils.SnapshotState.complete,
+    snapshot_utils.SnapshotState.skipped,
+)
+
+
+def modified_time(project: Any) -> Optional[datetime.datetime]:
+    """Returns when a project was last modified, from an SDK project or a dict
+
+    Args:
+        project: a project from the finder
+
+    Returns:
+        the naive UTC time the project was modified, None if it is not known
+    """
+    modified = project.get("modified")
+    if not modified:
+        return None
+    if not isinstance(modified, datetime.datetime):
+        modified = parse_datetime(modified)
+    return snapshot_utils.utc_naive(modified)
+
+
+def latest_complete(
+    records: Iterable[snapshot_utils.SnapshotRecord],
+) -> Optional[snapshot_utils.SnapshotRecord]:
+    """Returns the most recent of the completed snapshots, if any"""
+    complete = [r for r in records if r.status == snapshot_utils.SnapshotState.complete]
+    return max(
+        complete, key=lambda r: snapshot_utils.utc_naive(r.created), default=None
+    )
+
+
+def load_last_snapshots(
+    report_path: os.PathLike,
+) -> Dict[str, snapshot_utils.SnapshotRecord]:
+    """Reads the most recent completed snapshot of each project in a report
+
+    A project skipped by an incremental run keeps the snapshot it was skipped
+    for, so that chained incremental runs keep skipping it while it is unchanged.
+
+    Args:
+        report_path: the path of a snapshot report from a previous run
+
+    Returns:
+        the last completed snapshot of each project, by project ID
+    """
+    last_snapshots = {}
+    for row in report.iter_rows(report_path):
+        if row[snapshot_utils.STATUS] not in LAST_SNAPSHOT_STATES:
+            continue
+        record = snapshot_utils.SnapshotRecord.from_row(row)
+        record.status = snapshot_utils.SnapshotState.complete
+        previous = last_snapshots.get(record.parents.project)
+        if previous is None or record.created > previous.created:
+            last_snapshots[record.parents.project] = record
+    log.info(f"Loaded the last snapshots of {len(last_snapshots)} projects")
+    return last_snapshots
+
+
+def parse_snapshot_list(
+    snapshots: Union[list, dict, None],
+) -> Optional[snapshot_utils.SnapshotRecord]:
+    """Returns the last completed snapshot from a snapshot listing response"""
+    if isinstance(snapshots, dict):
+        snapshots = snapshots.get("results", [])
+    return latest_complete(
+        snapshot_utils.SnapshotRecord.parse_obj(dict(s)) for s in snapshots or []
+    )
+
+
+def get_last_snapshot(
+    client: "FWClient", project_id: str
+) -> Optional[snapshot_utils.SnapshotRecord]:
+    """Gets the most recent completed snapshot of a project from the API
+
+    Args:
+        client: a flywheel client
+        project_id: the ID of the project
+
+    Returns:
+        the last completed snapshot, None if the project has none
+    """
+    snapshots = client.get(f"/snapshot/projects/{project_id}/snapshots")
+    return parse_snapshot_list(snapshots)
+
+
+def is_unchanged(
+    project: Any, last_snapshot: Optional[snapshot_utils.SnapshotRecord]
+) -> bool:
+    """Returns True if a project was not modified since its last snapshot
+
+    Report timestamps are truncated to the minute, which can only make a project
+    look modified after its snapshot, never the other way around.
+
+    Args:
+        project: a project from the finder
+        last_snapshot: the project's last completed snapshot
+    """
+    if last_snapshot is None:
+        return False
+    modified = modified_time(project)
+    if modified is None:
+        return False
+    return modified <= snapshot_utils.utc_naive(last_snapshot.created)
+
+
+def skipped_record(
+    last_snapshot: snapshot_utils.SnapshotRecord, batch_name: str
+) -> snapshot_utils.SnapshotRecord:
+    """Returns the report record of a project skipped for being unchanged
+
+    The record points at the project's last snapshot, which is still current.
+    Nothing was attempted on the project in this run, so the attempts and failed
+    snapshots of the last snapshot's run are not carried over.
+    """
+    return last_snapshot.copy(
+        update={
+            "status": snapshot_utils.SnapshotState.skipped,
+            "batch_label": batch_name,
+            "attempt": 1,
+            "history": [],
+        }
+    )
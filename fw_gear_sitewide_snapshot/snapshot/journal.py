@@ -0,0 +1,95 @@
+import json
+import logging
+import os
+import threading
+from typing import List
+
+from . import snapshot_utils
+
+log = logging.getLogger("SnapshotJournal")
+
+JOURNAL_FILENAME = "snapshot_journal.jsonl"
+
+# Journal event types
+SNAPSHOT_EVENT = "snapshot"
+STATUS_EVENT = "status"
+
+
+class Journal:
+    """An append-only JSON lines journal of the snapshots triggered in a run
+
+    A line is written as soon as each snapshot is triggered and each time its
+    status changes, so the state of a run survives the gear being killed.
+
+    Params:
+        path: the path of the journal file, appended to if it already exists
+    """
+
+    def __init__(self, path: os.PathLike):
+        self.path = path
+        self._file = open(path, "a", encoding="utf-8")
+        self._lock = threading.Lock()
+
+    def __enter__(self) -> "Journal":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def close(self) -> None:
+        with self._lock:
+            self._file.close()
+
+    def record_snapshot(self, record: snapshot_utils.SnapshotRecord) -> None:
+        """Journals a newly triggered snapshot"""
+        self._write(
+            {"event": SNAPSHOT_EVENT, "record": json.loads(record.json(by_alias=True))}
+        )
+
+    def record_status(self, record: snapshot_utils.SnapshotRecord) -> None:
+        """Journals a change in the status of a snapshot, and how long it took"""
+        event = {"event": STATUS_EVENT, "id": record.id, "status": record.status}
+        if record.duration_seconds is not None:
+            event["duration_seconds"] = record.duration_seconds
+        self._write(event)
+
+    def _write(self, event: dict) -> None:
+        line = json.dumps(event) + "\n"
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+
+
+def load_journal(path: os.PathLike) -> List[snapshot_utils.SnapshotRecord]:
+    """Replays a journal into the latest state of every snapshot it recorded
+
+    A truncated final line, left by a run that was killed mid-write, is skipped.
+    A failed snapshot that was retried is superseded by its retry.
+
+    Args:
+        path: the path of the journal file
+
+    Returns:
+        the journaled snapshots, in the order they were triggered
+    """
+    records = {}
+    with open(path, encoding="utf-8") as journal_file:
+        for line_number, line in enumerate(journal_file, start=1):
+            try:
+                event = json.loads(line)
+            except json.JSONDecodeError:
+                log.warning(f"Skipping unreadable journal line {line_number}")
+                continue
+            if event["event"] == SNAPSHOT_EVENT:
+                record = snapshot_utils.SnapshotRecord.parse_obj(event["record"])
+                records[record.id] = record
+            elif event["event"] == STATUS_EVENT and event["id"] in records:
+                record = records[event["id"]]
+                record.status = snapshot_utils.SnapshotState(event["status"])
+                record.duration_seconds = event.get(
+                    "duration_seconds", record.duration_seconds
+                )
+    retried = {
+        snapshot_id for record in records.values() for snapshot_id in record.history
+    }
+    return [record for record in records.values() if record.id not in retried]
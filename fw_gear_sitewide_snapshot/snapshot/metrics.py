@@ -0,0 +1,349 @@
+import bisect
+import collections
+import contextlib
+import functools
+import json
+import math
+import os
+import threading
+import time
+from typing import Any, Callable, Iterable, Iterator, List, Optional
+
+from . import snapshot_utils, throttle
+
+METRICS_FILENAME = "run_metrics.json"
+PROMETHEUS_FILENAME = "run_metrics.prom"
+PROMETHEUS_PREFIX = "sitewide_snapshot"
+
+# Upper bounds of the latency histogram buckets, in seconds
+LATENCY_BUCKETS = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    math.inf,
+)
+
+# Names of the Flywheel API endpoints the gear calls
+FIND = "find"
+GET_PROJECT = "get_project"
+LOOKUP = "lookup"
+TRIGGER = "trigger"
+STATUS = "status"
+LIST_SNAPSHOTS = "list_snapshots"
+DOWNLOAD = "download"
+
+
+class Histogram:
+    """A latency histogram with fixed buckets
+
+    Not thread-safe on its own, `Metrics` guards it with its lock.
+    """
+
+    def __init__(self, buckets: Iterable[float] = LATENCY_BUCKETS):
+        self.buckets = list(buckets)
+        self.counts = [0] * len(self.buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.min = math.inf
+        self.max = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Estimates a quantile as the upper bound of the bucket it falls in"""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def cumulative(self) -> List[int]:
+        """Returns the number of observations at or below each bucket bound"""
+        total, cumulative = 0, []
+        for count in self.counts:
+            total += count
+            cumulative.append(total)
+        return cumulative
+
+    def to_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "sum": round(self.sum, 6),
+            "mean": round(self.sum / self.count, 6) if self.count else None,
+            "min": round(self.min, 6) if self.count else None,
+            "max": round(self.max, 6),
+            "p50": self.quantile(0.5),
+            "p90": self.quantile(0.9),
+            "p99": self.quantile(0.99),
+            "buckets": {
+                bucket_label(bound): count
+                for bound, count in zip(self.buckets, self.cumulative())
+            },
+        }
+
+
+def bucket_label(bound: float) -> str:
+    return "+Inf" if bound == math.inf else repr(bound)
+
+
+class Metrics:
+    """Collects the metrics of a gear run
+
+    Tracks, per Flywheel API endpoint, a latency histogram of every request
+    attempt, the errors by HTTP status, the retries and the requests in flight.
+    The seconds spent in each phase of the run (triggering, polling, sleeping)
+    and general counters are tracked as well.  Thread-safe.
+    """
+
+    def __init__(self, clock: Callable[[], float] = time.monotonic):
+        self.clock = clock
+        self.started = clock()
+        self.latency = collections.defaultdict(Histogram)
+        self.errors = collections.defaultdict(collections.Counter)
+        self.retries = collections.Counter()
+        self.in_flight = collections.Counter()
+        self.max_in_flight = collections.Counter()
+        self.phases = collections.Counter()
+        self.counters = collections.Counter()
+        self.snapshots = collections.Counter()
+        self.connections = {}
+        self._lock = threading.Lock()
+
+    def _start(self, endpoint: str) -> float:
+        with self._lock:
+            self.in_flight[endpoint] += 1
+            self.max_in_flight[endpoint] = max(
+                self.max_in_flight[endpoint], self.in_flight[endpoint]
+            )
+        return self.clock()
+
+    def _finish(
+        self, endpoint: str, started: float, error: Optional[Exception] = None
+    ) -> None:
+        elapsed = self.clock() - started
+        with self._lock:
+            self.in_flight[endpoint] -= 1
+            self.latency[endpoint].observe(elapsed)
+            if error is not None:
+                status = throttle.status_code(error)
+                self.errors[endpoint][str(status or type(error).__name__)] += 1
+
+    def timed(self, endpoint: str, func: Callable[..., Any]) -> Callable[..., Any]:
+        """Wraps a function calling an endpoint so that every call is measured
+
+        The wrapper's `endpoint` attribute lets `throttle.Throttle` attribute the
+        retries of the call to the endpoint.
+        """
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            started = self._start(endpoint)
+            try:
+                result = func(*args, **kwargs)
+            except Exception as e:
+                self._finish(endpoint, started, e)
+                raise
+            self._finish(endpoint, started)
+            return result
+
+        wrapper.endpoint = endpoint
+        return wrapper
+
+    def timed_async(
+        self, endpoint: str, func: Callable[..., Any]
+    ) -> Callable[..., Any]:
+        """Wraps a coroutine function calling an endpoint, like `timed`"""
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            started = self._start(endpoint)
+            try:
+                result = await func(*args, **kwargs)
+            except Exception as e:
+                self._finish(endpoint, started, e)
+                raise
+            self._finish(endpoint, started)
+            return result
+
+        wrapper.endpoint = endpoint
+        return wrapper
+
+    def record_retry(self, endpoint: str) -> None:
+        with self._lock:
+            self.retries[endpoint] += 1
+
+    def increment(self, counter: str, value: float = 1) -> None:
+        with self._lock:
+            self.counters[counter] += value
+
+    @contextlib.contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        """Adds the seconds spent in the block to a phase of the run"""
+        started = self.clock()
+        try:
+            yield
+        finally:
+            elapsed = self.clock() - started
+            with self._lock:
+                self.phases[name] += elapsed
+
+    def timed_iter(self, name: str, items: Iterable) -> Iterator:
+        """Yields the items of an iterable, adding the time waited for them to a phase
+
+        Used for the SDK finder, which fetches a page of projects now and then
+        rather than one request per project.
+        """
+        iterator = iter(items)
+        while True:
+            with self.phase(name):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+    def record_snapshots(
+        self, records: Iterable[snapshot_utils.SnapshotRecord]
+    ) -> None:
+        """Records the final number of snapshots in each status"""
+        counts = collections.Counter(record.status.value for record in records)
+        with self._lock:
+            self.snapshots = counts
+
+    def record_connections(self, stats: dict) -> None:
+        """Records the connections opened to the site, and the requests sent"""
+        with self._lock:
+            self.connections = dict(stats)
+
+    def to_dict(self) -> dict:
+        """Returns the metrics as a JSON-serializable dict"""
+        with self._lock:
+            endpoints = sorted(set(self.latency) | set(self.retries))
+            return {
+                "run_seconds": round(self.clock() - self.started, 3),
+                "phases": {k: round(v, 3) for k, v in sorted(self.phases.items())},
+                "counters": dict(sorted(self.counters.items())),
+                "snapshots": dict(sorted(self.snapshots.items())),
+                "connections": dict(self.connections),
+                "endpoints": {
+                    endpoint: {
+                        "latency": self.latency[endpoint].to_dict(),
+                        "errors": dict(self.errors[endpoint]),
+                        "retries": self.retries[endpoint],
+                        "max_in_flight": self.max_in_flight[endpoint],
+                    }
+                    for endpoint in endpoints
+                },
+            }
+
+    def write_json(self, path: os.PathLike) -> None:
+        """Writes the metrics to a JSON file"""
+        with open(path, "w", encoding="utf-8") as metrics_file:
+            json.dump(self.to_dict(), metrics_file, indent=2)
+
+    def write_prometheus(self, path: os.PathLike) -> None:
+        """Writes the metrics in the Prometheus text format, e.g. for node_exporter"""
+        lines = prometheus_lines(self)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as metrics_file:
+            metrics_file.write("\n".join(lines) + "\n")
+        # Replaced at once, so the textfile collector never reads a partial file
+        os.replace(tmp_path, path)
+
+
+def prometheus_lines(source: Metrics) -> List[str]:
+    """Formats the metrics of a run in the Prometheus text exposition format"""
+    metrics = source.to_dict()
+    p = PROMETHEUS_PREFIX
+    lines = [
+        f"# HELP {p}_run_seconds Wall clock seconds of the gear run",
+        f"# TYPE {p}_run_seconds gauge",
+        f"{p}_run_seconds {metrics['run_seconds']}",
+        f"# HELP {p}_phase_seconds Seconds spent in each phase of the run",
+        f"# TYPE {p}_phase_seconds gauge",
+    ]
+    lines += [
+        f'{p}_phase_seconds{{phase="{name}"}} {value}'
+        for name, value in metrics["phases"].items()
+    ]
+    lines += [
+        f"# HELP {p}_snapshots Snapshots by final status",
+        f"# TYPE {p}_snapshots gauge",
+    ]
+    lines += [
+        f'{p}_snapshots{{status="{status}"}} {count}'
+        for status, count in metrics["snapshots"].items()
+    ]
+    connections = metrics["connections"]
+    if connections:
+        lines += [
+            f"# HELP {p}_connections_opened_total Connections opened to the site",
+            f"# TYPE {p}_connections_opened_total counter",
+            f"{p}_connections_opened_total {connections['opened']}",
+            f"# HELP {p}_connection_requests_total Requests sent over the connections",
+            f"# TYPE {p}_connection_requests_total counter",
+            f"{p}_connection_requests_total {connections['requests']}",
+        ]
+    for name, value in metrics["counters"].items():
+        lines += [f"# TYPE {p}_{name}_total counter", f"{p}_{name}_total {value}"]
+
+    lines += [
+        f"# HELP {p}_request_duration_seconds Latency of Flywheel API requests",
+        f"# TYPE {p}_request_duration_seconds histogram",
+    ]
+    for endpoint, values in metrics["endpoints"].items():
+        label = f'endpoint="{endpoint}"'
+        histogram = source.latency[endpoint]
+        for bound, count in zip(histogram.buckets, histogram.cumulative()):
+            lines.append(
+                f"{p}_request_duration_seconds_bucket"
+                f'{{{label},le="{bucket_label(bound)}"}} {count}'
+            )
+        lines.append(f"{p}_request_duration_seconds_sum{{{label}}} {histogram.sum}")
+        lines.append(f"{p}_request_duration_seconds_count{{{label}}} {histogram.count}")
+    lines += [
+        f"# HELP {p}_request_errors_total Failed Flywheel API requests by status",
+        f"# TYPE {p}_request_errors_total counter",
+    ]
+    for endpoint, values in metrics["endpoints"].items():
+        for status, count in values["errors"].items():
+            lines.append(
+                f'{p}_request_errors_total{{endpoint="{endpoint}",status="{status}"}}'
+                f" {count}"
+            )
+    lines += [
+        f"# HELP {p}_request_retries_total Throttled requests that were retried",
+        f"# TYPE {p}_request_retries_total counter",
+    ]
+    lines += [
+        f'{p}_request_retries_total{{endpoint="{endpoint}"}} {values["retries"]}'
+        for endpoint, values in metrics["endpoints"].items()
+    ]
+    lines += [
+        f"# HELP {p}_requests_in_flight_max Most concurrent requests to an endpoint",
+        f"# TYPE {p}_requests_in_flight_max gauge",
+    ]
+    lines += [
+        f'{p}_requests_in_flight_max{{endpoint="{endpoint}"}} '
+        f'{values["max_in_flight"]}'
+        for endpoint, values in metrics["endpoints"].items()
+    ]
+    return lines
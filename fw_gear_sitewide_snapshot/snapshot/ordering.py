@@ -0,0 +1,133 @@
+import logging
+import os
+import statistics
+from typing import Any, Dict, Iterable, List, Optional
+
+from . import report, snapshot_utils
+
+log = logging.getLogger("SnapshotOrdering")
+
+# The project stats counted towards the size of a project, i.e. the containers
+# and files its snapshot copies
+SIZE_COUNTERS = (
+    "subjects",
+    "sessions",
+    "acquisitions",
+    "analyses",
+    "files",
+    "acquisition_files",
+)
+# Seconds a snapshot takes per container or file, until calibrated on durations
+DEFAULT_SECONDS_PER_ITEM = 0.01
+
+
+def project_size(project: Any) -> Optional[int]:
+    """Returns the containers and files in a project, from the finder's stats
+
+    Args:
+        project: a project from the finder, an SDK project or a dict
+
+    Returns:
+        the size of the project, None if the finder did not return its stats
+    """
+    stats = project.get("stats")
+    number_of = stats.get("number_of") if stats else None
+    if not number_of:
+        return None
+    return sum(number_of.get(counter) or 0 for counter in SIZE_COUNTERS)
+
+
+def load_durations(report_path: os.PathLike) -> Dict[str, float]:
+    """Reads the seconds the latest completed snapshot of each project took
+
+    Reports written before durations were recorded give no durations.
+
+    Args:
+        report_path: the path of a snapshot report from a previous run
+
+    Returns:
+        the duration of each project's last completed snapshot, by project ID
+    """
+    durations = {}
+    latest = {}
+    for row in report.iter_rows(report_path):
+        if row[snapshot_utils.STATUS] != snapshot_utils.SnapshotState.complete:
+            continue
+        duration = snapshot_utils.parse_seconds(
+            row.get(snapshot_utils.DURATION_SECONDS)
+        )
+        if duration is None:
+            continue
+        project_id = row[snapshot_utils.PROJECT_ID]
+        timestamp = row[snapshot_utils.TIMESTAMP]
+        if project_id not in latest or timestamp >= latest[project_id]:
+            latest[project_id] = timestamp
+            durations[project_id] = duration
+    log.info(f"Loaded the snapshot durations of {len(durations)} projects")
+    return durations
+
+
+class CostEstimator:
+    """Estimates how long the snapshot of each project will take
+
+    A project snapshotted before is expected to take as long as its last
+    snapshot.  Other projects are estimated from their size, at the seconds per
+    container or file that the projects with both a size and a duration took.
+    Projects with neither are expected to take the median estimate.
+
+    Params:
+        durations: the seconds the last snapshot of each project took, by
+            project ID
+    """
+
+    def __init__(self, durations: Optional[Dict[str, float]] = None):
+        self.durations = durations or {}
+
+    def seconds_per_item(self, sizes: Dict[str, Optional[int]]) -> float:
+        """Returns the median seconds per container or file of past snapshots"""
+        rates = [
+            self.durations[project_id] / size
+            for project_id, size in sizes.items()
+            if size and project_id in self.durations
+        ]
+        return statistics.median(rates) if rates else DEFAULT_SECONDS_PER_ITEM
+
+    def estimate(self, projects: Iterable[Any]) -> Dict[str, Optional[float]]:
+        """Estimates the seconds the snapshot of each project will take
+
+        Args:
+            projects: projects from the finder
+
+        Returns:
+            the estimate of each project, by project ID, None if nothing is known
+            of any project
+        """
+        sizes = {project.get("_id"): project_size(project) for project in projects}
+        rate = self.seconds_per_item(sizes)
+        estimates = {}
+        for project_id, size in sizes.items():
+            if project_id in self.durations:
+                estimates[project_id] = self.durations[project_id]
+            elif size is not None:
+                estimates[project_id] = size * rate
+        known = list(estimates.values())
+        default = statistics.median(known) if known else None
+        return {project_id: estimates.get(project_id, default) for project_id in sizes}
+
+
+def longest_first(
+    projects: Iterable[Any], estimates: Dict[str, Optional[float]]
+) -> List[Any]:
+    """Orders projects by their estimated snapshot duration, longest first
+
+    Starting the longest snapshots first keeps a large project triggered last
+    from finishing long after the rest of the batch.  Projects with the same
+    estimate keep their order.
+
+    Args:
+        projects: projects from the finder
+        estimates: the estimate of each project, by project ID
+    """
+    return sorted(
+        projects, key=lambda project: -(estimates.get(project.get("_id")) or 0)
+    )
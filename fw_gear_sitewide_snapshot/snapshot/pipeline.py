@@ -0,0 +1,125 @@
+import asyncio
+import queue
+import threading
+from typing import (
+    Any,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Iterable,
+    Iterator,
+    Optional,
+)
+
+# Projects the finder may page ahead of the triggering workers, a few pages' worth
+PREFETCH_SIZE = 1000
+
+# Seconds between checks of whether the consumer went away, while the queue is full
+_PUT_TIMEOUT = 0.1
+
+
+class _Done:
+    """Marks the end of the items, with the error that ended them, if any"""
+
+    def __init__(self, error: Optional[BaseException] = None):
+        self.error = error
+
+
+def prefetch(items: Iterable, maxsize: int = PREFETCH_SIZE) -> Iterator:
+    """Iterates over an iterable in a background thread, yielding its items
+
+    The thread runs up to `maxsize` items ahead of the consumer, so slow steps of
+    the iteration, like fetching the next page of finder results, overlap with
+    the processing of the items already fetched.  An error raised by the
+    iteration is raised to the consumer once the items before it are consumed.
+
+    Args:
+        items: the iterable to iterate over
+        maxsize: the most items fetched ahead of the consumer
+    """
+    fetched = queue.Queue(maxsize=maxsize)
+    stopped = threading.Event()
+
+    def put(item) -> bool:
+        while not stopped.is_set():
+            try:
+                fetched.put(item, timeout=_PUT_TIMEOUT)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce() -> None:
+        try:
+            for item in items:
+                if not put(item):
+                    return
+        except BaseException as e:
+            put(_Done(e))
+        else:
+            put(_Done())
+
+    producer = threading.Thread(target=produce, name="Prefetch", daemon=True)
+    producer.start()
+    try:
+        while True:
+            item = fetched.get()
+            if isinstance(item, _Done):
+                if item.error is not None:
+                    raise item.error
+                return
+            yield item
+    finally:
+        # Unblocks the producer if the consumer stopped early
+        stopped.set()
+        producer.join()
+
+
+async def drain(
+    items: AsyncIterator,
+    func: Callable[[Any], Awaitable[None]],
+    workers: int,
+    maxsize: int = PREFETCH_SIZE,
+) -> None:
+    """Awaits a coroutine function on every item of an async iterator
+
+    The iterator is consumed into a bounded queue, which `workers` tasks drain
+    while the next items are fetched, so that at most `maxsize` items are held
+    at once however many the iterator yields.  `func` should handle its own errors; an
+    error raised by the iterator cancels the workers and is raised.
+
+    Args:
+        items: the async iterator of items
+        func: the coroutine function to await on each item
+        workers: the number of items processed concurrently
+        maxsize: the most items fetched ahead of the workers
+    """
+    fetched = asyncio.Queue(maxsize=maxsize)
+    done = object()
+
+    async def produce() -> None:
+        async for item in items:
+            await fetched.put(item)
+
+    async def work() -> None:
+        while True:
+            item = await fetched.get()
+            if item is done:
+                return
+            await func(item)
+
+    worker_tasks = [asyncio.create_task(work()) for _ in range(max(1, workers))]
+    try:
+        await produce()
+        for _ in worker_tasks:
+            await fetched.put(done)
+        await asyncio.gather(*worker_tasks)
+    finally:
+        for task in worker_tasks:
+            task.cancel()
+
+
+async def iterate_async(items: Iterable) -> AsyncIterator:
+    """Yields the items of an iterable from an async iterator, e.g. for `drain`"""
+    for item in items:
+        yield item
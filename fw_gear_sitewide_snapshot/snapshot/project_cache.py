@@ -0,0 +1,76 @@
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+from pydantic import BaseModel
+
+# Enough for every project on a large site, while still bounding memory
+DEFAULT_CACHE_SIZE = 50_000
+
+
+class ProjectInfo(BaseModel):
+    """The project metadata recorded alongside each snapshot"""
+
+    id: str
+    label: str = ""
+    group: str = ""
+
+    @classmethod
+    def from_project(cls, project) -> "ProjectInfo":
+        """Creates a ProjectInfo from an sdk project, finder result or dict"""
+        return cls(
+            id=project.get("_id"),
+            label=project.get("label") or "",
+            group=project.get("group") or "",
+        )
+
+
+class ProjectCache:
+    """A thread-safe, size-bounded cache of project metadata keyed by project ID
+
+    The least recently used project is evicted once `max_size` is reached.
+
+    Params:
+        max_size: the maximum number of projects to hold
+    """
+
+    def __init__(self, max_size: int = DEFAULT_CACHE_SIZE):
+        self.max_size = max_size
+        self._projects = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._projects)
+
+    def __contains__(self, project_id: str) -> bool:
+        return project_id in self._projects
+
+    def add(self, project) -> ProjectInfo:
+        """Caches the metadata of an sdk project, finder result or dict
+
+        Args:
+            project: the project to cache
+
+        Returns:
+            the cached project metadata
+        """
+        info = ProjectInfo.from_project(project)
+        with self._lock:
+            self._projects[info.id] = info
+            self._projects.move_to_end(info.id)
+            while len(self._projects) > self.max_size:
+                self._projects.popitem(last=False)
+        return info
+
+    def get(self, project_id: str) -> Optional[ProjectInfo]:
+        """Returns the cached metadata for a project, or None if it is not cached"""
+        with self._lock:
+            info = self._projects.get(project_id)
+            if info is not None:
+                self._projects.move_to_end(project_id)
+        return info
+
+    def clear(self) -> None:
+        """Removes every project from the cache"""
+        with self._lock:
+            self._projects.clear()
@@ -0,0 +1,193 @@
+import contextlib
+import datetime
+import json
+import logging
+import os
+from typing import (
+    Any,
+    AsyncIterator,
+    Iterable,
+    Iterator,
+    List,
+    Mapping,
+    Optional,
+    Tuple,
+)
+
+from . import snapshot_utils
+
+log = logging.getLogger("ProjectIndex")
+
+PROJECT_INDEX_FILENAME = "project_index.jsonl"
+
+# Finder features that leave info, files and other heavy fields out of the
+# projects listed, as only their ID, label, group and modified time are used
+LEAN_FINDER_FEATURES = ["slim-containers", "exclude-files"]
+
+
+def index_entry(project: Any) -> dict:
+    """Returns the fields of a project the gear uses, from an SDK project or a dict
+
+    Args:
+        project: a project from the finder
+    """
+    modified = project.get("modified")
+    if isinstance(modified, datetime.datetime):
+        modified = modified.isoformat()
+    return {
+        "_id": project.get("_id"),
+        "label": project.get("label") or "",
+        "group": project.get("group") or "",
+        "modified": modified,
+    }
+
+
+class ProjectIndex:
+    """A JSON lines index of the projects matching a finder filter
+
+    The first line records the filter, each following line a project, with the
+    target it matched if the filter has several targets.  Lines are
+    written to a temporary file, which only replaces `path` once the finder was
+    exhausted, so an index never silently misses projects.
+
+    Params:
+        path: the path of the index
+    """
+
+    def __init__(self, path: os.PathLike):
+        self.path = path
+        self.count = 0
+        self._tmp_path = f"{path}.tmp"
+        self._file = None
+
+    def open(self, project_filter: str) -> None:
+        """Starts a new index, discarding any projects added before
+
+        Args:
+            project_filter: the filter the projects match
+        """
+        self.close()
+        self.count = 0
+        self._file = open(self._tmp_path, "w", encoding="utf-8")
+        header = {
+            "filter": project_filter,
+            "created": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        }
+        self._file.write(json.dumps(header) + "\n")
+
+    def add(self, project: Any, matched_filter: Optional[str] = None) -> None:
+        """Writes a project to the index
+
+        Args:
+            project: a project from the finder
+            matched_filter: the target of the filter that matched the project
+        """
+        entry = index_entry(project)
+        if matched_filter:
+            entry[snapshot_utils.MATCHED_FILTER] = matched_filter
+        self._file.write(json.dumps(entry) + "\n")
+        self.count += 1
+
+    def commit(self) -> None:
+        """Saves the index, once every project matching the filter was added"""
+        self.close()
+        os.replace(self._tmp_path, self.path)
+        log.info(f"Indexed {self.count} projects in {self.path}")
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def discard(self) -> None:
+        """Drops the index being written, as the finder was not exhausted"""
+        self.close()
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(self._tmp_path)
+
+    def record(
+        self,
+        projects: Iterable[Any],
+        project_filter: str,
+        matches: Optional[Mapping[str, str]] = None,
+    ) -> Iterator[Any]:
+        """Yields the projects, adding each to the index as it passes through
+
+        The index is saved once the projects are exhausted, and discarded if
+        they raise or are not all consumed.
+
+        Args:
+            projects: the projects from the finder
+            project_filter: the filter the projects match
+            matches: if set, the target of the filter each project matched, by
+                project ID
+        """
+        self.open(project_filter)
+        try:
+            for project in projects:
+                self.add(project, _matched_filter(project, matches))
+                yield project
+        except BaseException:
+            self.discard()
+            raise
+        self.commit()
+
+    async def record_async(
+        self,
+        projects: AsyncIterator[Any],
+        project_filter: str,
+        matches: Optional[Mapping[str, str]] = None,
+    ) -> AsyncIterator[Any]:
+        """Like `record`, for the projects of an async iterator"""
+        self.open(project_filter)
+        try:
+            async for project in projects:
+                self.add(project, _matched_filter(project, matches))
+                yield project
+        except BaseException:
+            self.discard()
+            raise
+        self.commit()
+
+
+def _matched_filter(
+    project: Any, matches: Optional[Mapping[str, str]]
+) -> Optional[str]:
+    """Returns the target a project matched, None if the targets are not indexed"""
+    if matches is None:
+        return None
+    return matches.get(project.get("_id"))
+
+
+def load_project_index(path: os.PathLike) -> Tuple[str, List[dict]]:
+    """Loads the index of a previous run
+
+    Args:
+        path: the path of the index
+
+    Returns:
+        the filter the projects matched, and the projects
+    """
+    with open(path, encoding="utf-8") as index_file:
+        header = json.loads(index_file.readline())
+        projects = [json.loads(line) for line in index_file if line.strip()]
+    log.info(
+        f"Loaded {len(projects)} projects matching {header['filter']!r}, indexed "
+        f"{header['created']}"
+    )
+    return header["filter"], projects
+
+
+def reusable(
+    indexed_filter: Optional[str], project_filter: str, incremental: bool
+) -> bool:
+    """Returns True if an index can stand in for the finder
+
+    Incremental runs always query the finder, as they need current modified times.
+
+    Args:
+        indexed_filter: the filter of the index, None if there is no index
+        project_filter: the filter of this run
+        incremental: whether this run is incremental
+    """
+    return not incremental and indexed_filter == project_filter
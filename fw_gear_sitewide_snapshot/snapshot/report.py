@@ -0,0 +1,385 @@
+import csv
+import json
+import logging
+import os
+import time
+from typing import TYPE_CHECKING, Dict, Iterable, Iterator, List, Optional
+
+from . import snapshot_utils
+
+if TYPE_CHECKING:
+    import pandas as pd
+    import pyarrow as pa
+
+log = logging.getLogger("SnapshotReport")
+
+# The columns every snapshot report has.  The "retry failed" input relies on
+# these, so they must not change.
+REQUIRED_COLUMNS = [
+    snapshot_utils.GROUP_LABEL,
+    snapshot_utils.PROJECT_LABEL,
+    snapshot_utils.PROJECT_ID,
+    snapshot_utils.SNAPSHOT_ID,
+    snapshot_utils.TIMESTAMP,
+    snapshot_utils.BATCH_LABEL,
+    snapshot_utils.STATUS,
+]
+# The columns of a snapshot report, in order.  New columns are only appended,
+# and may be missing from the reports of earlier versions.
+REPORT_COLUMNS = REQUIRED_COLUMNS + [
+    snapshot_utils.ESTIMATED_SECONDS,
+    snapshot_utils.DURATION_SECONDS,
+    snapshot_utils.ATTEMPT,
+    snapshot_utils.SNAPSHOT_HISTORY,
+    snapshot_utils.MATCHED_FILTER,
+]
+
+# Seconds between report rewrites while waiting on snapshots
+REPORT_FLUSH_INTERVAL = 60
+
+# Report formats, by the extension of the report's path
+CSV = "csv"
+JSONL = "jsonl"
+PARQUET = "parquet"
+REPORT_FORMATS = {".csv": CSV, ".jsonl": JSONL, ".parquet": PARQUET}
+
+
+def report_format(report_path: os.PathLike) -> str:
+    """Returns the format of a snapshot report, from the extension of its path"""
+    extension = os.path.splitext(os.fspath(report_path))[1].lower()
+    if extension not in REPORT_FORMATS:
+        raise ValueError(
+            f"{report_path} is not a snapshot report, its extension is not one of "
+            f"{', '.join(REPORT_FORMATS)}"
+        )
+    return REPORT_FORMATS[extension]
+
+
+def parquet_available() -> bool:
+    """Returns True if Parquet reports can be written, which needs pyarrow"""
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def parquet_schema() -> "pa.Schema":
+    """Returns the column types of a Parquet report
+
+    Labels, statuses and matched filters, shared by many snapshots, are
+    dictionary encoded.
+    """
+    import pyarrow as pa
+
+    category = pa.dictionary(pa.int32(), pa.string())
+    return pa.schema(
+        [
+            (snapshot_utils.GROUP_LABEL, category),
+            (snapshot_utils.PROJECT_LABEL, pa.string()),
+            (snapshot_utils.PROJECT_ID, pa.string()),
+            (snapshot_utils.SNAPSHOT_ID, pa.string()),
+            (snapshot_utils.TIMESTAMP, pa.timestamp("us")),
+            (snapshot_utils.BATCH_LABEL, category),
+            (snapshot_utils.STATUS, category),
+            (snapshot_utils.ESTIMATED_SECONDS, pa.float64()),
+            (snapshot_utils.DURATION_SECONDS, pa.float64()),
+            (snapshot_utils.ATTEMPT, pa.int32()),
+            (snapshot_utils.SNAPSHOT_HISTORY, pa.list_(pa.string())),
+            (snapshot_utils.MATCHED_FILTER, category),
+        ]
+    )
+
+
+def typed_row(record: snapshot_utils.SnapshotRecord) -> dict:
+    """Returns the report row of a snapshot with typed values, for JSONL and Parquet
+
+    The timestamp is the full naive UTC time the snapshot was created at.
+    """
+    return {
+        snapshot_utils.GROUP_LABEL: record.group_label,
+        snapshot_utils.PROJECT_LABEL: record.project_label,
+        snapshot_utils.PROJECT_ID: record.project_id,
+        snapshot_utils.SNAPSHOT_ID: record.id,
+        snapshot_utils.TIMESTAMP: snapshot_utils.utc_naive(record.created),
+        snapshot_utils.BATCH_LABEL: record.batch_label,
+        snapshot_utils.STATUS: record.status.value,
+        snapshot_utils.ESTIMATED_SECONDS: record.estimated_seconds,
+        snapshot_utils.DURATION_SECONDS: record.duration_seconds,
+        snapshot_utils.ATTEMPT: record.attempt,
+        snapshot_utils.SNAPSHOT_HISTORY: list(record.history),
+        snapshot_utils.MATCHED_FILTER: record.matched_filter,
+    }
+
+
+def json_line(record: snapshot_utils.SnapshotRecord) -> str:
+    """Returns the JSONL report line of a snapshot"""
+    row = typed_row(record)
+    row[snapshot_utils.TIMESTAMP] = row[snapshot_utils.TIMESTAMP].isoformat()
+    return json.dumps(row) + "\n"
+
+
+def write_parquet(
+    records: Iterable[snapshot_utils.SnapshotRecord], report_path: os.PathLike
+) -> None:
+    """Writes snapshot records to a Parquet file"""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    table = pa.Table.from_pylist(
+        [typed_row(record) for record in records], schema=parquet_schema()
+    )
+    pq.write_table(table, report_path)
+
+
+def write_report(
+    records: Iterable[snapshot_utils.SnapshotRecord], report_path: os.PathLike
+) -> None:
+    """Streams snapshot records to a report, one row at a time
+
+    The report is written to a temporary file that then replaces `report_path`,
+    so a reader never sees a partially written report.  A Parquet report is
+    written at once, and needs pyarrow.
+
+    Args:
+        records: the snapshot records to write
+        report_path: the path of the report, a .csv, .jsonl or .parquet file
+    """
+    output_format = report_format(report_path)
+    if output_format == CSV:
+        write_rows((record.to_row() for record in records), report_path)
+        return
+    tmp_path = f"{report_path}.tmp"
+    if output_format == JSONL:
+        with open(tmp_path, "w", encoding="utf-8") as report_file:
+            for record in records:
+                report_file.write(json_line(record))
+    else:
+        write_parquet(records, tmp_path)
+    os.replace(tmp_path, report_path)
+
+
+def append_report(
+    records: Iterable[snapshot_utils.SnapshotRecord], report_path: os.PathLike
+) -> None:
+    """Appends the rows of snapshots to a report, creating it if needed
+
+    A CSV or JSONL report grows by a row per snapshot.  As a Parquet file cannot
+    be appended to, a Parquet report appended to is a directory of Parquet files,
+    which gains a file per append.  A snapshot appended more than once is read
+    back with its last row.
+
+    Args:
+        records: the snapshot records to append
+        report_path: the path of the report
+    """
+    output_format = report_format(report_path)
+    if output_format == PARQUET:
+        os.makedirs(report_path, exist_ok=True)
+        write_parquet(
+            records, os.path.join(report_path, f"part-{time.time_ns()}.parquet")
+        )
+    elif output_format == JSONL:
+        with open(report_path, "a", encoding="utf-8") as report_file:
+            report_file.writelines(json_line(record) for record in records)
+    else:
+        is_new = not os.path.exists(report_path) or not os.path.getsize(report_path)
+        with open(report_path, "a", newline="", encoding="utf-8") as report_file:
+            writer = csv.DictWriter(
+                report_file,
+                fieldnames=REPORT_COLUMNS,
+                restval="",
+                extrasaction="ignore",
+            )
+            if is_new:
+                writer.writeheader()
+            writer.writerows(record.to_row() for record in records)
+
+
+def write_rows(rows: Iterable[Dict[str, str]], report_path: os.PathLike) -> None:
+    """Streams report rows to a CSV report, like `write_report`"""
+    tmp_path = f"{report_path}.tmp"
+    with open(tmp_path, "w", newline="", encoding="utf-8") as report_file:
+        writer = csv.DictWriter(
+            report_file, fieldnames=REPORT_COLUMNS, restval="", extrasaction="ignore"
+        )
+        writer.writeheader()
+        for row in rows:
+            writer.writerow(row)
+    os.replace(tmp_path, report_path)
+
+
+def read_json_lines(
+    report_path: os.PathLike, columns: Optional[List[str]] = None
+) -> Iterator[dict]:
+    """Yields the rows of a JSONL report, skipping a truncated final line
+
+    Args:
+        report_path: the path of the report
+        columns: if set, the only columns to keep
+    """
+    with open(report_path, encoding="utf-8") as report_file:
+        for line_number, line in enumerate(report_file, start=1):
+            try:
+                row = json.loads(line)
+            except json.JSONDecodeError:
+                log.warning(f"Skipping unreadable report line {line_number}")
+                continue
+            yield row if columns is None else {c: row.get(c) for c in columns}
+
+
+def to_report_strings(frame: "pd.DataFrame") -> "pd.DataFrame":
+    """Formats the typed columns of a JSONL or Parquet report as in a CSV report"""
+    import pandas as pd
+
+    for column in frame.columns:
+        values = frame[column].astype(object)
+        if column == snapshot_utils.TIMESTAMP:
+            # isoformat() leaves out the microseconds when they are 0, so the
+            # format of the first row is not the format of every row
+            frame[column] = pd.to_datetime(values, format="ISO8601").dt.strftime(
+                snapshot_utils.RECORD_TIMESTAMP_FORMAT
+            )
+        elif column in (
+            snapshot_utils.ESTIMATED_SECONDS,
+            snapshot_utils.DURATION_SECONDS,
+        ):
+            frame[column] = [
+                snapshot_utils.format_seconds(None if pd.isna(v) else v) for v in values
+            ]
+        elif column == snapshot_utils.SNAPSHOT_HISTORY:
+            frame[column] = [
+                snapshot_utils.HISTORY_SEPARATOR.join(v) if v is not None else ""
+                for v in values
+            ]
+        else:
+            frame[column] = ["" if pd.isna(v) else str(v) for v in values]
+    return frame
+
+
+def read_report(
+    report_path: os.PathLike, columns: Optional[List[str]] = None
+) -> "pd.DataFrame":
+    """Reads a snapshot report of any format, every column as in a CSV report
+
+    Only the given columns are read from the report, and the typed columns of
+    JSONL and Parquet reports are formatted as strings, so that reports of every
+    format are handled alike.  A snapshot with several rows, e.g. in a report
+    appended to as it changed, keeps its last row.
+
+    Args:
+        report_path: the path of a .csv, .jsonl or .parquet report
+        columns: if set, the only columns to read
+
+    Returns:
+        the rows of the report
+    """
+    import pandas as pd
+
+    input_format = report_format(report_path)
+    if input_format == CSV:
+        # Skipping type inference keeps IDs and labels as they were written
+        frame = pd.read_csv(
+            report_path, usecols=columns, dtype=str, keep_default_na=False
+        )
+    else:
+        if input_format == JSONL:
+            frame = pd.DataFrame.from_records(
+                read_json_lines(report_path, columns), columns=columns
+            )
+        else:
+            frame = pd.read_parquet(report_path, columns=columns)
+        frame = to_report_strings(frame)
+    if snapshot_utils.SNAPSHOT_ID in frame:
+        frame = frame.drop_duplicates(
+            snapshot_utils.SNAPSHOT_ID, keep="last", ignore_index=True
+        )
+    return frame
+
+
+def iter_rows(report_path: os.PathLike) -> Iterator[Dict[str, str]]:
+    """Yields the rows of a snapshot report of any format, as in a CSV report"""
+    if report_format(report_path) == CSV:
+        with open(report_path, newline="", encoding="utf-8") as report_file:
+            yield from csv.DictReader(report_file)
+        return
+    yield from read_report(report_path).to_dict(orient="records")
+
+
+def merge_reports(report_paths: Iterable[os.PathLike], output_path: os.PathLike) -> int:
+    """Combines snapshot reports, e.g. of sharded gear runs, into one report
+
+    A snapshot in more than one report is written once, with its row from the
+    last report it is in, so reports should be given oldest first.  Reports of
+    any format can be merged, and the merged report has the format of the
+    extension of `output_path`.
+
+    Args:
+        report_paths: the paths of the reports to merge
+        output_path: the path of the merged report
+
+    Returns:
+        the number of rows in the merged report
+    """
+    # Checks the output is a report before any report is read
+    report_format(output_path)
+    rows = {}
+    for report_path in report_paths:
+        for row in iter_rows(report_path):
+            missing = set(REQUIRED_COLUMNS) - set(row)
+            if missing:
+                raise ValueError(
+                    f"{report_path} is not a snapshot report, it has no "
+                    f"{', '.join(sorted(missing))} column"
+                )
+            rows[row[snapshot_utils.SNAPSHOT_ID]] = row
+    write_report(
+        (snapshot_utils.SnapshotRecord.from_row(row) for row in rows.values()),
+        output_path,
+    )
+    return len(rows)
+
+
+class ReportWriter:
+    """Rewrites the snapshot report periodically while snapshots are polled
+
+    With `append` set, each write appends the rows of the snapshots added or
+    changed since the last write instead, so a write costs as much as the
+    snapshots that moved, however many snapshots the run has.
+
+    Params:
+        report_path: the path of the report, a .csv, .jsonl or .parquet file
+        flush_interval: the minimum number of seconds between two writes
+        append: if True, writes append to the report rather than replace it
+    """
+
+    def __init__(
+        self,
+        report_path: os.PathLike,
+        flush_interval: float = REPORT_FLUSH_INTERVAL,
+        append: bool = False,
+    ):
+        self.report_path = report_path
+        self.flush_interval = flush_interval
+        self.append = append
+        # The status each snapshot was last appended with
+        self._written: Dict[str, snapshot_utils.SnapshotState] = {}
+        self._flushed = time.monotonic()
+
+    def flush(self, records: Iterable[snapshot_utils.SnapshotRecord]) -> None:
+        """Writes the report now"""
+        # Copied so that snapshots added while writing do not break the iteration
+        records = list(records)
+        if self.append:
+            changed = [r for r in records if self._written.get(r.id) != r.status]
+            if changed:
+                append_report(changed, self.report_path)
+            self._written.update((r.id, r.status) for r in changed)
+        else:
+            write_report(records, self.report_path)
+        self._flushed = time.monotonic()
+
+    def maybe_flush(self, records: Iterable[snapshot_utils.SnapshotRecord]) -> None:
+        """Writes the report if `flush_interval` seconds passed since the last write"""
+        if time.monotonic() - self._flushed >= self.flush_interval:
+            self.flush(records)
@@ -0,0 +1,106 @@
+import heapq
+import itertools
+import logging
+import math
+import random
+import threading
+import time
+from typing import Callable, List
+
+from . import snapshot_store
+
+log = logging.getLogger("SnapshotRetries")
+
+MAX_SNAPSHOT_RETRIES = 2
+RETRY_BACKOFF = 15.0  # seconds, doubled on every retry of a project
+RETRY_MAX_BACKOFF = 120.0  # seconds
+# Seconds before a retry held back by a full admission window is tried again
+POSTPONE_INTERVAL = 1.0
+
+
+class RetryQueue:
+    """Failed snapshots waiting to be triggered again, after a backoff
+
+    Each project may be retried `max_retries` times.  The wait before a retry
+    doubles with every attempt, randomized so retries do not synchronize.  A
+    retry whose trigger request failed counts as an attempt.  Thread-safe.
+
+    Params:
+        max_retries: the retries of a project's snapshot, after the first attempt
+        backoff: the wait before the first retry
+        max_backoff: the longest wait before a retry
+        clock: a monotonic clock returning seconds
+    """
+
+    def __init__(
+        self,
+        max_retries: int = MAX_SNAPSHOT_RETRIES,
+        backoff: float = RETRY_BACKOFF,
+        max_backoff: float = RETRY_MAX_BACKOFF,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.clock = clock
+        self._queue = []
+        self._counter = itertools.count()
+        # Retries per project whose trigger failed, so no snapshot recorded them
+        self._failed_triggers = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._queue)
+
+    def delay(self, attempt: int) -> float:
+        """Returns the jittered wait before retrying a snapshot's `attempt`"""
+        delay = min(self.max_backoff, self.backoff * 2 ** (attempt - 1))
+        return delay * random.uniform(0.5, 1.5)
+
+    def offer(self, record: snapshot_store.CompactSnapshot) -> bool:
+        """Queues the retry of a failed snapshot, if its project has retries left
+
+        Returns:
+            True if the snapshot will be retried
+        """
+        with self._lock:
+            attempt = record.attempt + self._failed_triggers.get(record.project_id, 0)
+        if attempt > self.max_retries:
+            return False
+        self._push(self.clock() + self.delay(attempt), record)
+        return True
+
+    def offer_again(self, record: snapshot_store.CompactSnapshot) -> bool:
+        """Queues a retry again after its trigger failed, counting it as an attempt
+
+        Returns:
+            True if the snapshot will be retried
+        """
+        with self._lock:
+            failed = self._failed_triggers.get(record.project_id, 0)
+            self._failed_triggers[record.project_id] = failed + 1
+        return self.offer(record)
+
+    def postpone(self, record: snapshot_store.CompactSnapshot) -> None:
+        """Queues a due retry again shortly, e.g. while the window is full"""
+        self._push(self.clock() + POSTPONE_INTERVAL, record)
+
+    def _push(self, due: float, record: snapshot_store.CompactSnapshot) -> None:
+        with self._lock:
+            heapq.heappush(self._queue, (due, next(self._counter), record))
+
+    def pop_due(self) -> List[snapshot_store.CompactSnapshot]:
+        """Removes and returns the failed snapshots due for a retry"""
+        now = self.clock()
+        due = []
+        with self._lock:
+            while self._queue and self._queue[0][0] <= now:
+                due.append(heapq.heappop(self._queue)[2])
+        return due
+
+    def next_retry_in(self) -> float:
+        """Returns the seconds until the next retry is due, inf if there is none"""
+        with self._lock:
+            if not self._queue:
+                return math.inf
+            return max(0.0, self._queue[0][0] - self.clock())
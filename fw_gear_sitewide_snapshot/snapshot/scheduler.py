@@ -0,0 +1,111 @@
+import heapq
+import itertools
+import random
+import time
+from typing import Callable, List
+
+from . import snapshot_utils
+
+# Fresh snapshots are polled quickly, then less often the longer they run
+POLL_INITIAL_INTERVAL = 2.0  # seconds
+POLL_MAX_INTERVAL = 60.0  # seconds
+POLL_BACKOFF_FACTOR = 1.5
+# Randomize each interval by +/- this fraction so polls do not synchronize
+POLL_JITTER = 0.2
+MAX_POLLS_PER_SECOND = 10
+
+
+class PollScheduler:
+    """Schedules status polls for snapshots with exponential backoff
+
+    Snapshots are kept in a priority queue ordered by the time of their next poll.
+    Each poll of a snapshot pushes its next poll further out, and the total number
+    of polls handed out is capped at `max_polls_per_second`.  A snapshot already
+    queued is not queued again.
+
+    Params:
+        initial_interval: the delay before the first poll of a snapshot
+        max_interval: the longest delay between two polls of a snapshot
+        backoff_factor: the growth of the delay after each poll
+        jitter: the fraction by which each delay is randomized
+        max_polls_per_second: the most polls handed out per second, across snapshots
+        clock: a monotonic clock returning seconds
+    """
+
+    def __init__(
+        self,
+        initial_interval: float = POLL_INITIAL_INTERVAL,
+        max_interval: float = POLL_MAX_INTERVAL,
+        backoff_factor: float = POLL_BACKOFF_FACTOR,
+        jitter: float = POLL_JITTER,
+        max_polls_per_second: float = MAX_POLLS_PER_SECOND,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.initial_interval = initial_interval
+        self.max_interval = max_interval
+        self.backoff_factor = backoff_factor
+        self.jitter = jitter
+        self.max_polls_per_second = max_polls_per_second
+        self.clock = clock
+        self._queue = []
+        self._counter = itertools.count()
+        self._polls = {}
+        self._queued = set()
+        # Poll budget, refilled at max_polls_per_second up to one second's worth
+        self._burst = max(1.0, float(max_polls_per_second))
+        self._tokens = self._burst
+        self._refilled = clock()
+
+    def __len__(self) -> int:
+        return len(self._queue)
+
+    def interval(self, polls: int) -> float:
+        """Returns the jittered delay before the next poll of a snapshot
+
+        Args:
+            polls: the number of times the snapshot has been polled already
+        """
+        delay = min(
+            self.max_interval, self.initial_interval * self.backoff_factor**polls
+        )
+        return delay * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    def schedule(self, record: snapshot_utils.SnapshotRecord) -> None:
+        """Queues the next poll of a snapshot, unless it is already queued"""
+        if record.id in self._queued:
+            return
+        self._queued.add(record.id)
+        polls = self._polls.get(record.id, 0)
+        next_poll = self.clock() + self.interval(polls)
+        heapq.heappush(self._queue, (next_poll, next(self._counter), record))
+
+    def pop_due(self) -> List[snapshot_utils.SnapshotRecord]:
+        """Removes and returns the snapshots due for a poll, within the poll budget"""
+        now = self._refill()
+        due = []
+        while self._queue and self._queue[0][0] <= now and self._tokens >= 1:
+            _, _, record = heapq.heappop(self._queue)
+            self._queued.discard(record.id)
+            self._polls[record.id] = self._polls.get(record.id, 0) + 1
+            self._tokens -= 1
+            due.append(record)
+        return due
+
+    def next_poll_in(self) -> float:
+        """Returns the number of seconds until the next snapshot can be polled"""
+        if not self._queue:
+            return self.max_interval
+        now = self._refill()
+        until_due = self._queue[0][0] - now
+        until_budget = (1 - self._tokens) / self.max_polls_per_second
+        return max(0.0, until_due, until_budget)
+
+    def _refill(self) -> float:
+        """Adds the poll budget accrued since the last refill and returns the time"""
+        now = self.clock()
+        elapsed = now - self._refilled
+        self._tokens = min(
+            self._burst, self._tokens + elapsed * self.max_polls_per_second
+        )
+        self._refilled = now
+        return now
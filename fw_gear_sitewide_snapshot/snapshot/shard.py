@@ -0,0 +1,38 @@
+import hashlib
+
+
+def validate_shard(shard_index: int, shard_count: int) -> None:
+    """Raises a ValueError unless the shard index is one of `shard_count` shards"""
+    if shard_count < 1:
+        raise ValueError(f"shard count must be at least 1, got {shard_count}")
+    if not 0 <= shard_index < shard_count:
+        raise ValueError(
+            f"shard index must be between 0 and {shard_count - 1}, got {shard_index}"
+        )
+
+
+def shard_of(project_id: str, shard_count: int) -> int:
+    """Returns the shard a project belongs to
+
+    Projects are assigned by a hash of their ID rather than by finder order, so
+    every gear job agrees on the partition however the finder pages its results.
+
+    Args:
+        project_id: the ID of the project
+        shard_count: the number of shards
+    """
+    digest = hashlib.sha1(project_id.encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") % shard_count
+
+
+def project_in_shard(project_id: str, shard_index: int, shard_count: int) -> bool:
+    """Returns True if a project belongs to the given shard
+
+    Args:
+        project_id: the ID of the project
+        shard_index: the shard of this gear job, from 0 to `shard_count - 1`
+        shard_count: the number of shards
+    """
+    if shard_count == 1:
+        return True
+    return shard_of(project_id, shard_count) == shard_index
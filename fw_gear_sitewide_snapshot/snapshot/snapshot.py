@@ -1,68 +1,311 @@
 import logging
-import os
-from typing import List, Union
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+    Union,
+)
 
-import flywheel
-import fw_utils
-import pandas as pd
-from fw_client import FWClient
+from . import (
+    base,
+    incremental,
+    metrics,
+    pipeline,
+    project_index,
+    snapshot_store,
+    snapshot_utils,
+    targets,
+    transport,
+)
 
-from . import snapshot_utils
+if TYPE_CHECKING:
+    import flywheel
+    import fw_utils
+    from fw_client import FWClient
 
 log = logging.getLogger("TriggerSnapshots")
 
+# Items submitted to the worker pool ahead of the workers, per worker
+QUEUED_PER_WORKER = 2
 
-class Snapshotter:
+
+class Snapshotter(base.BaseSnapshotter):
     """A class for triggering snapshots on projects
 
+    API calls are made on a bounded pool of worker threads.
+
     Params:
         api_key: a flywheel api key
+        batch_name: a name to associate with this batch of snapshots
+        options: the options of `base.BaseSnapshotter`
     """
 
-    def __init__(self, api_key: str, batch_name=""):
-        self.snapshot_client = FWClient(
-            api_key=api_key,
-            client_name="Snapshotter",
-            client_version="0.1",
-        )
-        self.sdk_client = flywheel.Client(api_key=api_key)
-        self.batch_name = batch_name
-        self.snapshots = []
+    def __init__(self, api_key: str, batch_name="", **options):
+        super().__init__(batch_name, **options)
+        # The clients are built on first use, as a run may only need one of them
+        self.api_key = api_key
+        self._snapshot_client = None
+        self._sdk_client = None
+        self._client_lock = threading.Lock()
+        # Wakes the triggers waiting for room in the admission window
+        self._window_moved = threading.Condition()
+        # One keep-alive pool, sized to the workers, shared by both clients
+        self.transport = transport.SharedTransport(self.max_workers)
+
+    @property
+    def snapshot_client(self) -> "FWClient":
+        """The FWClient used for the snapshot endpoints"""
+        with self._client_lock:
+            if self._snapshot_client is None:
+                from fw_client import FWClient
+
+                self._snapshot_client = FWClient(
+                    api_key=self.api_key,
+                    client_name="Snapshotter",
+                    client_version="0.1",
+                    # The throttle retries 429 and 503, and backs off on them
+                    retry_status_forcelist=[502, 504],
+                    connect_timeout=transport.CONNECT_TIMEOUT,
+                    read_timeout=transport.READ_TIMEOUT,
+                )
+                # Retry-After is left to the throttle, which paces every worker
+                self.transport.mount(
+                    self._snapshot_client,
+                    self._snapshot_client.get_adapter("https://").max_retries.new(
+                        respect_retry_after_header=False
+                    ),
+                )
+        return self._snapshot_client
+
+    @snapshot_client.setter
+    def snapshot_client(self, client: "FWClient") -> None:
+        self._snapshot_client = client
+
+    @property
+    def sdk_client(self) -> "flywheel.Client":
+        """The flywheel SDK client used for the project finder and lookups"""
+        with self._client_lock:
+            if self._sdk_client is None:
+                import flywheel
+
+                self._sdk_client = flywheel.Client(api_key=self.api_key)
+                rest_client = self._sdk_client.api_client.rest_client
+                rest_client.connect_timeout = transport.CONNECT_TIMEOUT
+                rest_client.request_timeout = transport.READ_TIMEOUT
+                # The SDK keeps its own retries, as the finder is not throttled
+                self.transport.mount(rest_client.session)
+        return self._sdk_client
+
+    @sdk_client.setter
+    def sdk_client(self, client: "flywheel.Client") -> None:
+        self._sdk_client = client
+
+    def connection_stats(self) -> dict:
+        """Returns the connections opened and the requests sent over them"""
+        return self.transport.stats()
 
-    def trigger_snapshots_on_list(self, projects: List) -> pd.DataFrame:
+    def trigger_snapshots_on_list(self, projects: List) -> None:
         """Trigger snapshots on a list of project ids
 
         Args:
             projects: a list of project ids
-
-        Returns:
-            a dataframe of snapshot records
         """
-        for project_id in projects:
-            log.debug(f"Triggering snapshot on project {project_id} from list")
-            _ = self.make_snapshot_on_id(project_id)
+        projects = [p for p in projects if self.wanted(p)]
+        self.run_concurrently(self.make_snapshot_on_id, projects)
 
     def trigger_snapshots_on_filter(
         self,
         project_filter,
-    ) -> pd.DataFrame:
+    ) -> None:
         """Trigger snapshots on projects matching a filter
 
+        The filter may have several targets, finder filters, project IDs and
+        lookup paths, separated by semicolons.  A project matched by more than one
+        is snapshotted once.
+
         Args:
             project_filter: the filter to use
+        """
+        plan = targets.plan_targets(project_filter)
+        found = self.find_projects(plan)
+        projects = (p for p in found if self.wanted(p.get("_id")))
+
+        if self.estimator:
+            self.run_concurrently(
+                self.trigger_on_found, self.order_longest_first(projects)
+            )
+        else:
+            # Finder pages are fetched ahead, while the workers trigger snapshots
+            prefetched = self.metrics.timed_iter(
+                "find_wait", pipeline.prefetch(projects)
+            )
+            self.run_concurrently(self.trigger_on_found, prefetched)
+        self.log_triggered()
+
+    def trigger_on_found(
+        self, project: Union["flywheel.Project", "fw_utils.dicts.AttrDict"]
+    ) -> None:
+        """Triggers a snapshot on a project from the finder, unless it is skipped"""
+        if self.incremental and self.skip_if_unchanged(project):
+            return
+        log.debug(f"Filter triggered snapshot on project {project.get('label')}")
+        self.make_snapshot_on_project(project)
+
+    def find_projects(self, plan: targets.TargetPlan) -> Iterable:
+        """Returns the projects of a plan's targets, recording them in the index
+
+        Each filter is queried in turn, then the projects given by ID or path that
+        no filter found are resolved, and every project is returned once.  The
+        projects of a previous run's index are reused if it was made with the
+        same targets, rather than querying the finder.
+
+        Args:
+            plan: the filters and projects to find
+        """
+        found = self.reused_projects(plan)
+        if found is None:
+            found = (
+                project
+                for target, project in self.query_targets(plan)
+                if self.matches.match(project, target)
+            )
+        if self.index:
+            found = self.index.record(found, plan.key, self.indexed_targets(plan))
+        return found
+
+    def query_targets(self, plan: targets.TargetPlan) -> Iterator[Tuple[str, Any]]:
+        """Yields the projects of each target of a plan, with the target
+
+        A project given by ID or path is only resolved if no target before it
+        matched the project.
+        """
+        for project_filter in plan.filters:
+            found = self.metrics.timed_iter(
+                metrics.FIND,
+                self.sdk_client.projects.iter_find(
+                    project_filter,
+                    x_accept_feature=project_index.LEAN_FINDER_FEATURES,
+                    # The size of each project, to estimate its snapshot by
+                    **({"stats": True} if self.estimator else {}),
+                ),
+            )
+            for project in found:
+                yield project_filter, project
+        for target in self.targets_to_resolve(plan):
+            project = self.resolve_project(target)
+            if project is not None:
+                yield target, project
+
+    def resolve_project(self, target: str) -> Optional[Any]:
+        """Gets a project given by ID or lookup path
+
+        An error is logged and recorded in `self.errors`, like an error
+        triggering a snapshot.
 
         Returns:
-            a dataframe of snapshot records
+            the project, None if it could not be found
+        """
+        try:
+            if snapshot_utils.string_matches_id(target):
+                return self.get_project(target)
+            return self.lookup(target)
+        except Exception as e:
+            log.error(f"Unable to find project {target}: {e}")
+            self.record_error(target, e)
+            return None
+
+    def get_project(self, project_id: str) -> "flywheel.Project":
+        """Gets a project by ID"""
+        return self.call_api(
+            metrics.GET_PROJECT, self.sdk_client.get_project, project_id
+        )
+
+    def lookup(self, path: str) -> "flywheel.Project":
+        """Resolves a group/project path to a project"""
+        return self.call_api(metrics.LOOKUP, self.sdk_client.lookup, path)
+
+    def last_snapshot(self, project_id: str) -> Optional[snapshot_utils.SnapshotRecord]:
+        """Returns the last completed snapshot of a project, None if it has none
+
+        Args:
+            project_id: the ID of the project
         """
-        if project_filter == "ALL":
-            project_filter = ""
-        projects = self.sdk_client.projects.iter_find(project_filter)
-        for project in projects:
-            log.debug(f"Filter triggered snapshot on project {project.get('label')}")
-            _ = self.make_snapshot_on_project(project)
+        if self.last_snapshots is not None:
+            return self.last_snapshots.get(project_id)
+        return self.call_api(
+            metrics.LIST_SNAPSHOTS,
+            incremental.get_last_snapshot,
+            self.snapshot_client,
+            project_id,
+        )
+
+    def skip_if_unchanged(
+        self, project: Union["flywheel.Project", "fw_utils.dicts.AttrDict"]
+    ) -> bool:
+        """Records a project as skipped if it is unchanged since its last snapshot
+
+        Args:
+            project: a project from the finder
+
+        Returns:
+            True if the project was skipped, False if it needs a snapshot
+        """
+        # Without a modified time there is nothing to compare, so skip the lookup
+        if incremental.modified_time(project) is None:
+            return False
+        return self.skip_unchanged(project, self.last_snapshot(project.get("_id")))
+
+    def call_api(self, endpoint: str, func: Callable[..., Any], *args, **kwargs) -> Any:
+        """Calls a Flywheel API function through the throttle, measuring each call
+
+        Args:
+            endpoint: the name of the endpoint, for the metrics
+            func: the function calling the endpoint
+            args, kwargs: the arguments of the function
+        """
+        return self.throttle.call(self.metrics.timed(endpoint, func), *args, **kwargs)
+
+    def run_concurrently(self, func: Callable[[Any], Any], items: Iterable) -> None:
+        """Calls a function on every item using a bounded pool of worker threads
+
+        An error on one item is logged and recorded in `self.errors` rather than
+        aborting the rest of the batch.  Items are taken from `items` only as
+        workers free up, so a lazy iterable is never read far ahead.
+
+        Args:
+            func: the function to call on each item
+            items: the items to call the function on
+        """
+        if self.max_workers == 1:
+            for item in items:
+                self._call_and_record_errors(func, item)
+            return
+
+        # Bounds the items submitted but not yet done, so memory stays bounded
+        slots = threading.BoundedSemaphore(self.max_workers * QUEUED_PER_WORKER)
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            for item in items:
+                slots.acquire()
+                future = executor.submit(self._call_and_record_errors, func, item)
+                future.add_done_callback(lambda _: slots.release())
+
+    def _call_and_record_errors(self, func: Callable[[Any], Any], item: Any) -> None:
+        """Calls a function on an item, logging and recording any error raised"""
+        try:
+            func(item)
+        except Exception as e:
+            self.log_error(item, e)
 
     def make_snapshot_on_project(
-        self, project: Union[str, flywheel.Project, fw_utils.dicts.AttrDict]
+        self, project: Union[str, "flywheel.Project", "fw_utils.dicts.AttrDict"]
     ) -> str:
         """Make a snapshot on a project
 
@@ -76,20 +319,18 @@ class Snapshotter:
         # If a string is provided, it's an ID or a lookup path
         if isinstance(project, str):
             if snapshot_utils.string_matches_id(project):
+                # A cached project is known to exist, so there is no need to get it
+                if project in self.projects:
+                    return self.make_snapshot_on_id(project)
                 # Snapshots can be initiated on bogus project IDs as long as they're in the correct format.
                 # Ensure the project exists here by getting it
-                project = self.sdk_client.get_project(project)
+                project = self.get_project(project)
             else:
-                project = self.sdk_client.lookup(project)
+                project = self.lookup(project)
 
         # Otherwise it's an sdk project object or a FWClient project object,
         # either way they should have the "_id" attribute
-        project_id = project.get("_id")
-
-        if not project_id:
-            raise ValueError(f"no project ID found for project {project}")
-
-        return self.make_snapshot_on_id(project_id)
+        return self.make_snapshot_on_id(self.remember_project(project))
 
     def make_snapshot_on_id(self, project_id: str) -> str:
         """Make a snapshot on a project given a project ID
@@ -100,40 +341,143 @@ class Snapshotter:
         Returns:
             the ID of the snapshot
         """
-        response = snapshot_utils.make_snapshot(self.snapshot_client, project_id)
-        self.log_snapshot(response)
+        self.wait_for_admission()
+        try:
+            response = self.trigger(project_id)
+            self.log_snapshot(response)
+        finally:
+            self.release_admission()
         return response
 
-    def log_snapshot(self, response: dict) -> None:
+    def trigger(self, project_id: str) -> dict:
+        """Sends the request triggering a snapshot on a project"""
+        return self.call_api(
+            metrics.TRIGGER,
+            snapshot_utils.make_snapshot,
+            self.snapshot_client,
+            project_id,
+        )
+
+    def wait_for_admission(self) -> None:
+        """Waits until the admission window has room for one more snapshot
+
+        The wait is woken as snapshots finish or give back their room, and at the
+        latest once the window's stall timeout lets snapshots through.
+        """
+        if self.window is None:
+            return
+        waiting = time.monotonic()
+        with self._window_moved:
+            while not self.try_admit():
+                self._window_moved.wait(self.window.stall_timeout)
+        self.metrics.increment("window_wait_seconds", time.monotonic() - waiting)
+
+    def window_moved(self) -> None:
+        """Wakes the triggers waiting for room in the admission window"""
+        with self._window_moved:
+            self._window_moved.notify_all()
+
+    def log_snapshot(
+        self,
+        response: dict,
+        retrying: Optional[snapshot_store.CompactSnapshot] = None,
+    ) -> None:
         """Logs a snapshot response and adds it to the snapshot list
         Args:
             response: the response from the flywheel API
+            retrying: the failed snapshot this snapshot retries, if any
         """
 
         record = snapshot_utils.SnapshotRecord(**response)
+        project = self.projects.get(record.project_id)
+        if project is None:
+            project = self.projects.add(self.get_project(record.project_id))
+        self.add_snapshot(record, project, retrying)
+
+    def update_snapshots(
+        self, snapshots: Optional[Iterable[base.Snapshot]] = None
+    ) -> None:
+        """Fetches updates on the status of the snapshots in the snapshot list and updates them in place
+
+        Args:
+            snapshots: the snapshots to update, defaults to every unfinished snapshot
+        """
+        self.run_concurrently(self.update_snapshot, self.snapshots_to_update(snapshots))
 
-        project_id = record.parents.project
-        project = self.sdk_client.get_project(project_id)
+    def update_snapshot(self, record: base.Snapshot) -> None:
+        """Fetches the status of a single snapshot and updates it in place
 
-        record.project_label = project.label
-        record.group_label = project.group
-        record.batch_label = self.batch_name
+        Errors are logged and leave the status unchanged, so that the snapshot is
+        simply checked again on the next poll.
 
-        self.snapshots.append(record)
+        Args:
+            record: the snapshot to update
+        """
+        detail = self.fetch_status(record)
+        if detail is not None:
+            self.record_status(record, detail.status, detail.finished)
+
+    def refresh_statuses(self, records: List[snapshot_utils.SnapshotRecord]) -> None:
+        """Fetches the status of snapshots that are not part of this run
 
-    def update_snapshots(self) -> None:
-        """Fetches updates on the status of the snapshots in the snapshot list and updates them in place"""
-        [s.update(self.snapshot_client) for s in self.snapshots if not s.is_final()]
+        Used for the snapshots of a previous report, whose status is only set,
+        without journaling, moving the window or downloading them.
 
-    def is_finished(self) -> bool:
-        """Returns True if all snapshots are finished, False otherwise"""
-        return all([s.is_final() for s in self.snapshots])
+        Args:
+            records: the snapshots to refresh
+        """
+        self.run_concurrently(self.refresh_status, records)
 
-    def save_snapshot_report(self, report_path: os.PathLike) -> None:
-        """Saves the snapshot report to a CSV file"""
-        df = self.reports_to_df()
-        df.to_csv(report_path, index=False)
+    def refresh_status(self, record: snapshot_utils.SnapshotRecord) -> None:
+        """Sets the status of a snapshot that is not part of this run"""
+        detail = self.fetch_status(record)
+        if detail is not None:
+            record.status = detail.status
 
-    def reports_to_df(self) -> pd.DataFrame:
-        """Converts the snapshot reports to a dataframe"""
-        return pd.DataFrame([s.to_series() for s in self.snapshots])
+    def fetch_status(
+        self, record: base.Snapshot
+    ) -> Optional[snapshot_utils.SnapshotStatus]:
+        """Returns the status of a snapshot, None if it could not be fetched"""
+        try:
+            return self.call_api(
+                metrics.STATUS,
+                snapshot_utils.get_snapshot_detail,
+                self.snapshot_client,
+                record.project_id,
+                record.id,
+                timeout=snapshot_utils.STATUS_REQUEST_TIMEOUT,
+            )
+        except Exception as e:
+            log.warning(f"Unable to update the status of snapshot {record.id}: {e}")
+            return None
+
+    def retry_failed_snapshots(self) -> int:
+        """Triggers again the failed snapshots whose backoff has passed
+
+        Returns:
+            the number of snapshots retried
+        """
+        due = self.admit_retries()
+        self.run_concurrently(self.retry_snapshot, due)
+        return len(due)
+
+    def retry_snapshot(self, record: snapshot_store.CompactSnapshot) -> None:
+        """Triggers a new snapshot on the project of a failed snapshot
+
+        The new snapshot takes the place of the failed one in the snapshot list.
+        The window must have admitted it.  A trigger request that fails counts as
+        an attempt, and is retried again after a backoff while attempts are left.
+
+        Args:
+            record: the failed snapshot
+        """
+        try:
+            try:
+                response = self.trigger(record.project_id)
+            except Exception as e:
+                if self.retry_again(record, e):
+                    return
+                raise
+            self.log_snapshot(response, retrying=record)
+        finally:
+            self.release_admission()
@@ -0,0 +1,273 @@
+import collections
+import datetime
+import sys
+import threading
+from typing import Dict, Iterable, Iterator, List, Optional, Union
+
+from . import snapshot_utils
+
+
+class CompactSnapshot:
+    """A snapshot as held in memory for the length of a run
+
+    A slotted stand-in for `snapshot_utils.SnapshotRecord`, which stays the model
+    of API responses, journal lines and report rows.  Group and batch labels and
+    matched filters, shared by many snapshots, are interned, and the status is a
+    `SnapshotState` member rather than a string.
+    """
+
+    __slots__ = (
+        "id",
+        "project_id",
+        "created",
+        "status",
+        "group_label",
+        "project_label",
+        "batch_label",
+        "estimated_seconds",
+        "duration_seconds",
+        "attempt",
+        "history",
+        "matched_filter",
+    )
+
+    def __init__(
+        self,
+        id: str,
+        project_id: str,
+        created: datetime.datetime,
+        status: snapshot_utils.SnapshotState = snapshot_utils.SnapshotState.pending,
+        group_label: str = "",
+        project_label: str = "",
+        batch_label: str = "",
+        estimated_seconds: Optional[float] = None,
+        duration_seconds: Optional[float] = None,
+        attempt: int = 1,
+        history: Iterable[str] = (),
+        matched_filter: str = "",
+    ):
+        self.id = id
+        self.project_id = project_id
+        self.created = created
+        self.status = snapshot_utils.SnapshotState(status)
+        self.group_label = sys.intern(group_label)
+        self.project_label = project_label
+        self.batch_label = sys.intern(batch_label)
+        self.estimated_seconds = estimated_seconds
+        self.duration_seconds = duration_seconds
+        self.attempt = attempt
+        self.history = tuple(history)
+        self.matched_filter = sys.intern(matched_filter)
+
+    def __repr__(self) -> str:
+        return (
+            f"CompactSnapshot(id={self.id!r}, project_id={self.project_id!r}, "
+            f"status={self.status.value!r})"
+        )
+
+    @classmethod
+    def from_record(cls, record: snapshot_utils.SnapshotRecord) -> "CompactSnapshot":
+        return cls(
+            id=record.id,
+            project_id=record.parents.project,
+            created=record.created,
+            status=record.status,
+            group_label=record.group_label,
+            project_label=record.project_label,
+            batch_label=record.batch_label,
+            estimated_seconds=record.estimated_seconds,
+            duration_seconds=record.duration_seconds,
+            attempt=record.attempt,
+            history=record.history,
+            matched_filter=record.matched_filter,
+        )
+
+    def to_record(self) -> snapshot_utils.SnapshotRecord:
+        return snapshot_utils.SnapshotRecord(
+            _id=self.id,
+            created=self.created,
+            status=self.status,
+            parents=snapshot_utils.SnapshotParents(project=self.project_id),
+            group_label=self.group_label,
+            project_label=self.project_label,
+            batch_label=self.batch_label,
+            estimated_seconds=self.estimated_seconds,
+            duration_seconds=self.duration_seconds,
+            attempt=self.attempt,
+            history=list(self.history),
+            matched_filter=self.matched_filter,
+        )
+
+    def is_final(self) -> bool:
+        """Helper that indicates whether or not this is a terminal state"""
+        return self.status.is_final()
+
+    def to_row(self) -> dict:
+        """Returns the snapshot report row for this snapshot"""
+        return {
+            snapshot_utils.GROUP_LABEL: self.group_label,
+            snapshot_utils.PROJECT_LABEL: self.project_label,
+            snapshot_utils.PROJECT_ID: self.project_id,
+            snapshot_utils.SNAPSHOT_ID: self.id,
+            snapshot_utils.TIMESTAMP: self.created.strftime(
+                snapshot_utils.RECORD_TIMESTAMP_FORMAT
+            ),
+            snapshot_utils.BATCH_LABEL: self.batch_label,
+            snapshot_utils.STATUS: self.status.value,
+            snapshot_utils.ESTIMATED_SECONDS: snapshot_utils.format_seconds(
+                self.estimated_seconds
+            ),
+            snapshot_utils.DURATION_SECONDS: snapshot_utils.format_seconds(
+                self.duration_seconds
+            ),
+            snapshot_utils.ATTEMPT: str(self.attempt),
+            snapshot_utils.SNAPSHOT_HISTORY: snapshot_utils.HISTORY_SEPARATOR.join(
+                self.history
+            ),
+            snapshot_utils.MATCHED_FILTER: self.matched_filter,
+        }
+
+
+class SnapshotStore:
+    """The thread-safe list of the snapshots of a run
+
+    Besides the snapshots in the order they were added, an index of the ones not
+    in a final state is kept up to date as statuses change, so that checking
+    whether a run is finished, or picking the snapshots to poll, does not scan
+    every snapshot.  The position of each snapshot is kept too, so a retry takes
+    the place of the snapshot it retries without a scan either.
+
+    Params:
+        records: the snapshots to start with
+    """
+
+    def __init__(
+        self,
+        records: Iterable[Union[snapshot_utils.SnapshotRecord, CompactSnapshot]] = (),
+    ):
+        self._snapshots: List[CompactSnapshot] = []
+        self._by_id: Dict[str, CompactSnapshot] = {}
+        # The index of each snapshot in `_snapshots`, by snapshot ID
+        self._positions: Dict[str, int] = {}
+        # An insertion-ordered set of the unfinished snapshots
+        self._pending: Dict[CompactSnapshot, None] = {}
+        self._counts = collections.Counter()
+        self._lock = threading.Lock()
+        for record in records:
+            self.add(record)
+
+    def __len__(self) -> int:
+        return len(self._snapshots)
+
+    def __iter__(self) -> Iterator[CompactSnapshot]:
+        return iter(self._snapshots)
+
+    def __getitem__(self, index: int) -> CompactSnapshot:
+        return self._snapshots[index]
+
+    def add(
+        self, record: Union[snapshot_utils.SnapshotRecord, CompactSnapshot]
+    ) -> CompactSnapshot:
+        """Adds a snapshot
+
+        Args:
+            record: the snapshot, stored compactly if it is a `SnapshotRecord`
+
+        Returns:
+            the stored snapshot
+        """
+        if not isinstance(record, CompactSnapshot):
+            record = CompactSnapshot.from_record(record)
+        with self._lock:
+            self._positions[record.id] = len(self._snapshots)
+            self._snapshots.append(record)
+            self._by_id[record.id] = record
+            self._counts[record.status] += 1
+            if not record.is_final():
+                self._pending[record] = None
+        return record
+
+    def replace(
+        self,
+        old: CompactSnapshot,
+        new: Union[snapshot_utils.SnapshotRecord, CompactSnapshot],
+    ) -> CompactSnapshot:
+        """Replaces a snapshot with its retry, which takes its place in the list
+
+        Args:
+            old: the stored snapshot being retried
+            new: the snapshot retrying it
+
+        Returns:
+            the stored retry
+        """
+        if not isinstance(new, CompactSnapshot):
+            new = CompactSnapshot.from_record(new)
+        with self._lock:
+            position = self._positions.pop(old.id)
+            self._snapshots[position] = new
+            self._positions[new.id] = position
+            self._by_id.pop(old.id, None)
+            self._by_id[new.id] = new
+            self._counts[old.status] -= 1
+            self._counts[new.status] += 1
+            self._pending.pop(old, None)
+            if not new.is_final():
+                self._pending[new] = None
+        return new
+
+    def get(self, snapshot_id: str) -> Optional[CompactSnapshot]:
+        """Returns the snapshot with the given ID, or None if there is none"""
+        return self._by_id.get(snapshot_id)
+
+    def set_status(
+        self,
+        record: Union[snapshot_utils.SnapshotRecord, CompactSnapshot],
+        status: snapshot_utils.SnapshotState,
+        finished: Optional[datetime.datetime] = None,
+    ) -> bool:
+        """Sets the status of a snapshot, keeping the index of unfinished ones
+
+        A `SnapshotRecord`, e.g. one read from a previous report rather than held
+        by the store, simply has its status set.  A snapshot held by the store
+        records how long it took when it first reaches a final state.
+
+        Args:
+            record: the snapshot
+            status: its new status
+            finished: when the snapshot finished, if the server says, or else
+                it is taken to have finished now
+
+        Returns:
+            True if the status changed
+        """
+        with self._lock:
+            previous = record.status
+            if status == previous:
+                return False
+            record.status = status
+            if isinstance(record, CompactSnapshot):
+                self._counts[previous] -= 1
+                self._counts[status] += 1
+                if status.is_final():
+                    self._pending.pop(record, None)
+                    if record.duration_seconds is None:
+                        record.duration_seconds = snapshot_utils.seconds_since(
+                            record.created, finished
+                        )
+                else:
+                    self._pending[record] = None
+        return True
+
+    def pending(self) -> List[CompactSnapshot]:
+        """Returns the snapshots not in a final state, in the order they were added"""
+        with self._lock:
+            return list(self._pending)
+
+    def pending_count(self) -> int:
+        """Returns the number of snapshots not in a final state"""
+        return len(self._pending)
+
+    def count(self, status: snapshot_utils.SnapshotState) -> int:
+        """Returns the number of snapshots in a status"""
+        return self._counts[status]
@@ -2,16 +2,21 @@ import datetime
 import logging
 import re
 from enum import Enum
+from typing import TYPE_CHECKING, List, Mapping, Optional
 
-import pandas as pd
-from fw_client import FWClient
 from fw_http_client.errors import NotFound
 from pydantic import BaseModel, Field
-from requests import Response
+
+if TYPE_CHECKING:
+    import pandas as pd
+    from fw_client import FWClient
+    from requests import Response
 
 CONTAINER_ID_FORMAT = "^[0-9a-fA-F]{24}$"
 SNAPSHOT_TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%S.%f%z"
 RECORD_TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M"
+# Seconds to wait for a single snapshot status request before giving up on it
+STATUS_REQUEST_TIMEOUT = 30
 
 # Row names for the series that will be used to create the snapshot record dataframe
 GROUP_LABEL = "group_label"
@@ -21,6 +26,13 @@ SNAPSHOT_ID = "snapshot_id"
 TIMESTAMP = "timestamp"
 BATCH_LABEL = "batch_label"
 STATUS = "status"
+ESTIMATED_SECONDS = "estimated_seconds"
+DURATION_SECONDS = "duration_seconds"
+ATTEMPT = "attempt"
+SNAPSHOT_HISTORY = "snapshot_history"
+MATCHED_FILTER = "matched_filter"
+# Separates the IDs of the earlier snapshots of a project in a report cell
+HISTORY_SEPARATOR = ";"
 
 log = logging.getLogger("SnapshotUtils")
 
@@ -32,10 +44,58 @@ class SnapshotState(str, Enum):
     in_progress = "in_progress"
     complete = "complete"
     failed = "failed"
+    # Not a server state: the project was unchanged since its last snapshot
+    skipped = "skipped"
 
     def is_final(self) -> bool:
         """Helper that indicates whether or not this is a terminal state"""
-        return self in (SnapshotState.complete, SnapshotState.failed)
+        return self in (
+            SnapshotState.complete,
+            SnapshotState.failed,
+            SnapshotState.skipped,
+        )
+
+
+def parse_seconds(value: Optional[str]) -> Optional[float]:
+    """Parses a number of seconds from a report cell, None if the cell is empty"""
+    return float(value) if value not in (None, "") else None
+
+
+def format_seconds(seconds: Optional[float]) -> str:
+    """Formats a number of seconds for a report cell, empty if it is not known"""
+    return "" if seconds is None else f"{seconds:.1f}"
+
+
+def parse_history(value: Optional[str]) -> List[str]:
+    """Parses the IDs of a project's earlier snapshots from a report cell"""
+    return value.split(HISTORY_SEPARATOR) if value else []
+
+
+def utc_naive(timestamp: datetime.datetime) -> datetime.datetime:
+    """Converts a timestamp to naive UTC, the timezone of report timestamps"""
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone(datetime.timezone.utc)
+    return timestamp.replace(tzinfo=None)
+
+
+def utc_aware(timestamp: datetime.datetime) -> datetime.datetime:
+    """Converts a timestamp to aware UTC, taking a naive one as UTC already"""
+    if timestamp.tzinfo is None:
+        return timestamp.replace(tzinfo=datetime.timezone.utc)
+    return timestamp.astimezone(datetime.timezone.utc)
+
+
+def seconds_since(
+    created: datetime.datetime, until: Optional[datetime.datetime] = None
+) -> float:
+    """Returns the seconds from a snapshot's creation until a time, or until now
+
+    Naive timestamps are taken as UTC, like report timestamps, whatever the
+    timezone of the host.
+    """
+    if until is None:
+        until = datetime.datetime.now(datetime.timezone.utc)
+    return max(0.0, (utc_aware(until) - utc_aware(created)).total_seconds())
 
 
 class SnapshotParents(BaseModel):
@@ -44,6 +104,21 @@ class SnapshotParents(BaseModel):
     project: str
 
 
+class SnapshotStatus(BaseModel):
+    """The status of a snapshot, from the response of its detail endpoint"""
+
+    status: SnapshotState
+    completed: Optional[datetime.datetime] = None
+    modified: Optional[datetime.datetime] = None
+
+    @property
+    def finished(self) -> Optional[datetime.datetime]:
+        """Returns when a final snapshot finished, if the response says"""
+        if not self.status.is_final():
+            return None
+        return self.completed or self.modified
+
+
 class SnapshotRecord(BaseModel):
     id: str = Field(alias="_id")
     created: datetime.datetime = datetime.datetime.now()
@@ -52,13 +127,30 @@ class SnapshotRecord(BaseModel):
     group_label: str = ""
     project_label: str = ""
     batch_label: str = ""
+    # The seconds the snapshot was expected to take, and took once final
+    estimated_seconds: Optional[float] = None
+    duration_seconds: Optional[float] = None
+    # The attempt at snapshotting the project, and the IDs of the failed attempts
+    # that this snapshot retries
+    attempt: int = 1
+    history: List[str] = []
+    # The filter, project ID or path of the project filter that matched the project
+    matched_filter: str = ""
 
-    def update(self, client) -> None:
-        """Updates the snapshot status"""
-        snapshot = client.get(
-            f"/snapshot/projects/{self.parents.project}/snapshots/{self.id}/detail"
+    @property
+    def project_id(self) -> str:
+        return self.parents.project
+
+    def update(self, client, timeout: Optional[float] = None) -> None:
+        """Updates the snapshot status
+
+        Args:
+            client: a flywheel client
+            timeout: seconds to wait for the response, defaults to the client's own
+        """
+        self.status = get_snapshot_status(
+            client, self.parents.project, self.id, timeout=timeout
         )
-        self.status = SnapshotState(snapshot.status)
 
     def is_final(self) -> bool:
         """Helper that indicates whether or not this is a terminal state"""
@@ -68,19 +160,56 @@ class SnapshotRecord(BaseModel):
         """Get a formatted timestamp from a snapshot"""
         return datetime.datetime.strftime(self.created, RECORD_TIMESTAMP_FORMAT)
 
-    def to_series(self):
-        return pd.Series(
-            {
-                GROUP_LABEL: self.group_label,
-                PROJECT_LABEL: self.project_label,
-                PROJECT_ID: self.parents.project,
-                SNAPSHOT_ID: self.id,
-                TIMESTAMP: self.format_timestamp(),
-                BATCH_LABEL: self.batch_label,
-                STATUS: self.status,
-            }
+    def to_row(self) -> dict:
+        """Returns the snapshot report row for this snapshot"""
+        return {
+            GROUP_LABEL: self.group_label,
+            PROJECT_LABEL: self.project_label,
+            PROJECT_ID: self.parents.project,
+            SNAPSHOT_ID: self.id,
+            TIMESTAMP: self.format_timestamp(),
+            BATCH_LABEL: self.batch_label,
+            STATUS: self.status.value,
+            ESTIMATED_SECONDS: format_seconds(self.estimated_seconds),
+            DURATION_SECONDS: format_seconds(self.duration_seconds),
+            ATTEMPT: str(self.attempt),
+            SNAPSHOT_HISTORY: HISTORY_SEPARATOR.join(self.history),
+            MATCHED_FILTER: self.matched_filter,
+        }
+
+    def to_series(self) -> "pd.Series":
+        import pandas as pd
+
+        return pd.Series(self.to_row())
+
+    @classmethod
+    def from_row(cls, row: Mapping) -> "SnapshotRecord":
+        """Creates a snapshot record from a snapshot report row
+
+        Reports written before durations, retries or matched filters were
+        recorded have no estimate, duration, attempt, history or filter columns.
+
+        Args:
+            row: a report row, e.g. a dict or a pandas series, keyed by column name
+        """
+        return cls(
+            _id=row[SNAPSHOT_ID],
+            created=datetime.datetime.strptime(row[TIMESTAMP], RECORD_TIMESTAMP_FORMAT),
+            status=SnapshotState(row[STATUS]),
+            parents=SnapshotParents(project=row[PROJECT_ID]),
+            group_label=row[GROUP_LABEL],
+            project_label=row[PROJECT_LABEL],
+            batch_label=row[BATCH_LABEL],
+            estimated_seconds=parse_seconds(row.get(ESTIMATED_SECONDS)),
+            duration_seconds=parse_seconds(row.get(DURATION_SECONDS)),
+            attempt=int(row.get(ATTEMPT) or 1),
+            history=parse_history(row.get(SNAPSHOT_HISTORY)),
+            matched_filter=row.get(MATCHED_FILTER) or "",
         )
 
+    # A pandas series is a mapping of column names to values
+    from_series = from_row
+
 
 def string_matches_id(string: str) -> bool:
     """determines if a string matches the flywheel ID format
@@ -92,7 +221,7 @@ def string_matches_id(string: str) -> bool:
     return True if re.fullmatch(CONTAINER_ID_FORMAT, string) else False
 
 
-def make_snapshot(client: FWClient, project_id: str) -> Response:
+def make_snapshot(client: "FWClient", project_id: str) -> "Response":
     """makes a snapshot on a project
     Args:
         client: a flywheel client
@@ -104,7 +233,47 @@ def make_snapshot(client: FWClient, project_id: str) -> Response:
     return client.post(f"/snapshot/projects/{project_id}/snapshots")
 
 
-def get_snapshot(client: FWClient, project_id: str, snapshot_id: str) -> dict:
+def get_snapshot_status(
+    client: "FWClient",
+    project_id: str,
+    snapshot_id: str,
+    timeout: Optional[float] = None,
+) -> SnapshotState:
+    """gets the status of a snapshot
+    Args:
+        client: a flywheel client
+        project_id: the ID of the project the snapshot is on
+        snapshot_id: the ID of the snapshot
+        timeout: seconds to wait for the response, defaults to the client's own
+    Returns:
+        the status of the snapshot
+    """
+    return get_snapshot_detail(client, project_id, snapshot_id, timeout).status
+
+
+def get_snapshot_detail(
+    client: "FWClient",
+    project_id: str,
+    snapshot_id: str,
+    timeout: Optional[float] = None,
+) -> SnapshotStatus:
+    """gets the status of a snapshot, with when it finished if the server says
+    Args:
+        client: a flywheel client
+        project_id: the ID of the project the snapshot is on
+        snapshot_id: the ID of the snapshot
+        timeout: seconds to wait for the response, defaults to the client's own
+    Returns:
+        the status of the snapshot
+    """
+    kwargs = {"timeout": timeout} if timeout else {}
+    snapshot = client.get(
+        f"/snapshot/projects/{project_id}/snapshots/{snapshot_id}/detail", **kwargs
+    )
+    return SnapshotStatus.parse_obj(dict(snapshot))
+
+
+def get_snapshot(client: "FWClient", project_id: str, snapshot_id: str) -> dict:
     """gets a snapshot from a project
     Args:
         client: a flywheel client
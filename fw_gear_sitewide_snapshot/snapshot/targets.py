@@ -0,0 +1,171 @@
+import logging
+import re
+from typing import Any, Dict, FrozenSet, Iterable, Iterator, List, Set
+
+from . import snapshot_utils
+
+log = logging.getLogger("SnapshotTargets")
+
+# The filter matching every project
+ALL_PROJECTS = "ALL"
+# Separates the targets of the project filter: finder filters, project IDs and
+# group/project lookup paths
+TARGET_SEPARATOR = ";"
+TARGET_SPLIT_RE = re.compile(r"[;\n]")
+# Finder filters compare a field to a value, project IDs and paths do not
+FILTER_OPERATOR_RE = re.compile(r"[=<>]")
+
+
+def is_filter(target: str) -> bool:
+    """Returns True if a target is a finder filter, not a project ID or path"""
+    return bool(FILTER_OPERATOR_RE.search(target))
+
+
+def filter_terms(project_filter: str) -> FrozenSet[str]:
+    """Returns the comma separated conditions of a finder filter, all of which match"""
+    return frozenset(t.strip() for t in project_filter.split(",") if t.strip())
+
+
+def target_label(target: str) -> str:
+    """Returns the name of a target in the report, "ALL" for every project"""
+    return target or ALL_PROJECTS
+
+
+class TargetPlan:
+    """The finder queries and explicit projects that select the projects of a run
+
+    Params:
+        filters: the finder filters to query, in order, "" for every project
+        projects: the IDs and lookup paths of projects to snapshot
+    """
+
+    def __init__(self, filters: List[str], projects: List[str]):
+        self.filters = filters
+        self.projects = projects
+
+    def __repr__(self) -> str:
+        return f"TargetPlan(filters={self.filters!r}, projects={self.projects!r})"
+
+    @property
+    def key(self) -> str:
+        """The targets as one string, the filter recorded in the project index
+
+        A plan of a single filter is keyed by that filter, as indexes were before
+        several targets could be given.
+        """
+        return TARGET_SEPARATOR.join(self.filters + self.projects)
+
+    def is_batch(self) -> bool:
+        """Returns True if the plan has more than one target"""
+        return len(self.filters) + len(self.projects) > 1
+
+
+def plan_targets(project_filter: str) -> TargetPlan:
+    """Plans the finder queries for a project filter of one or more targets
+
+    Targets are separated by semicolons or new lines, and are either finder
+    filters, project IDs or group/project lookup paths.  Repeated targets are
+    dropped, as are filters with every condition of another filter, whose
+    projects the other filter already finds.  A filter of "ALL" finds every
+    project, so it is then the only target queried.
+
+    Args:
+        project_filter: the targets, e.g. "group=a; label=~^b; group/project"
+
+    Returns:
+        the filters to query and the projects to resolve, in the order given
+    """
+    given = []
+    for target in TARGET_SPLIT_RE.split(project_filter or ""):
+        target = target.strip()
+        if target and target not in given:
+            given.append(target)
+
+    if ALL_PROJECTS in given:
+        if len(given) > 1:
+            log.info(
+                f"'{ALL_PROJECTS}' matches every project, so the other "
+                f"{len(given) - 1} targets are not queried"
+            )
+        return TargetPlan(filters=[""], projects=[])
+
+    filters = []
+    for target in filter(is_filter, given):
+        terms = filter_terms(target)
+        if any(filter_terms(kept) <= terms for kept in filters):
+            log.info(f"Not querying {target!r}, another filter finds its projects")
+            continue
+        subsumed = [kept for kept in filters if terms < filter_terms(kept)]
+        for kept in subsumed:
+            log.info(f"Not querying {kept!r}, {target!r} finds its projects")
+        filters = [kept for kept in filters if kept not in subsumed] + [target]
+    projects = [target for target in given if not is_filter(target)]
+    return TargetPlan(filters=filters, projects=projects)
+
+
+class ProjectMatches:
+    """The target that first matched each project of a run
+
+    Projects matched by more than one target, or given explicitly as well as
+    found by a filter, are triggered once, for the first target that matched.
+    """
+
+    def __init__(self):
+        self.targets: Dict[str, str] = {}
+        self.duplicates = 0
+        self._paths: Set[str] = set()
+
+    def __len__(self) -> int:
+        return len(self.targets)
+
+    def match(self, project: Any, target: str) -> bool:
+        """Records the target a project matched
+
+        Args:
+            project: a project from the finder or a lookup
+            target: the filter, project ID or path it matched
+
+        Returns:
+            True if no target matched the project before
+        """
+        project_id = project.get("_id")
+        if project_id in self.targets:
+            self.duplicates += 1
+            return False
+        self.targets[project_id] = target_label(target)
+        self._paths.add(f"{project.get('group')}/{project.get('label')}")
+        return True
+
+    def covers(self, target: str) -> bool:
+        """Returns True if a project ID or path is of a project already matched
+
+        A project already matched is not looked up again.
+        """
+        if target in self.targets or target in self._paths:
+            self.duplicates += 1
+            return True
+        return False
+
+    def restore(self, projects: Iterable[dict], default: str) -> Iterator[dict]:
+        """Yields indexed projects, recording the targets they matched in the index
+
+        Args:
+            projects: the projects of a previous run's index
+            default: the target of projects indexed without one, i.e. the only
+                target of the run
+        """
+        for project in projects:
+            target = project.get(snapshot_utils.MATCHED_FILTER) or default
+            if self.match(project, target):
+                yield project
+
+    def get(self, project_id: str) -> str:
+        """Returns the target a project matched, "" if it was not matched"""
+        return self.targets.get(project_id, "")
+
+    def log_duplicates(self) -> None:
+        if self.duplicates:
+            log.info(
+                f"{self.duplicates} projects were matched by more than one target, "
+                "and are snapshotted once"
+            )
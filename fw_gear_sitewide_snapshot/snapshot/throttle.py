@@ -0,0 +1,315 @@
+import asyncio
+import datetime
+import email.utils
+import logging
+import random
+import sys
+import threading
+import time
+from typing import TYPE_CHECKING, Any, Callable, Optional
+
+if TYPE_CHECKING:
+    from .metrics import Metrics
+
+log = logging.getLogger("Throttle")
+
+MAX_REQUESTS_PER_SECOND = 20
+# Responses that mean the server wants us to slow down
+THROTTLE_STATUSES = (429, 503)
+MAX_RETRIES = 5
+RETRY_BACKOFF = 1.0  # seconds, doubled on every retry
+RETRY_MAX_BACKOFF = 60.0  # seconds
+# Consecutive failures that open the circuit, and how long it stays open
+FAILURE_THRESHOLD = 5
+CIRCUIT_COOLDOWN = 30.0  # seconds
+
+
+def status_code(error: Exception) -> Optional[int]:
+    """Returns the HTTP status of an error raised by FWClient, the SDK or httpx"""
+    response = getattr(error, "response", None)
+    status = getattr(response, "status_code", None)
+    if status is None:
+        # flywheel.ApiException carries the status itself
+        status = getattr(error, "status", None)
+    return status if isinstance(status, int) else None
+
+
+def retry_after(error: Exception) -> Optional[float]:
+    """Returns the seconds to wait from an error's Retry-After header, if any"""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or getattr(error, "headers", None)
+    value = headers.get("Retry-After") if headers else None
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    now = datetime.datetime.now(datetime.timezone.utc)
+    return max(0.0, (retry_at - now).total_seconds())
+
+
+def is_failure(error: Exception) -> bool:
+    """Returns True if an error suggests the server is unhealthy"""
+    status = status_code(error)
+    if status is None:
+        # No response at all, e.g. a connection error or a timeout.  httpx is only
+        # loaded by the asyncio engine, and its errors cannot occur without it
+        httpx = sys.modules.get("httpx")
+        if httpx and isinstance(error, httpx.TransportError):
+            return True
+        return isinstance(error, OSError)
+    return status >= 500
+
+
+class TokenBucket:
+    """A thread-safe token bucket limiting the rate of requests
+
+    Params:
+        rate: the tokens added per second
+        burst: the most tokens the bucket holds, defaults to one second's worth
+        clock: a monotonic clock returning seconds
+    """
+
+    def __init__(
+        self,
+        rate: float,
+        burst: Optional[float] = None,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.rate = rate
+        self.burst = burst or max(1.0, rate)
+        self.clock = clock
+        self._tokens = self.burst
+        self._refilled = clock()
+        self._lock = threading.Lock()
+
+    def reserve(self) -> float:
+        """Takes a token and returns the seconds to wait before it may be used"""
+        with self._lock:
+            now = self.clock()
+            self._tokens = min(
+                self.burst, self._tokens + (now - self._refilled) * self.rate
+            )
+            self._refilled = now
+            self._tokens -= 1
+            return 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+
+
+class AdaptiveConcurrency:
+    """An AIMD limit on the number of requests in flight
+
+    The limit grows by one for every `limit` successful requests, and is cut by
+    `decrease_factor` whenever the server throttles a request.  Threads waiting
+    for a slot are woken as slots are released, as many as there are free slots.
+
+    Params:
+        max_limit: the highest the limit can grow
+        min_limit: the lowest the limit can shrink
+        decrease_factor: the multiplier applied to the limit on throttling
+    """
+
+    def __init__(
+        self, max_limit: int, min_limit: int = 1, decrease_factor: float = 0.5
+    ):
+        self.max_limit = max(min_limit, max_limit)
+        self.min_limit = min_limit
+        self.decrease_factor = decrease_factor
+        self.limit = float(self.max_limit)
+        self.in_flight = 0
+        self._lock = threading.Lock()
+        self._released = threading.Condition(self._lock)
+
+    def free_slots(self) -> int:
+        """Returns the number of requests that may start now"""
+        return max(0, int(self.limit) - self.in_flight)
+
+    def try_acquire(self) -> bool:
+        """Takes a slot if one is free, returning True if it was taken"""
+        with self._lock:
+            if self.free_slots():
+                self.in_flight += 1
+                return True
+            return False
+
+    def acquire(self) -> None:
+        """Takes a slot, waiting for one to be released if none is free"""
+        with self._released:
+            self._released.wait_for(self.free_slots)
+            self.in_flight += 1
+
+    def release(self, throttled: bool = False) -> None:
+        """Frees a slot and adjusts the limit to the outcome of the request"""
+        with self._released:
+            self.in_flight -= 1
+            if throttled:
+                self.limit = max(self.min_limit, self.limit * self.decrease_factor)
+            else:
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            self._released.notify(self.free_slots())
+
+
+class CircuitBreaker:
+    """Stops sending requests for a while after repeated failures
+
+    Once `failure_threshold` requests fail in a row the circuit opens for
+    `cooldown` seconds.  After that, requests are let through again and the next
+    failure re-opens it, while a success closes it.
+
+    Params:
+        failure_threshold: the consecutive failures that open the circuit
+        cooldown: the seconds the circuit stays open
+        clock: a monotonic clock returning seconds
+    """
+
+    def __init__(
+        self,
+        failure_threshold: int = FAILURE_THRESHOLD,
+        cooldown: float = CIRCUIT_COOLDOWN,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.clock = clock
+        self.failures = 0
+        self._opened = None
+        self._lock = threading.Lock()
+
+    def wait_time(self) -> float:
+        """Returns the seconds until requests are allowed, 0 if they are now"""
+        with self._lock:
+            if self._opened is None:
+                return 0.0
+            return max(0.0, self._opened + self.cooldown - self.clock())
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.failures = 0
+            self._opened = None
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.failure_threshold:
+                if self._opened is None:
+                    log.warning(
+                        f"{self.failures} consecutive API failures, pausing requests "
+                        f"for {self.cooldown} seconds"
+                    )
+                self._opened = self.clock()
+
+
+class Throttle:
+    """Rate limits, retries and adapts the concurrency of Flywheel API calls
+
+    Every call waits for the circuit breaker, a concurrency slot and a token from
+    the rate limiter.  Calls throttled by the server (429/503) are retried after
+    the Retry-After delay, or an exponential backoff when there is none.
+
+    Params:
+        max_requests_per_second: the steady state request rate
+        max_concurrency: the most requests in flight at once
+        max_retries: the retries of a throttled call before giving up
+        metrics: if set, records the retries and the seconds calls spent waiting
+    """
+
+    def __init__(
+        self,
+        max_requests_per_second: float = MAX_REQUESTS_PER_SECOND,
+        max_concurrency: int = 1,
+        max_retries: int = MAX_RETRIES,
+        metrics: Optional["Metrics"] = None,
+    ):
+        self.bucket = TokenBucket(max_requests_per_second)
+        self.concurrency = AdaptiveConcurrency(max_concurrency)
+        self.breaker = CircuitBreaker()
+        self.max_retries = max_retries
+        self.metrics = metrics
+        # Wakes the coroutines waiting for a slot, made on first use so that it
+        # belongs to the running event loop
+        self._slot_released: Optional[asyncio.Condition] = None
+
+    def retry_delay(self, error: Exception, attempt: int) -> float:
+        """Returns the seconds to wait before retrying a throttled call"""
+        delay = retry_after(error)
+        if delay is None:
+            delay = min(RETRY_MAX_BACKOFF, RETRY_BACKOFF * 2**attempt)
+            delay *= random.uniform(0.5, 1.5)
+        return delay
+
+    def call(self, func: Callable[..., Any], *args, **kwargs) -> Any:
+        """Calls a function once the throttle allows it, retrying if throttled"""
+        for attempt in range(self.max_retries + 1):
+            waiting = time.monotonic()
+            time.sleep(self.breaker.wait_time())
+            self.concurrency.acquire()
+            try:
+                time.sleep(self.bucket.reserve())
+                self._record_wait(waiting)
+                result = func(*args, **kwargs)
+            except Exception as e:
+                if not self._record_error(e, attempt, func):
+                    raise
+                time.sleep(self.retry_delay(e, attempt))
+                continue
+            self._record_success()
+            return result
+
+    async def call_async(self, func: Callable[..., Any], *args, **kwargs) -> Any:
+        """Awaits a coroutine once the throttle allows it, retrying if throttled"""
+        if self._slot_released is None:
+            self._slot_released = asyncio.Condition()
+        for attempt in range(self.max_retries + 1):
+            waiting = time.monotonic()
+            await asyncio.sleep(self.breaker.wait_time())
+            async with self._slot_released:
+                while not self.concurrency.try_acquire():
+                    await self._slot_released.wait()
+            try:
+                await asyncio.sleep(self.bucket.reserve())
+                self._record_wait(waiting)
+                result = await func(*args, **kwargs)
+            except Exception as e:
+                retry = self._record_error(e, attempt, func)
+                await self._notify_released()
+                if not retry:
+                    raise
+                await asyncio.sleep(self.retry_delay(e, attempt))
+                continue
+            self._record_success()
+            await self._notify_released()
+            return result
+
+    async def _notify_released(self) -> None:
+        """Wakes as many coroutines waiting for a slot as there are free slots"""
+        async with self._slot_released:
+            self._slot_released.notify(self.concurrency.free_slots())
+
+    def _record_success(self) -> None:
+        self.concurrency.release()
+        self.breaker.record_success()
+
+    def _record_wait(self, waiting: float) -> None:
+        """Records the seconds a call waited for the throttle since `waiting`"""
+        if self.metrics:
+            self.metrics.increment("throttle_wait_seconds", time.monotonic() - waiting)
+
+    def _record_error(
+        self, error: Exception, attempt: int, func: Optional[Callable] = None
+    ) -> bool:
+        """Records a failed call, returning True if it should be retried"""
+        throttled = status_code(error) in THROTTLE_STATUSES
+        self.concurrency.release(throttled=throttled)
+        if is_failure(error):
+            self.breaker.record_failure()
+        if throttled and attempt < self.max_retries:
+            log.debug(f"Request throttled by the server, retrying: {error}")
+            if self.metrics:
+                # Calls wrapped by `Metrics.timed` are named after their endpoint
+                self.metrics.record_retry(getattr(func, "endpoint", "other"))
+            return True
+        return False
@@ -0,0 +1,123 @@
+import logging
+import threading
+from typing import TYPE_CHECKING, Any, Dict, Optional
+
+if TYPE_CHECKING:
+    import requests
+    from urllib3.util.retry import Retry
+
+log = logging.getLogger("SnapshotTransport")
+
+# Connections kept open beyond one per worker, for the finder and status polls
+POOL_HEADROOM = 4
+# Seconds to wait to connect to the site, and for a response
+CONNECT_TIMEOUT = 10
+READ_TIMEOUT = 60
+
+
+def pool_size(max_workers: int) -> int:
+    """Returns the connections to keep open for a number of concurrent workers"""
+    return max(1, max_workers) + POOL_HEADROOM
+
+
+def http2_available() -> bool:
+    """Returns True if httpx can speak HTTP/2, which needs the h2 package"""
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+class ConnectionStats:
+    """Counts the connections opened for the requests sent, across threads"""
+
+    def __init__(self):
+        self.opened = 0
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    def add(self, opened: int = 0, requests: int = 0) -> None:
+        with self._lock:
+            self.opened += opened
+            self.requests += requests
+
+    async def trace(self, event_name: str, info: dict) -> None:
+        """Counts the connections and requests of httpx, as its `trace` extension"""
+        if event_name == "connection.connect_tcp.complete":
+            self.add(opened=1)
+        elif event_name.endswith(".send_request_headers.complete"):
+            self.add(requests=1)
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "opened": self.opened,
+                "requests": self.requests,
+                "reused": max(0, self.requests - self.opened),
+                "reuse_ratio": (
+                    round(1 - self.opened / self.requests, 3) if self.requests else None
+                ),
+            }
+
+
+class SharedTransport:
+    """A keep-alive connection pool shared by several `requests` sessions
+
+    The `FWClient` of the snapshot endpoints and the session of the flywheel SDK
+    each mount an adapter on the same urllib3 pool manager, so that they reuse
+    each other's connections to the site.  The pool holds a connection per
+    worker plus some headroom, so that concurrent workers neither wait on nor
+    throw away connections.
+
+    Params:
+        max_workers: the number of requests sent concurrently
+    """
+
+    def __init__(self, max_workers: int = 1):
+        from requests.adapters import HTTPAdapter
+
+        self.pool_size = pool_size(max_workers)
+        # Builds the pool manager that every mounted adapter then shares
+        self._adapter = HTTPAdapter(pool_maxsize=self.pool_size)
+        self.poolmanager = self._adapter.poolmanager
+
+    def mount(
+        self, session: "requests.Session", max_retries: Optional["Retry"] = None
+    ) -> bool:
+        """Sends the requests of a session through the shared pool
+
+        Args:
+            session: the session to mount the shared pool on
+            max_retries: the retry policy of the session's requests, defaults to
+                the one it already has
+
+        Returns:
+            False if the session is not a `requests` session, and was left as is
+        """
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        if not isinstance(session, requests.Session):
+            return False
+        if max_retries is None:
+            max_retries = session.get_adapter("https://").max_retries
+        adapter = HTTPAdapter(pool_maxsize=self.pool_size, max_retries=max_retries)
+        adapter.poolmanager.clear()
+        adapter.poolmanager = self.poolmanager
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return True
+
+    def stats(self) -> Dict[str, Any]:
+        """Returns the connections opened and the requests sent over them"""
+        stats = ConnectionStats()
+        pools = self.poolmanager.pools
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is not None:
+                stats.add(opened=pool.num_connections, requests=pool.num_requests)
+        return {"pool_size": self.pool_size, **stats.to_dict()}
+
+    def close(self) -> None:
+        self.poolmanager.clear()
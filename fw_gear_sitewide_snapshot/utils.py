@@ -1,7 +1,14 @@
-import pandas as pd
-from fw_client import FWClient
+import os
+from typing import TYPE_CHECKING, Iterable, List
 
-from .snapshot import snapshot_utils
+from .snapshot import project_cache, report, snapshot_utils
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+    from .snapshot.snapshot import Snapshotter
+
+FINAL_STATES = [s.value for s in snapshot_utils.SnapshotState if s.is_final()]
 
 
 def get_api_key(config: dict) -> str:
@@ -17,18 +24,95 @@ def is_final(value: str):
     return snapshot_utils.SnapshotState(value).is_final()
 
 
-def filter_completed_and_failed_snapshots(snapshots: pd.DataFrame) -> pd.DataFrame:
-    snapshots = snapshots[~snapshots["status"].apply(is_final)]
+def read_report(report_path: os.PathLike) -> "pd.DataFrame":
+    """Reads the columns of a snapshot report that a retry needs, as strings
+
+    The report may be a CSV, JSONL or Parquet report.  Skipping type inference
+    and the other columns keeps IDs and labels as they were written, and makes
+    large reports faster to read.
+    """
+    return report.read_report(report_path, columns=report.REQUIRED_COLUMNS)
+
+
+def filter_completed_and_failed_snapshots(
+    snapshots: "pd.DataFrame",
+) -> "pd.DataFrame":
+    snapshots = snapshots[~snapshots[snapshot_utils.STATUS].isin(FINAL_STATES)]
     return snapshots
 
 
-def refresh_nonfailed_snapshots(
-    snapshots: pd.DataFrame, client: FWClient
-) -> pd.DataFrame:
-    rows_to_refresh = snapshots[~snapshots["status"].apply(is_final)].index
-    for row_index in rows_to_refresh:
-        snapshot = snapshots.loc[row_index]
-        snapshot_record = snapshot_utils.SnapshotRecord.from_series(snapshot)
-        snapshot_record.update(client)
-        snapshots.loc[row_index, "status"] = snapshot_record.status
+def records_to_refresh(
+    snapshots: "pd.DataFrame",
+) -> List[snapshot_utils.SnapshotRecord]:
+    """Returns the snapshot records of the unfinished snapshots in a report"""
+    rows = filter_completed_and_failed_snapshots(snapshots)
+    return [
+        snapshot_utils.SnapshotRecord.from_row(row)
+        for row in rows.to_dict(orient="records")
+    ]
+
+
+def apply_statuses(
+    snapshots: "pd.DataFrame", records: Iterable[snapshot_utils.SnapshotRecord]
+) -> "pd.DataFrame":
+    """Sets the status of the report rows of the given snapshots to theirs"""
+    statuses = {record.id: record.status.value for record in records}
+    if statuses:
+        snapshot_ids = snapshots[snapshot_utils.SNAPSHOT_ID]
+        refreshed = snapshot_ids.isin(statuses.keys())
+        snapshots.loc[refreshed, snapshot_utils.STATUS] = snapshot_ids[refreshed].map(
+            statuses
+        )
     return snapshots
+
+
+def refresh_nonfailed_snapshots(
+    snapshots: "pd.DataFrame", snapshotter: "Snapshotter"
+) -> "pd.DataFrame":
+    """Refreshes the status of the unfinished snapshots in a report
+
+    The snapshots are refreshed concurrently by the snapshotter's workers.  As
+    they are not part of the run, only their status is set.
+
+    Args:
+        snapshots: the snapshot report
+        snapshotter: the snapshotter to refresh the snapshots with
+
+    Returns:
+        the report, with the status of its unfinished snapshots refreshed
+    """
+    records = records_to_refresh(snapshots)
+    snapshotter.refresh_statuses(records)
+    return apply_statuses(snapshots, records)
+
+
+def select_projects_to_retry(snapshots: "pd.DataFrame") -> List[str]:
+    """Returns the projects whose snapshots failed, in report order
+
+    A project is listed once, however many of its snapshots failed, and not at all
+    if the report has a snapshot of it that completed or is still running.
+
+    Args:
+        snapshots: a refreshed snapshot report
+    """
+    status = snapshots[snapshot_utils.STATUS]
+    project_ids = snapshots[snapshot_utils.PROJECT_ID]
+    failed = status == snapshot_utils.SnapshotState.failed.value
+    settled = project_ids[~failed].unique()
+    retry = project_ids[failed & ~project_ids.isin(settled)]
+    return retry.drop_duplicates().tolist()
+
+
+def seed_project_cache(
+    snapshots: "pd.DataFrame", cache: project_cache.ProjectCache
+) -> None:
+    """Adds the projects of a snapshot report to a project cache"""
+    projects = snapshots.drop_duplicates(snapshot_utils.PROJECT_ID)
+    for row in projects.to_dict(orient="records"):
+        cache.add(
+            {
+                "_id": row[snapshot_utils.PROJECT_ID],
+                "label": row[snapshot_utils.PROJECT_LABEL],
+                "group": row[snapshot_utils.GROUP_LABEL],
+            }
+        )
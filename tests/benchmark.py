@@ -0,0 +1,201 @@
+"""Benchmarks the snapshotters against a local stand-in for the Flywheel API.
+
+For each batch size, a fresh `tests.fake_flywheel` server is started in its own
+process and every one of its projects is snapshotted and waited on.  Reported
+per batch size:
+
+- trigger_s: seconds to find the projects and trigger their snapshots
+- triggers_per_s: snapshots triggered per second
+- polls: snapshot status requests sent while waiting
+- requests: requests the server received, and of them throttled (429)
+- finish_s: seconds from the first request until every snapshot finished
+- peak_mb: peak memory allocated by the gear, as traced by tracemalloc.  Tracing
+  slows the gear down, so use --skip-memory for timings
+
+Run it from the repository root, e.g.
+
+    python -m tests.benchmark --sizes 10 100 1000 10000 50000 --workers 32
+"""
+
+import argparse
+import asyncio
+import contextlib
+import json
+import subprocess
+import sys
+import time
+import tracemalloc
+from typing import Iterator, List, Optional
+from unittest.mock import patch
+
+from fw_gear_sitewide_snapshot import main as gear_main
+from fw_gear_sitewide_snapshot.snapshot import scheduler, snapshot
+
+from .fake_flywheel import FakeFlywheel, connect, get_stats
+
+DEFAULT_SIZES = [10, 100, 1000, 10000, 50000]
+COLUMNS = [
+    "size",
+    "engine",
+    "trigger_s",
+    "triggers_per_s",
+    "polls",
+    "requests",
+    "throttled",
+    "errors",
+    "finish_s",
+    "peak_mb",
+]
+
+
+@contextlib.contextmanager
+def fake_site(in_process: bool = False, **options) -> Iterator[str]:
+    """Runs a fake Flywheel site and yields its URL
+
+    Args:
+        in_process: if True, serve from a thread of this process.  Otherwise the
+            server runs in a subprocess, and is left out of the measurements
+        options: the `FakeFlywheel` options
+    """
+    if in_process:
+        with FakeFlywheel(**options) as fake:
+            yield fake.url
+        return
+
+    args = [sys.executable, "-m", "tests.fake_flywheel"]
+    for name, value in options.items():
+        if value is not None:
+            args += [f"--{name.replace('_', '-')}", str(value)]
+    server = subprocess.Popen(args, stdout=subprocess.PIPE, text=True)
+    try:
+        yield server.stdout.readline().strip()
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def trigger_and_wait(url: str, engine: str, args: argparse.Namespace) -> dict:
+    """Snapshots every project of a fake site and returns the timings"""
+    poll_scheduler = scheduler.PollScheduler(
+        initial_interval=args.poll_interval,
+        max_polls_per_second=args.max_polls_per_second,
+    )
+    options = {
+        "max_workers": args.workers,
+        "max_requests_per_second": args.max_requests_per_second,
+    }
+    api_key = f"{url}:benchmark"
+    start = time.monotonic()
+    if engine == "asyncio":
+        from fw_gear_sitewide_snapshot.snapshot import async_snapshot
+
+        async def run() -> tuple:
+            async with async_snapshot.AsyncSnapshotter(api_key, **options) as snap:
+                await snap.trigger_snapshots_on_filter("ALL")
+                triggered = time.monotonic()
+                await gear_main.wait_for_snapshots_async(snap, poll_scheduler)
+            return snap, triggered
+
+        snapshotter, triggered = asyncio.run(run())
+    else:
+        snapshotter = connect(snapshot.Snapshotter(api_key, **options), url)
+        snapshotter.trigger_snapshots_on_filter("ALL")
+        triggered = time.monotonic()
+        gear_main.wait_for_snapshots(snapshotter, poll_scheduler)
+    finished = time.monotonic()
+
+    return {
+        "trigger_s": round(triggered - start, 3),
+        "triggers_per_s": round(len(snapshotter.snapshots) / (triggered - start), 1),
+        "errors": len(snapshotter.errors),
+        "finish_s": round(finished - start, 3),
+    }
+
+
+def run_benchmark(
+    size: int, engine: str, args: argparse.Namespace, in_process: bool = False
+) -> dict:
+    """Benchmarks one batch size on one engine"""
+    site_options = {
+        "projects": size,
+        "latency": args.latency,
+        "throttle_rate": args.throttle_rate,
+        "error_rate": args.error_rate,
+        "duration": args.duration,
+        "duration_jitter": args.duration_jitter,
+        "seed": args.seed,
+    }
+    peak = None
+    with fake_site(in_process=in_process, **site_options) as url:
+        if not args.skip_memory:
+            tracemalloc.start()
+        try:
+            with patch.object(gear_main, "SNAPSHOT_TIMEOUT", args.timeout):
+                result = trigger_and_wait(url, engine, args)
+            if not args.skip_memory:
+                peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        stats = get_stats(url)
+
+    requests = stats["requests"]
+    return {
+        "size": size,
+        "engine": engine,
+        **result,
+        "polls": requests.get("detail", 0),
+        "requests": sum(requests.values()) - requests.get("stats", 0),
+        "throttled": stats["responses"].get("429", 0),
+        "peak_mb": round(peak / 2**20, 1) if peak is not None else "-",
+    }
+
+
+def print_table(results: List[dict]) -> None:
+    widths = {c: max(len(c), *(len(str(r[c])) for r in results)) for c in COLUMNS}
+    print("  ".join(c.rjust(widths[c]) for c in COLUMNS))
+    for result in results:
+        print("  ".join(str(result[c]).rjust(widths[c]) for c in COLUMNS))
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description=__doc__.splitlines()[0],
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES)
+    parser.add_argument(
+        "--engines", nargs="+", default=["threads"], choices=["threads", "asyncio"]
+    )
+    parser.add_argument("--workers", type=int, default=16)
+    parser.add_argument("--max-requests-per-second", type=float, default=1000)
+    parser.add_argument("--max-polls-per-second", type=float, default=500)
+    parser.add_argument(
+        "--poll-interval", type=float, default=scheduler.POLL_INITIAL_INTERVAL
+    )
+    parser.add_argument("--timeout", type=float, default=gear_main.SNAPSHOT_TIMEOUT)
+    parser.add_argument("--latency", type=float, default=0.01, help="seconds")
+    parser.add_argument("--throttle-rate", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--duration", type=float, default=5.0, help="seconds")
+    parser.add_argument("--duration-jitter", type=float, default=0.5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--skip-memory", action="store_true")
+    parser.add_argument("--json", help="also write the results to this file")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> None:  # pragma: no cover
+    args = parse_args(argv)
+    results = []
+    for engine in args.engines:
+        for size in args.sizes:
+            results.append(run_benchmark(size, engine, args))
+            print(json.dumps(results[-1]), file=sys.stderr, flush=True)
+    print_table(results)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as results_file:
+            json.dump(results, results_file, indent=2)
+
+
+if __name__ == "__main__":  # pragma: no cover
+    main()
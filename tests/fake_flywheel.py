@@ -0,0 +1,506 @@
+"""A local stand-in for the Flywheel project and snapshot API.
+
+It serves the endpoints the gear uses over real HTTP, so that `Snapshotter`,
+`AsyncSnapshotter` and `wait_for_snapshots` can be exercised end to end:
+
+- GET /api/projects, the finder, paged with `limit` and `after_id`, and filtered
+  on fields with `=`, or `=~` for a regular expression
+- GET /api/projects/{id} and POST /api/lookup
+- POST and GET /snapshot/projects/{id}/snapshots
+- GET /snapshot/projects/{id}/snapshots/{id}/detail
+- GET /snapshot/projects/{id}/snapshots/{id}/download, with range requests
+
+Requests can be slowed down, failed with a 500 or throttled with a 429, and each
+snapshot moves from pending to in_progress to complete (or failed) on a timer.
+The server runs in a thread of the calling process, or on its own with
+
+    python -m tests.fake_flywheel --projects 10000
+"""
+
+import argparse
+import base64
+import collections
+import datetime
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Iterator, List, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+import requests
+
+API_KEY = "fake-key"
+FIND_RETRIES = 5
+FIND_BACKOFF = 0.01  # seconds
+PAGE_SIZE = 250
+# The project fields listed by the finder with the slim-containers feature
+SLIM_FIELDS = ("_id", "label", "group", "modified")
+
+SNAPSHOTS_RE = re.compile(r"^/snapshot/projects/(\w+)/snapshots$")
+DETAIL_RE = re.compile(r"^/snapshot/projects/(\w+)/snapshots/(\w+)/detail$")
+DOWNLOAD_RE = re.compile(r"^/snapshot/projects/(\w+)/snapshots/(\w+)/download$")
+RANGE_RE = re.compile(r"^bytes=(\d+)-$")
+PROJECT_RE = re.compile(r"^/api/projects/(\w+)$")
+
+
+def matches_filter(project: dict, project_filter: str) -> bool:
+    """Returns True if a project matches every condition of a finder filter"""
+    for condition in project_filter.split(","):
+        field, _, value = condition.strip().partition("=")
+        actual = str(project.get(field.strip(), ""))
+        if value.startswith("~"):
+            if not re.search(value[1:], actual):
+                return False
+        elif actual != value:
+            return False
+    return True
+
+
+class FakeFlywheel:
+    """An in-process HTTP server faking the Flywheel endpoints used by the gear
+
+    Params:
+        projects: the number of projects on the fake site
+        latency: the seconds every request takes
+        error_rate: the fraction of requests answered with a 500
+        throttle_rate: the fraction of requests answered with a 429
+        retry_after: if set, the whole seconds of the Retry-After header of 429
+            responses.  The SDK's urllib3 retries those on its own, the snapshot
+            client leaves them to the throttle
+        start_delay: the seconds a snapshot stays pending
+        duration: the seconds a snapshot stays in progress
+        duration_jitter: the fraction by which each duration is randomized
+        snapshot_failure_rate: the fraction of snapshots that end up failed
+        seed: the seed of the random failures, for repeatable runs
+        archive_size: the bytes of every downloaded snapshot
+    """
+
+    def __init__(
+        self,
+        projects: int = 10,
+        latency: float = 0.0,
+        error_rate: float = 0.0,
+        throttle_rate: float = 0.0,
+        retry_after: Optional[int] = None,
+        start_delay: float = 0.0,
+        duration: float = 0.0,
+        duration_jitter: float = 0.0,
+        snapshot_failure_rate: float = 0.0,
+        seed: Optional[int] = None,
+        archive_size: int = 4096,
+    ):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.start_delay = start_delay
+        self.duration = duration
+        self.duration_jitter = duration_jitter
+        self.snapshot_failure_rate = snapshot_failure_rate
+        self.archive_size = archive_size
+        # The snapshot ID and first byte of every download request
+        self.downloads = []
+        self.random = random.Random(seed)
+        modified = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+        self.projects = collections.OrderedDict(
+            (
+                f"{i:024x}",
+                {
+                    "_id": f"{i:024x}",
+                    "label": f"project {i}",
+                    "group": f"group{i % 10}",
+                    "modified": modified.isoformat(),
+                    "info": {"description": f"Fake project {i}"},
+                    "permissions": [{"id": "user@example.com", "access": "admin"}],
+                },
+            )
+            for i in range(projects)
+        )
+        self._project_ids = list(self.projects)
+        # The containers and files in each project, listed with `stats=true`.  A
+        # random generator of their own leaves the sequence of faults as it was
+        sizes = random.Random(seed)
+        self.sizes = {
+            project_id: sizes.randint(1, 1000) for project_id in self.projects
+        }
+        self.snapshots = {}
+        self.requests = collections.Counter()
+        self.faults = collections.Counter()
+        self.responses = collections.Counter()
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def api_key(self) -> str:
+        """An API key pointing FWClient and AsyncSnapshotter at this server"""
+        return f"{self.url}:{API_KEY}"
+
+    def start(self, port: int = 0) -> "FakeFlywheel":
+        """Starts serving on a background thread"""
+        self._server = ThreadingHTTPServer(("127.0.0.1", port), self._handler())
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> "FakeFlywheel":
+        return self.start()
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
+
+    def stats(self) -> dict:
+        """Returns the requests and injected faults by endpoint, and the responses
+        by status"""
+        with self._lock:
+            return {
+                "requests": dict(self.requests),
+                "faults": dict(self.faults),
+                "responses": {str(k): v for k, v in self.responses.items()},
+                "snapshots": len(self.snapshots),
+            }
+
+    def status(self, snapshot: dict) -> str:
+        """Returns the state of a snapshot at the current time"""
+        elapsed = time.monotonic() - snapshot["started"]
+        if elapsed < self.start_delay:
+            return "pending"
+        if elapsed < self.start_delay + snapshot["duration"]:
+            return "in_progress"
+        return "failed" if snapshot["fails"] else "complete"
+
+    def snapshot_json(self, snapshot: dict) -> dict:
+        return {
+            "_id": snapshot["_id"],
+            "created": snapshot["created"],
+            "status": self.status(snapshot),
+            "parents": {"project": snapshot["project"]},
+        }
+
+    def create_snapshot(self, project_id: str) -> dict:
+        with self._lock:
+            jitter = self.random.uniform(-self.duration_jitter, self.duration_jitter)
+            snapshot = {
+                "_id": f"{len(self.snapshots):024x}",
+                "project": project_id,
+                "created": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+                "started": time.monotonic(),
+                "duration": self.duration * (1 + jitter),
+                "fails": self.random.random() < self.snapshot_failure_rate,
+            }
+            self.snapshots[snapshot["_id"]] = snapshot
+        return self.snapshot_json(snapshot)
+
+    def archive(self, snapshot_id: str) -> bytes:
+        """Returns the bytes of a downloaded snapshot, the same on every download"""
+        return random.Random(snapshot_id).randbytes(self.archive_size)
+
+    def download(self, snapshot_id: str, range_header: Optional[str]):
+        """Returns the status, headers and bytes of a snapshot download"""
+        snapshot = self.snapshots.get(snapshot_id)
+        if snapshot is None or self.status(snapshot) != "complete":
+            return 404, {}, b""
+        archive = self.archive(snapshot_id)
+        match = RANGE_RE.match(range_header or "")
+        start = int(match.group(1)) if match else 0
+        with self._lock:
+            self.downloads.append((snapshot_id, start))
+        digest = base64.b64encode(hashlib.sha256(archive).digest()).decode()
+        headers = {"Digest": f"sha-256={digest}"}
+        if not match:
+            return 200, headers, archive
+        if start >= len(archive):
+            return 416, {"Content-Range": f"bytes */{len(archive)}"}, b""
+        headers["Content-Range"] = f"bytes {start}-{len(archive) - 1}/{len(archive)}"
+        return 206, headers, archive[start:]
+
+    def find(self, query: dict, features: Tuple[str, ...] = ()) -> List[dict]:
+        limit = int(query.get("limit", [PAGE_SIZE])[0])
+        after_id = query.get("after_id", [None])[0]
+        project_filter = query.get("filter", [""])[0]
+        ids = self._project_ids
+        if project_filter:
+            ids = [i for i in ids if matches_filter(self.projects[i], project_filter)]
+        start = 0
+        if after_id is not None:
+            # Project IDs are in order, so the page starts after the last one seen
+            start = ids.index(after_id) + 1
+        ids = ids[start : start + limit]
+        projects = [self.projects[project_id] for project_id in ids]
+        if "slim-containers" in features:
+            projects = [{k: p[k] for k in SLIM_FIELDS} for p in projects]
+        if query.get("stats", ["false"])[0].lower() == "true":
+            projects = [
+                {**p, "stats": {"number_of": {"files": self.sizes[p["_id"]]}}}
+                for p in projects
+            ]
+        return projects
+
+    def endpoint(self, method: str, path: str) -> str:
+        """Returns the name of the endpoint a request is for, without serving it"""
+        if path == "/api/projects":
+            return "find"
+        if PROJECT_RE.match(path):
+            return "get_project"
+        if path == "/api/lookup":
+            return "lookup"
+        if SNAPSHOTS_RE.match(path):
+            return "trigger" if method == "POST" else "list"
+        if DETAIL_RE.match(path):
+            return "detail"
+        if DOWNLOAD_RE.match(path):
+            return "download"
+        return "unknown"
+
+    def route(
+        self,
+        method: str,
+        path: str,
+        query: dict,
+        body: dict,
+        features: Tuple[str, ...] = (),
+    ):
+        """Returns the endpoint name, status and JSON body of a request
+
+        Args:
+            features: the features of the X-Accept-Feature header
+        """
+        if method == "GET" and path == "/_stats":
+            return "stats", 200, self.stats()
+        if method == "GET" and path == "/api/projects":
+            return "find", 200, self.find(query, features)
+        match = PROJECT_RE.match(path)
+        if method == "GET" and match:
+            project = self.projects.get(match.group(1))
+            return "get_project", 200 if project else 404, project
+        if method == "POST" and path == "/api/lookup":
+            label = (body.get("path") or [""])[-1]
+            for project in self.projects.values():
+                if project["label"] == label:
+                    return "lookup", 200, project
+            return "lookup", 404, None
+        match = SNAPSHOTS_RE.match(path)
+        if match and match.group(1) not in self.projects:
+            return "trigger", 404, None
+        if method == "POST" and match:
+            return "trigger", 200, self.create_snapshot(match.group(1))
+        if method == "GET" and match:
+            with self._lock:
+                snapshots = [
+                    s for s in self.snapshots.values() if s["project"] == match.group(1)
+                ]
+            return "list", 200, [self.snapshot_json(s) for s in snapshots]
+        match = DETAIL_RE.match(path)
+        if method == "GET" and match:
+            snapshot = self.snapshots.get(match.group(2))
+            if snapshot is None:
+                return "detail", 404, None
+            return "detail", 200, self.snapshot_json(snapshot)
+        return "unknown", 404, None
+
+    def inject_fault(self) -> Optional[int]:
+        """Returns the status of an injected 500 or 429, if this request gets one"""
+        with self._lock:
+            roll = self.random.random()
+        if roll < self.error_rate:
+            return 500
+        if roll < self.error_rate + self.throttle_rate:
+            return 429
+        return None
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # Keep connections open, as the Flywheel API does
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                self.handle_request("GET")
+
+            def do_POST(self):
+                self.handle_request("POST")
+
+            def handle_request(self, method: str) -> None:
+                length = int(self.headers.get("Content-Length") or 0)
+                raw = self.rfile.read(length) if length else b""
+                url = urlparse(self.path)
+                if fake.latency:
+                    time.sleep(fake.latency)
+
+                fault = None if url.path == "/_stats" else fake.inject_fault()
+                download = DOWNLOAD_RE.match(url.path)
+                if download and not fault:
+                    status, headers, payload = fake.download(
+                        download.group(2), self.headers.get("Range")
+                    )
+                    with fake._lock:
+                        fake.requests["download"] += 1
+                        fake.responses[status] += 1
+                    self.send_bytes(status, headers, payload)
+                    return
+                if fault:
+                    endpoint = fake.endpoint(method, url.path)
+                    status, body = fault, {"message": "fault"}
+                    with fake._lock:
+                        fake.faults[endpoint] += 1
+                else:
+                    features = self.headers.get("X-Accept-Feature") or ""
+                    endpoint, status, body = fake.route(
+                        method,
+                        url.path,
+                        parse_qs(url.query),
+                        json.loads(raw or "{}"),
+                        tuple(f.strip() for f in features.split(",")),
+                    )
+                with fake._lock:
+                    fake.requests[endpoint] += 1
+                    fake.responses[status] += 1
+                self.send_json(status, body)
+
+            def send_json(self, status: int, body) -> None:
+                payload = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                if status == 429 and fake.retry_after is not None:
+                    self.send_header("Retry-After", str(fake.retry_after))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def send_bytes(self, status: int, headers: dict, payload: bytes) -> None:
+                self.send_response(status)
+                self.send_header("Content-Type", "application/octet-stream")
+                self.send_header("Content-Length", str(len(payload)))
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, *args) -> None:
+                pass
+
+        return Handler
+
+
+def get_stats(url: str) -> dict:
+    """Gets the stats of a fake server, in this process or another"""
+    return requests.get(f"{url}/_stats", timeout=10).json()
+
+
+class FakeProjects:
+    """The `projects` finder of `FakeSDKClient`"""
+
+    def __init__(self, session: requests.Session, url: str):
+        self.session = session
+        self.url = url
+
+    def iter_find(
+        self,
+        project_filter: str = "",
+        x_accept_feature: Optional[List[str]] = None,
+        stats: bool = False,
+    ) -> Iterator[dict]:
+        """Pages through the projects, retrying faults like the SDK does"""
+        params = {"limit": PAGE_SIZE}
+        if project_filter:
+            params["filter"] = project_filter
+        if stats:
+            params["stats"] = "true"
+        headers = {"X-Accept-Feature": ", ".join(x_accept_feature or [])}
+        while True:
+            for attempt in range(FIND_RETRIES):
+                response = self.session.get(
+                    f"{self.url}/api/projects", params=params, headers=headers
+                )
+                if response.status_code not in (429, 500):
+                    break
+                time.sleep(FIND_BACKOFF * 2**attempt)
+            response.raise_for_status()
+            results = response.json()
+            if not results:
+                return
+            yield from results
+            params["after_id"] = results[-1]["_id"]
+
+
+class FakeSDKClient:
+    """Stands in for `flywheel.Client`, which checks its API key on creation
+
+    Only the finder, `get_project` and `lookup` used by `Snapshotter` are faked.
+    """
+
+    def __init__(self, url: str):
+        self.url = url
+        self.session = requests.Session()
+        self.projects = FakeProjects(self.session, url)
+
+    def get_project(self, project_id: str) -> dict:
+        response = self.session.get(f"{self.url}/api/projects/{project_id}")
+        response.raise_for_status()
+        return response.json()
+
+    def lookup(self, path: str) -> dict:
+        response = self.session.post(
+            f"{self.url}/api/lookup", json={"path": path.split("/")}
+        )
+        response.raise_for_status()
+        return response.json()
+
+
+def connect(snapshotter, url: str):
+    """Points a `Snapshotter` or `AsyncSnapshotter` at a fake server
+
+    The snapshotter must have been created with an API key from the server, e.g.
+    `FakeFlywheel.api_key`.  FWClient only routes /snapshot requests to sites
+    with a domain name, so the snapshot service of the fake site is set here.
+    The fake SDK client shares the snapshotter's connection pool, like the SDK.
+    """
+    if hasattr(snapshotter, "snapshot_client"):
+        snapshotter.sdk_client = FakeSDKClient(url)
+        snapshotter.transport.mount(snapshotter.sdk_client.session)
+        snapshotter.snapshot_client.svc_urls["/snapshot"] = url
+    return snapshotter
+
+
+def main(argv: Optional[List[str]] = None) -> None:  # pragma: no cover
+    """Serves a fake site until killed, printing its URL on the first line"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=0)
+    parser.add_argument("--projects", type=int, default=10)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--throttle-rate", type=float, default=0.0)
+    parser.add_argument("--retry-after", type=int)
+    parser.add_argument("--start-delay", type=float, default=0.0)
+    parser.add_argument("--duration", type=float, default=0.0)
+    parser.add_argument("--duration-jitter", type=float, default=0.0)
+    parser.add_argument("--snapshot-failure-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int)
+    args = vars(parser.parse_args(argv))
+    port = args.pop("port")
+
+    fake = FakeFlywheel(**args).start(port)
+    print(fake.url, flush=True)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        fake.stop()
+
+
+if __name__ == "__main__":  # pragma: no cover
+    main()
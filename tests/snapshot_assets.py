@@ -29,6 +29,23 @@ FAKE_RESPONSE = {
 FAKE_RECORD = snapshot_utils.SnapshotRecord(**FAKE_RESPONSE)
 
 
+def make_record(
+    snapshot_id: str = FAKE_SNAPSHOT_ID, **overrides
+) -> snapshot_utils.SnapshotRecord:
+    """Returns a snapshot record like `FAKE_RECORD`, with some fields overridden
+
+    Args:
+        snapshot_id: the ID of the snapshot
+        overrides: the fields to override, with `project_id` setting the parents
+    """
+    project_id = overrides.pop("project_id", None)
+    if project_id is not None:
+        overrides["parents"] = {"project": project_id}
+    return snapshot_utils.SnapshotRecord(
+        **{**FAKE_RESPONSE, "_id": snapshot_id, **overrides}
+    )
+
+
 @pytest.fixture
 def mock_client():
     return MagicMock(spec=fw_client.FWClient)
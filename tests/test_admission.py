@@ -0,0 +1,154 @@
+import asyncio
+import threading
+
+import pytest
+
+from fw_gear_sitewide_snapshot import main
+from fw_gear_sitewide_snapshot.snapshot import (
+    admission,
+    async_snapshot,
+    scheduler,
+    snapshot,
+    snapshot_utils,
+)
+
+from .fake_flywheel import FakeFlywheel, connect
+from .snapshot_assets import FAKE_KEY, make_record
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def fast_scheduler() -> scheduler.PollScheduler:
+    return scheduler.PollScheduler(
+        initial_interval=0.01, max_interval=0.02, max_polls_per_second=1000
+    )
+
+
+def max_active(fake: FakeFlywheel) -> int:
+    """Returns the most snapshots unfinished on the fake server when one started"""
+    snapshots = list(fake.snapshots.values())
+    return max(
+        sum(
+            other["started"]
+            <= started["started"]
+            < other["started"] + other["duration"]
+            for other in snapshots
+        )
+        for started in snapshots
+    )
+
+
+def test_window_counts_snapshots_being_triggered():
+    window = admission.AdmissionWindow(2)
+    assert window.try_admit(active=0)
+    assert window.try_admit(active=0)
+    assert not window.try_admit(active=0)
+
+    # A triggered snapshot counts as active instead
+    window.release()
+    assert not window.try_admit(active=1)
+    assert window.try_admit(active=0)
+
+
+def test_adaptive_window_shrinks_on_failures():
+    window = admission.AdmissionWindow(8, adaptive=True)
+    window.record_final(snapshot_utils.SnapshotState.failed)
+    window.record_final(snapshot_utils.SnapshotState.failed)
+    assert int(window.limit) == 2
+
+    for _ in range(6):
+        window.record_final(snapshot_utils.SnapshotState.complete)
+    assert int(window.limit) == 4
+    assert not window.try_admit(active=4)
+
+
+def test_stalled_window_opens_until_a_snapshot_finishes():
+    clock = FakeClock()
+    window = admission.AdmissionWindow(1, stall_timeout=60, clock=clock)
+    assert not window.try_admit(active=1)
+
+    clock.now = 60
+    assert window.try_admit(active=1)
+    assert window.try_admit(active=2)
+
+    window.record_final(snapshot_utils.SnapshotState.complete)
+    assert not window.try_admit(active=2)
+
+
+def test_trigger_is_woken_when_a_snapshot_finishes():
+    """Test a trigger held back by a full window goes as soon as one finishes"""
+    snapshotter = snapshot.Snapshotter(FAKE_KEY, window=admission.AdmissionWindow(1))
+    snapshotter.add_record(make_record("a"))
+    [record] = snapshotter.snapshots
+    admitted = threading.Event()
+
+    def trigger():
+        snapshotter.wait_for_admission()
+        admitted.set()
+
+    threading.Thread(target=trigger, daemon=True).start()
+    assert not admitted.wait(0.2)
+    snapshotter.record_status(record, snapshot_utils.SnapshotState.complete)
+    # Well within the window's stall timeout, which would let it through anyway
+    assert admitted.wait(5)
+
+
+def test_async_trigger_is_woken_when_a_snapshot_finishes():
+    async def scenario():
+        snapshotter = async_snapshot.AsyncSnapshotter(
+            FAKE_KEY, window=admission.AdmissionWindow(1)
+        )
+        snapshotter.add_record(make_record("a"))
+        [record] = snapshotter.snapshots
+        waiter = asyncio.create_task(snapshotter.wait_for_admission())
+        await asyncio.sleep(0.2)
+        assert not waiter.done()
+        snapshotter.record_status(record, snapshot_utils.SnapshotState.complete)
+        await asyncio.wait_for(waiter, 5)
+        await snapshotter.client.aclose()
+
+    asyncio.run(scenario())
+
+
+@pytest.mark.parametrize("max_workers", [1, 4])
+def test_snapshotter_keeps_at_most_the_window_active(max_workers):
+    """Test snapshots are triggered as earlier ones finish, never more at once"""
+    with FakeFlywheel(projects=12, duration=0.1, duration_jitter=0.5) as fake:
+        snapshotter = connect(
+            snapshot.Snapshotter(
+                fake.api_key,
+                max_workers=max_workers,
+                max_requests_per_second=1000,
+                window=admission.AdmissionWindow(3),
+            ),
+            fake.url,
+        )
+        with main.polling_in_background(snapshotter, fast_scheduler()):
+            snapshotter.trigger_snapshots_on_filter("ALL")
+
+        assert len(fake.snapshots) == 12
+        assert max_active(fake) <= 3
+    assert snapshotter.metrics.counters["window_wait_seconds"] > 0
+
+
+def test_async_snapshotter_keeps_at_most_the_window_active():
+    async def scenario(fake):
+        async with async_snapshot.AsyncSnapshotter(
+            fake.api_key,
+            max_workers=4,
+            max_requests_per_second=1000,
+            window=admission.AdmissionWindow(3),
+        ) as snapshotter:
+            async with main.polling_in_background_async(snapshotter, fast_scheduler()):
+                await snapshotter.trigger_snapshots_on_filter("ALL")
+
+    with FakeFlywheel(projects=12, duration=0.1, duration_jitter=0.5) as fake:
+        asyncio.run(scenario(fake))
+        assert len(fake.snapshots) == 12
+        assert max_active(fake) <= 3
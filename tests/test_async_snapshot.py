@@ -0,0 +1,116 @@
+import asyncio
+
+import httpx
+
+from fw_gear_sitewide_snapshot import main
+from fw_gear_sitewide_snapshot.snapshot import (
+    async_snapshot,
+    scheduler,
+    snapshot_utils,
+)
+
+from .snapshot_assets import FAKE_BATCH_NAME, FAKE_GROUP, FAKE_KEY, FAKE_PROJECT_LABEL
+
+PROJECT_IDS = [f"{i:024x}" for i in range(5)]
+
+
+def fake_api(request: httpx.Request) -> httpx.Response:
+    """A minimal stand-in for the project finder and snapshot endpoints"""
+    path = request.url.path
+    if path == "/api/projects":
+        # A single page of results, then an empty page
+        if "after_id" in request.url.params:
+            return httpx.Response(200, json=[])
+        return httpx.Response(
+            200,
+            json=[
+                {"_id": p, "label": FAKE_PROJECT_LABEL, "group": FAKE_GROUP}
+                for p in PROJECT_IDS
+            ],
+        )
+    if path.startswith("/api/projects/"):
+        project_id = path.rsplit("/", 1)[-1]
+        return httpx.Response(
+            200,
+            json={"_id": project_id, "label": FAKE_PROJECT_LABEL, "group": FAKE_GROUP},
+        )
+    if request.method == "POST" and path.endswith("/snapshots"):
+        project_id = path.split("/")[3]
+        if project_id not in PROJECT_IDS:
+            return httpx.Response(404)
+        return httpx.Response(
+            200,
+            json={
+                "_id": f"snapshot_{project_id}",
+                "status": "pending",
+                "parents": {"project": project_id},
+            },
+        )
+    if path.endswith("/detail"):
+        return httpx.Response(200, json={"status": "complete"})
+    return httpx.Response(404)
+
+
+def make_snapshotter(**kwargs) -> async_snapshot.AsyncSnapshotter:
+    snapshotter = async_snapshot.AsyncSnapshotter(FAKE_KEY, FAKE_BATCH_NAME, **kwargs)
+    snapshotter.client = httpx.AsyncClient(
+        transport=httpx.MockTransport(fake_api), base_url=snapshotter.snapshot_url
+    )
+    return snapshotter
+
+
+def test_trigger_and_wait_on_filter():
+    async def scenario():
+        async with make_snapshotter(max_workers=3) as snapshotter:
+            await snapshotter.trigger_snapshots_on_filter("ALL")
+            assert not snapshotter.is_finished()
+            poll_scheduler = scheduler.PollScheduler(initial_interval=0.01)
+            assert await main.wait_for_snapshots_async(snapshotter, poll_scheduler) == 0
+            return snapshotter
+
+    snapshotter = asyncio.run(scenario())
+
+    assert sorted(s.project_id for s in snapshotter.snapshots) == PROJECT_IDS
+    for record in snapshotter.snapshots:
+        assert record.status == snapshot_utils.SnapshotState.complete
+        assert record.project_label == FAKE_PROJECT_LABEL
+        assert record.group_label == FAKE_GROUP
+        assert record.batch_label == FAKE_BATCH_NAME
+    assert snapshotter.errors == []
+
+
+def test_trigger_on_list_records_errors():
+    async def scenario():
+        async with make_snapshotter() as snapshotter:
+            # The second project is rejected by the API
+            await snapshotter.trigger_snapshots_on_list(
+                [PROJECT_IDS[0], "ffffffffffffffffffffffff"]
+            )
+            return snapshotter
+
+    snapshotter = asyncio.run(scenario())
+
+    assert [s.project_id for s in snapshotter.snapshots] == [PROJECT_IDS[0]]
+    assert len(snapshotter.errors) == 1
+    assert snapshotter.errors[0][0] == "ffffffffffffffffffffffff"
+
+
+def test_trigger_on_list_is_bounded_by_the_workers():
+    """Test a list of projects is triggered by max_workers coroutines, not one each"""
+    active, most_active = set(), []
+
+    async def make_snapshot_on_id(project_id):
+        active.add(project_id)
+        most_active.append(len(active))
+        await asyncio.sleep(0.01)
+        active.discard(project_id)
+
+    async def scenario():
+        async with make_snapshotter(max_workers=2) as snapshotter:
+            snapshotter.make_snapshot_on_id = make_snapshot_on_id
+            await snapshotter.trigger_snapshots_on_list(PROJECT_IDS)
+
+    asyncio.run(scenario())
+
+    assert len(most_active) == len(PROJECT_IDS)
+    assert max(most_active) == 2
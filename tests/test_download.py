@@ -0,0 +1,116 @@
+import asyncio
+import hashlib
+
+import pytest
+
+from fw_gear_sitewide_snapshot import main
+from fw_gear_sitewide_snapshot.snapshot import (
+    async_snapshot,
+    download,
+    scheduler,
+    snapshot,
+)
+
+from .fake_flywheel import FakeFlywheel, connect
+
+
+def fast_scheduler() -> scheduler.PollScheduler:
+    return scheduler.PollScheduler(
+        initial_interval=0.01, max_interval=0.02, max_polls_per_second=1000
+    )
+
+
+def make_downloader(fake: FakeFlywheel, download_dir) -> download.SnapshotDownloader:
+    client = download.make_client(fake.api_key, max_workers=2)
+    client.svc_urls["/snapshot"] = fake.url
+    return download.SnapshotDownloader(client, download_dir, max_workers=2)
+
+
+def check_downloads(fake: FakeFlywheel, downloader: download.SnapshotDownloader):
+    """Checks every snapshot was downloaded whole, with its checksum"""
+    assert not downloader.errors
+    for snapshot_id, snapshot_json in fake.snapshots.items():
+        path = downloader.path(snapshot_json["project"], snapshot_id)
+        with open(path, "rb") as snapshot_file:
+            assert snapshot_file.read() == fake.archive(snapshot_id)
+        with open(path + download.CHECKSUM_SUFFIX) as checksum_file:
+            sha256 = hashlib.sha256(fake.archive(snapshot_id)).hexdigest()
+            assert checksum_file.read().split() == [sha256, path.split("/")[-1]]
+
+
+def test_snapshots_download_as_they_complete(tmp_path):
+    """Test completed snapshots download while the others are polled"""
+    with FakeFlywheel(projects=6, duration=0.05, archive_size=300_000) as fake:
+        downloader = make_downloader(fake, tmp_path)
+        snapshotter = connect(
+            snapshot.Snapshotter(
+                fake.api_key,
+                max_workers=2,
+                max_requests_per_second=1000,
+                downloader=downloader,
+                run_metrics=downloader.metrics,
+            ),
+            fake.url,
+        )
+        snapshotter.trigger_snapshots_on_filter("ALL")
+        assert main.wait_for_snapshots(snapshotter, fast_scheduler()) == 0
+        assert main.finish_downloads(downloader, 0) == 0
+
+        check_downloads(fake, downloader)
+    assert snapshotter.metrics.counters["downloads"] == 6
+    assert snapshotter.metrics.counters["downloaded_bytes"] == 6 * 300_000
+
+
+def test_async_snapshots_download_as_they_complete(tmp_path):
+    async def scenario(fake, downloader):
+        async with async_snapshot.AsyncSnapshotter(
+            fake.api_key,
+            max_workers=2,
+            max_requests_per_second=1000,
+            downloader=downloader,
+        ) as snapshotter:
+            await snapshotter.trigger_snapshots_on_filter("ALL")
+            await main.wait_for_snapshots_async(snapshotter, fast_scheduler())
+
+    with FakeFlywheel(projects=6, duration=0.05) as fake:
+        downloader = make_downloader(fake, tmp_path)
+        asyncio.run(scenario(fake, downloader))
+        downloader.close()
+
+        check_downloads(fake, downloader)
+
+
+def test_partial_download_resumes(tmp_path):
+    """Test a part file is resumed from where it ends, with the whole checked"""
+    with FakeFlywheel(projects=1) as fake:
+        record = fake.create_snapshot(next(iter(fake.projects)))
+        project_id, snapshot_id = record["parents"]["project"], record["_id"]
+        downloader = make_downloader(fake, tmp_path)
+        part_path = downloader.path(project_id, snapshot_id) + download.PART_SUFFIX
+        with open(part_path, "wb") as part_file:
+            part_file.write(fake.archive(snapshot_id)[:1000])
+
+        downloader.download(project_id, snapshot_id)
+        # Downloaded snapshots are not downloaded again
+        downloader.download(project_id, snapshot_id)
+
+        check_downloads(fake, downloader)
+        assert fake.downloads == [(snapshot_id, 1000)]
+    assert downloader.metrics.counters["downloads_resumed"] == 1
+
+
+@pytest.mark.parametrize("part", [b"corrupt", b"too long" * 1000])
+def test_bad_part_file_downloads_again(tmp_path, part):
+    """Test a part file that is not a prefix of the snapshot is replaced"""
+    with FakeFlywheel(projects=1) as fake:
+        record = fake.create_snapshot(next(iter(fake.projects)))
+        project_id, snapshot_id = record["parents"]["project"], record["_id"]
+        downloader = make_downloader(fake, tmp_path)
+        part_path = downloader.path(project_id, snapshot_id) + download.PART_SUFFIX
+        with open(part_path, "wb") as part_file:
+            part_file.write(part)
+
+        downloader.download(project_id, snapshot_id)
+
+        check_downloads(fake, downloader)
+        assert fake.downloads == [(snapshot_id, len(part)), (snapshot_id, 0)]
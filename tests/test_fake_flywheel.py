@@ -0,0 +1,70 @@
+"""End to end tests of the snapshotters against the local stand-in API"""
+
+import asyncio
+
+from fw_gear_sitewide_snapshot import main
+from fw_gear_sitewide_snapshot.snapshot import (
+    async_snapshot,
+    scheduler,
+    snapshot,
+    throttle,
+)
+
+from . import benchmark
+from .fake_flywheel import FakeFlywheel, connect
+
+
+def fast_scheduler():
+    return scheduler.PollScheduler(initial_interval=0.05, max_polls_per_second=1000)
+
+
+def test_snapshotter_end_to_end(monkeypatch):
+    """Test snapshots are triggered and waited on despite throttling"""
+    monkeypatch.setattr(throttle, "RETRY_BACKOFF", 0.01)
+    with FakeFlywheel(
+        projects=50, throttle_rate=0.1, duration=0.1, snapshot_failure_rate=0.2, seed=1
+    ) as fake:
+        snapshotter = connect(
+            snapshot.Snapshotter(
+                fake.api_key, max_workers=8, max_requests_per_second=1000
+            ),
+            fake.url,
+        )
+        snapshotter.trigger_snapshots_on_filter("ALL")
+        assert main.wait_for_snapshots(snapshotter, fast_scheduler()) == 0
+
+        stats = fake.stats()
+    assert not snapshotter.errors
+    assert len(snapshotter.snapshots) == stats["snapshots"] == 50
+    assert stats["responses"]["429"] > 0
+    statuses = {s.status.value for s in snapshotter.snapshots}
+    assert statuses == {"complete", "failed"}
+
+
+def test_async_snapshotter_end_to_end():
+    with FakeFlywheel(projects=50, duration=0.1) as fake:
+
+        async def run():
+            async with async_snapshot.AsyncSnapshotter(
+                fake.api_key, max_workers=8, max_requests_per_second=1000
+            ) as snapshotter:
+                await snapshotter.trigger_snapshots_on_filter("ALL")
+                await main.wait_for_snapshots_async(snapshotter, fast_scheduler())
+            return snapshotter
+
+        snapshotter = asyncio.run(run())
+    assert len(snapshotter.snapshots) == 50
+    assert snapshotter.is_finished()
+
+
+def test_run_benchmark():
+    args = benchmark.parse_args(
+        ["--duration", "0.1", "--latency", "0", "--poll-interval", "0.05"]
+    )
+    result = benchmark.run_benchmark(20, "threads", args, in_process=True)
+
+    assert result["size"] == 20
+    assert result["errors"] == 0
+    assert result["polls"] >= 20
+    assert result["requests"] >= 40
+    assert result["peak_mb"] > 0
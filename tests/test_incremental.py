@@ -0,0 +1,187 @@
+import datetime
+from unittest.mock import MagicMock, patch
+
+import flywheel
+
+from fw_gear_sitewide_snapshot.snapshot import (
+    incremental,
+    report,
+    snapshot,
+    snapshot_utils,
+)
+
+from .snapshot_assets import (
+    FAKE_GROUP,
+    FAKE_KEY,
+    FAKE_PROJECT_LABEL,
+    make_record,
+    mock_client,
+    mock_project,
+    mock_sdk_client,
+)
+
+SNAPSHOT_TIME = datetime.datetime(2024, 1, 2, 12, 0)
+CHANGED_ID = "000000000000000000000001"
+UNCHANGED_ID = "000000000000000000000002"
+
+
+def make_project(project_id, modified):
+    return flywheel.Project(
+        label=FAKE_PROJECT_LABEL,
+        id=project_id,
+        group=FAKE_GROUP,
+        modified=modified.replace(tzinfo=datetime.timezone.utc),
+    )
+
+
+def test_load_last_snapshots(tmp_path):
+    """Test the latest completed snapshot of each project is kept"""
+    states = snapshot_utils.SnapshotState
+    report_path = tmp_path / "snapshot_report.csv"
+    later = SNAPSHOT_TIME + datetime.timedelta(days=1)
+    report.write_report(
+        [
+            make_record(
+                "old",
+                project_id=CHANGED_ID,
+                created=SNAPSHOT_TIME,
+                status=states.complete,
+            ),
+            make_record(
+                "new", project_id=CHANGED_ID, created=later, status=states.complete
+            ),
+            make_record(
+                "newer", project_id=CHANGED_ID, created=later, status=states.failed
+            ),
+            make_record(
+                "failed",
+                project_id=UNCHANGED_ID,
+                created=SNAPSHOT_TIME,
+                status=states.failed,
+            ),
+        ],
+        report_path,
+    )
+
+    last_snapshots = incremental.load_last_snapshots(report_path)
+    assert list(last_snapshots) == [CHANGED_ID]
+    assert last_snapshots[CHANGED_ID].id == "new"
+
+
+def test_is_unchanged():
+    """Test a project is unchanged only if modified before its last snapshot"""
+    last = make_record(
+        "s", project_id=CHANGED_ID, created=SNAPSHOT_TIME, status="complete"
+    )
+    before = SNAPSHOT_TIME - datetime.timedelta(hours=1)
+    after = SNAPSHOT_TIME + datetime.timedelta(minutes=1)
+
+    assert incremental.is_unchanged(make_project(CHANGED_ID, before), last)
+    assert not incremental.is_unchanged(make_project(CHANGED_ID, after), last)
+    assert not incremental.is_unchanged(make_project(CHANGED_ID, before), None)
+    # Finder results from the REST API have ISO timestamps
+    assert incremental.is_unchanged({"modified": "2024-01-02T11:00:00Z"}, last)
+
+
+def test_parse_snapshot_list():
+    """Test the last completed snapshot is picked from a listing response"""
+    listing = [
+        {"_id": "a", "created": "2024-01-01T00:00:00Z", "status": "complete"},
+        {"_id": "b", "created": "2024-01-03T00:00:00Z", "status": "failed"},
+        {"_id": "c", "created": "2024-01-02T00:00:00Z", "status": "complete"},
+    ]
+    assert incremental.parse_snapshot_list(listing).id == "c"
+    assert incremental.parse_snapshot_list({"results": listing[1:2]}) is None
+
+
+@patch("fw_client.FWClient")
+@patch("flywheel.Client")
+def test_trigger_snapshots_on_filter_incremental(
+    patch_client, patch_sdk_client, mock_client, mock_sdk_client
+):
+    """Test unchanged projects are reported as skipped rather than snapshotted"""
+    modified = SNAPSHOT_TIME - datetime.timedelta(hours=1)
+    changed = make_project(CHANGED_ID, modified + datetime.timedelta(days=1))
+    unchanged = make_project(UNCHANGED_ID, modified)
+    mock_sdk_client.projects.iter_find.return_value = [changed, unchanged]
+    last_snapshots = {
+        project_id: make_record(
+            f"last_{project_id}",
+            project_id=project_id,
+            created=SNAPSHOT_TIME,
+            status="complete",
+            attempt=2,
+            history=[f"failed_{project_id}"],
+        )
+        for project_id in (CHANGED_ID, UNCHANGED_ID)
+    }
+
+    snapshotter = snapshot.Snapshotter(
+        api_key=FAKE_KEY, incremental=True, last_snapshots=last_snapshots
+    )
+    snapshotter.sdk_client = mock_sdk_client
+    snapshotter.make_snapshot_on_project = MagicMock()
+    snapshotter.trigger_snapshots_on_filter("ALL")
+
+    snapshotter.make_snapshot_on_project.assert_called_once_with(changed)
+    [skipped] = snapshotter.snapshots
+    assert skipped.id == f"last_{UNCHANGED_ID}"
+    assert skipped.status == snapshot_utils.SnapshotState.skipped
+    assert skipped.is_final()
+    assert skipped.project_label == FAKE_PROJECT_LABEL
+    assert skipped.attempt == 1 and not skipped.history
+
+
+@patch("fw_client.FWClient")
+@patch("flywheel.Client")
+def test_last_snapshot_from_api(
+    patch_client, patch_sdk_client, mock_client, mock_sdk_client
+):
+    """Test the listing endpoint is used when there is no previous report"""
+    mock_client.get.return_value = [
+        {"_id": "a", "created": "2024-01-01T00:00:00Z", "status": "complete"}
+    ]
+    snapshotter = snapshot.Snapshotter(api_key=FAKE_KEY, incremental=True)
+    snapshotter.snapshot_client = mock_client
+
+    assert snapshotter.last_snapshot(CHANGED_ID).id == "a"
+    mock_client.get.assert_called_with(f"/snapshot/projects/{CHANGED_ID}/snapshots")
+
+
+@patch("fw_client.FWClient")
+@patch("flywheel.Client")
+def test_chained_incremental_runs_keep_skipping(
+    patch_client, patch_sdk_client, tmp_path, mock_client, mock_sdk_client
+):
+    """Test a project skipped by one run is skipped by the next run too"""
+    unchanged = make_project(UNCHANGED_ID, SNAPSHOT_TIME - datetime.timedelta(hours=1))
+    mock_sdk_client.projects.iter_find.return_value = [unchanged]
+    first_report = tmp_path / "first.csv"
+    report.write_report(
+        [
+            make_record(
+                "last",
+                project_id=UNCHANGED_ID,
+                created=SNAPSHOT_TIME,
+                status="complete",
+            )
+        ],
+        first_report,
+    )
+
+    previous_report = first_report
+    for run in range(2):
+        snapshotter = snapshot.Snapshotter(
+            api_key=FAKE_KEY,
+            incremental=True,
+            last_snapshots=incremental.load_last_snapshots(previous_report),
+        )
+        snapshotter.sdk_client = mock_sdk_client
+        snapshotter.make_snapshot_on_project = MagicMock()
+        snapshotter.trigger_snapshots_on_filter("ALL")
+
+        snapshotter.make_snapshot_on_project.assert_not_called()
+        [skipped] = snapshotter.snapshots
+        assert (skipped.id, skipped.status) == ("last", "skipped")
+        previous_report = tmp_path / f"run_{run}.csv"
+        report.write_report(snapshotter.snapshots, previous_report)
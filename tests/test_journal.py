@@ -0,0 +1,75 @@
+from unittest.mock import MagicMock, patch
+
+from fw_gear_sitewide_snapshot.snapshot import journal, snapshot, snapshot_utils
+
+from .snapshot_assets import (
+    FAKE_KEY,
+    FAKE_PROJECT_ID,
+    FAKE_RESPONSE,
+    make_record,
+    mock_client,
+    mock_project,
+    mock_sdk_client,
+)
+
+
+def test_journal_round_trip(tmp_path):
+    path = tmp_path / journal.JOURNAL_FILENAME
+    first = make_record("first", project_id="a" * 24)
+    second = make_record("second", project_id="b" * 24)
+
+    with journal.Journal(path) as snapshot_journal:
+        snapshot_journal.record_snapshot(first)
+        snapshot_journal.record_snapshot(second)
+        first.status = snapshot_utils.SnapshotState.complete
+        snapshot_journal.record_status(first)
+
+    records = journal.load_journal(path)
+
+    assert records == [first, second]
+    assert records[0].status == snapshot_utils.SnapshotState.complete
+    assert records[1].status == snapshot_utils.SnapshotState.pending
+
+
+def test_load_journal_skips_truncated_line(tmp_path):
+    path = tmp_path / journal.JOURNAL_FILENAME
+    record = make_record("first", project_id=FAKE_PROJECT_ID)
+    with journal.Journal(path) as snapshot_journal:
+        snapshot_journal.record_snapshot(record)
+    with open(path, "a") as journal_file:
+        journal_file.write('{"event": "status", "id": "fi')
+
+    assert journal.load_journal(path) == [record]
+
+
+@patch("fw_client.FWClient")
+@patch("flywheel.Client")
+def test_snapshotter_journals_and_resumes(
+    patch_client, patch_sdk_client, mock_client, mock_sdk_client, tmp_path
+):
+    patch_client.return_value = mock_client
+    patch_sdk_client.return_value = mock_sdk_client
+    path = tmp_path / journal.JOURNAL_FILENAME
+
+    with journal.Journal(path) as snapshot_journal:
+        snapshotter = snapshot.Snapshotter(
+            api_key=FAKE_KEY, snapshot_journal=snapshot_journal
+        )
+        snapshotter.sdk_client = mock_sdk_client
+        snapshotter.snapshot_client = mock_client
+        snapshotter.log_snapshot(FAKE_RESPONSE)
+        mock_client.get.return_value = {"status": "in_progress"}
+        snapshotter.update_snapshots()
+
+    resumed = snapshot.Snapshotter(api_key=FAKE_KEY)
+    resumed.sdk_client = mock_sdk_client
+    resumed.make_snapshot_on_id = MagicMock()
+    resumed.resume(journal.load_journal(path))
+
+    assert [s.id for s in resumed.snapshots] == [FAKE_RESPONSE["_id"]]
+    assert resumed.snapshots[0].status == snapshot_utils.SnapshotState.in_progress
+
+    # Only the project that was not snapshotted before is triggered
+    other_project = "f" * 24
+    resumed.trigger_snapshots_on_list([FAKE_PROJECT_ID, other_project])
+    resumed.make_snapshot_on_id.assert_called_once_with(other_project)
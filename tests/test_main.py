@@ -1,15 +1,187 @@
 """Module to test main.py"""
+
+import math
+from unittest.mock import MagicMock, patch
+
 import pytest
 
-# from fw_gear_{{gear_package}}.main import run
+from fw_gear_sitewide_snapshot import main
+from fw_gear_sitewide_snapshot.snapshot import (
+    journal,
+    report,
+    scheduler,
+    snapshot,
+    snapshot_utils,
+)
+
+from .snapshot_assets import FAKE_KEY, FAKE_RESPONSE
+
+
+def make_snapshotter(records):
+    snapshotter = MagicMock()
+    snapshotter.snapshots = records
+    snapshotter.is_finished.side_effect = lambda: all(r.is_final() for r in records)
+    snapshotter.retry_failed_snapshots.return_value = 0
+    snapshotter.next_retry_in.return_value = math.inf
+    return snapshotter
+
+
+def test_wait_for_snapshots_finishes():
+    records = [
+        snapshot_utils.SnapshotRecord(**{**FAKE_RESPONSE, "_id": str(i)})
+        for i in range(3)
+    ]
+    snapshotter = make_snapshotter(records)
+
+    def complete(snapshots):
+        for record in snapshots:
+            record.status = snapshot_utils.SnapshotState.complete
+
+    snapshotter.update_snapshots.side_effect = complete
+    poll_scheduler = scheduler.PollScheduler(initial_interval=0.01)
+
+    assert main.wait_for_snapshots(snapshotter, poll_scheduler) == 0
+    assert all(r.is_final() for r in records)
+
+
+def test_wait_for_snapshots_times_out():
+    records = [snapshot_utils.SnapshotRecord(**FAKE_RESPONSE)]
+    snapshotter = make_snapshotter(records)
+    poll_scheduler = scheduler.PollScheduler(initial_interval=0.01)
+
+    with patch.object(main, "SNAPSHOT_TIMEOUT", 0.1):
+        assert main.wait_for_snapshots(snapshotter, poll_scheduler) == 1
+    # The unfinished snapshot was polled more than once before timing out
+    assert snapshotter.update_snapshots.call_count > 1
+
+
+def write_retry_report(path, statuses):
+    rows = []
+    for i, (project_id, status) in enumerate(statuses):
+        record = snapshot_utils.SnapshotRecord(
+            **{
+                **FAKE_RESPONSE,
+                "_id": f"snapshot{i}",
+                "status": status,
+                "parents": {"project": project_id},
+            }
+        )
+        rows.append(record)
+    report.write_report(rows, path)
+
+
+@pytest.mark.parametrize("extension", [".csv", ".jsonl"])
+def test_process_report_for_retry(tmp_path, extension):
+    states = snapshot_utils.SnapshotState
+    report_path = tmp_path / f"snapshot_report{extension}"
+    write_retry_report(
+        report_path,
+        [
+            ("000000000000000000000001", states.failed),
+            ("000000000000000000000001", states.failed),
+            ("000000000000000000000002", states.complete),
+            ("000000000000000000000003", states.failed),
+            ("000000000000000000000003", states.complete),
+            ("000000000000000000000004", states.pending),
+            ("000000000000000000000005", states.in_progress),
+        ],
+    )
+    snapshotter = snapshot.Snapshotter("key")
+
+    def fetch_status(record):
+        # Project 4's snapshot failed since the report was written, 5's completed
+        if record.parents.project.endswith("4"):
+            return snapshot_utils.SnapshotStatus(status=states.failed)
+        return snapshot_utils.SnapshotStatus(status=states.complete)
+
+    with patch.object(snapshotter, "fetch_status", side_effect=fetch_status):
+        projects, df = main.process_report_for_retry(report_path, snapshotter)
+
+    assert projects == ["000000000000000000000001", "000000000000000000000004"]
+    assert df["status"].tolist()[-2:] == ["failed", "complete"]
+    # The projects' labels came from the report
+    assert snapshotter.projects.get("000000000000000000000004").label
+
+
+def test_process_report_for_retry_leaves_the_run_alone(tmp_path):
+    """Test refreshing a report's snapshots neither journals, windows nor downloads"""
+    states = snapshot_utils.SnapshotState
+    report_path = tmp_path / "snapshot_report.csv"
+    write_retry_report(
+        report_path,
+        [
+            ("000000000000000000000001", states.pending),
+            ("000000000000000000000002", states.in_progress),
+        ],
+    )
+    snapshotter = snapshot.Snapshotter(
+        "key", snapshot_journal=MagicMock(), window=MagicMock(), downloader=MagicMock()
+    )
+
+    with patch.object(
+        snapshotter,
+        "fetch_status",
+        side_effect=[
+            snapshot_utils.SnapshotStatus(status=states.failed),
+            snapshot_utils.SnapshotStatus(status=states.complete),
+        ],
+    ):
+        projects, df = main.process_report_for_retry(report_path, snapshotter)
+
+    assert projects == ["000000000000000000000001"]
+    assert df["status"].tolist() == ["failed", "complete"]
+    assert not snapshotter.journal.method_calls
+    assert not snapshotter.window.method_calls
+    assert not snapshotter.downloader.method_calls
+    assert len(snapshotter.snapshots) == 0
+
+
+def test_parquet_report_falls_back_to_csv(tmp_path, monkeypatch):
+    monkeypatch.setattr(report, "parquet_available", lambda: False)
+    writer = main.make_report_writer(tmp_path / "snapshot_report.parquet")
+    assert str(writer.report_path).endswith("snapshot_report.csv")
+    assert not writer.append
+    assert main.make_report_writer(tmp_path / "snapshot_report.jsonl").append
+
+
+def run_gear(tmp_path, **options):
+    return main.run(
+        FAKE_KEY,
+        "group=group1",
+        "batch",
+        tmp_path / "snapshot_report.csv",
+        journal_path=tmp_path / "snapshot_journal.jsonl",
+        metrics_path=tmp_path / "run_metrics.json",
+        **options,
+    )
+
 
+@pytest.mark.parametrize(
+    "engine, reconcile",
+    [
+        ("threads", "process_report_for_retry"),
+        ("asyncio", "process_report_for_retry_async"),
+    ],
+)
+def test_run_without_failed_snapshots_still_finishes(tmp_path, engine, reconcile):
+    with patch.object(main, reconcile, return_value=([], None)), patch.object(
+        journal.Journal, "close", autospec=True
+    ) as close:
+        previous_report = tmp_path / "previous_report.csv"
+        assert run_gear(tmp_path, retry_failed=previous_report, engine=engine) == 0
 
-def test_run():
-    """Here is an example on how the test looks like for run.py
+    assert (tmp_path / "run_metrics.json").exists()
+    close.assert_called_once()
 
 
-    exit_code = run()
-    assert exit_code == 0
+def test_run_finishes_when_triggering_raises(tmp_path):
+    with patch.object(
+        snapshot.Snapshotter,
+        "trigger_snapshots_on_filter",
+        side_effect=RuntimeError("finder is down"),
+    ), patch.object(journal.Journal, "close", autospec=True) as close:
+        with pytest.raises(RuntimeError):
+            run_gear(tmp_path, retry_failed=None)
 
-    """
-    pass
+    assert (tmp_path / "run_metrics.json").exists()
+    close.assert_called_once()
@@ -0,0 +1,128 @@
+import json
+
+import pytest
+
+from fw_gear_sitewide_snapshot.snapshot import metrics, snapshot, throttle
+
+from .fake_flywheel import FakeFlywheel, connect
+from .snapshot_assets import FAKE_RECORD
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class FakeResponse:
+    def __init__(self, status_code):
+        self.status_code = status_code
+        self.headers = {"Retry-After": "0"}
+
+
+class FakeHTTPError(Exception):
+    def __init__(self, status_code):
+        super().__init__(f"HTTP {status_code}")
+        self.response = FakeResponse(status_code)
+
+
+def test_histogram():
+    histogram = metrics.Histogram()
+    for value in [0.001, 0.02, 0.02, 0.3, 12]:
+        histogram.observe(value)
+
+    assert histogram.count == 5
+    assert histogram.quantile(0.5) == 0.025
+    assert histogram.quantile(1) == 12
+    values = histogram.to_dict()
+    assert values["buckets"]["0.005"] == 1
+    assert values["buckets"]["+Inf"] == 5
+    assert values["max"] == 12
+
+
+def test_timed_records_latency_errors_and_in_flight():
+    clock = FakeClock()
+    run_metrics = metrics.Metrics(clock=clock)
+
+    def call(fail):
+        assert run_metrics.in_flight["trigger"] == 1
+        clock.now += 0.2
+        if fail:
+            raise FakeHTTPError(500)
+
+    timed = run_metrics.timed(metrics.TRIGGER, call)
+    timed(False)
+    with pytest.raises(FakeHTTPError):
+        timed(True)
+
+    trigger = run_metrics.to_dict()["endpoints"]["trigger"]
+    assert trigger["latency"]["count"] == 2
+    assert trigger["latency"]["sum"] == pytest.approx(0.4)
+    assert trigger["errors"] == {"500": 1}
+    assert trigger["max_in_flight"] == 1
+    assert run_metrics.in_flight["trigger"] == 0
+
+
+def test_throttle_records_retries():
+    run_metrics = metrics.Metrics()
+    calls = []
+
+    def flaky():
+        calls.append(1)
+        if len(calls) == 1:
+            raise FakeHTTPError(429)
+        return "ok"
+
+    limiter = throttle.Throttle(max_requests_per_second=1000, metrics=run_metrics)
+    assert limiter.call(run_metrics.timed(metrics.STATUS, flaky)) == "ok"
+
+    status = run_metrics.to_dict()["endpoints"]["status"]
+    assert status["retries"] == 1
+    assert status["errors"] == {"429": 1}
+    assert "throttle_wait_seconds" in run_metrics.counters
+
+
+def test_write_metrics(tmp_path):
+    run_metrics = metrics.Metrics()
+    run_metrics.timed(metrics.FIND, lambda: None)()
+    with run_metrics.phase("trigger"):
+        pass
+    run_metrics.record_snapshots([FAKE_RECORD])
+
+    run_metrics.write_json(tmp_path / metrics.METRICS_FILENAME)
+    run_metrics.write_prometheus(tmp_path / metrics.PROMETHEUS_FILENAME)
+
+    values = json.loads((tmp_path / metrics.METRICS_FILENAME).read_text())
+    assert values["snapshots"] == {"pending": 1}
+    assert "trigger" in values["phases"]
+    prometheus = (tmp_path / metrics.PROMETHEUS_FILENAME).read_text()
+    assert 'sitewide_snapshot_snapshots{status="pending"} 1' in prometheus
+    assert (
+        'sitewide_snapshot_request_duration_seconds_bucket{endpoint="find",le="+Inf"} 1'
+        in prometheus
+    )
+
+
+def test_snapshotter_metrics(monkeypatch):
+    """Test every API call of a snapshotter is measured by endpoint"""
+    monkeypatch.setattr(throttle, "RETRY_BACKOFF", 0.01)
+    with FakeFlywheel(projects=20, throttle_rate=0.2, duration=60, seed=2) as fake:
+        snapshotter = connect(
+            snapshot.Snapshotter(
+                fake.api_key, max_workers=4, max_requests_per_second=1000
+            ),
+            fake.url,
+        )
+        snapshotter.trigger_snapshots_on_filter("ALL")
+        snapshotter.update_snapshots()
+        stats = fake.stats()
+
+    values = snapshotter.metrics.to_dict()
+    endpoints = values["endpoints"]
+    assert endpoints["trigger"]["latency"]["count"] == stats["requests"]["trigger"]
+    assert endpoints["status"]["latency"]["count"] == stats["requests"]["detail"]
+    assert endpoints["trigger"]["retries"] == stats["faults"].get("trigger", 0)
+    assert endpoints["status"]["retries"] == stats["faults"].get("detail", 0)
+    assert values["phases"]["find"] > 0
@@ -0,0 +1,118 @@
+import asyncio
+import csv
+
+import pytest
+
+from fw_gear_sitewide_snapshot.snapshot import (
+    async_snapshot,
+    ordering,
+    report,
+    snapshot,
+)
+
+from .fake_flywheel import FakeFlywheel, connect
+from .snapshot_assets import FAKE_RESPONSE, make_record
+
+
+def sized(project_id: str, files: int = None) -> dict:
+    project = {"_id": project_id}
+    if files is not None:
+        project["stats"] = {"number_of": {"files": files, "sessions": 0}}
+    return project
+
+
+def test_estimates_from_durations_and_sizes():
+    """Test sizes are priced at the rate of past snapshots, unknowns at the median"""
+    estimator = ordering.CostEstimator({"a": 100.0, "b": 30.0})
+    projects = [sized("a", 50), sized("b"), sized("c", 10), sized("d")]
+
+    estimates = estimator.estimate(projects)
+
+    # "a" took 2 seconds per file, "d" has neither a duration nor stats
+    assert estimates == {"a": 100.0, "b": 30.0, "c": 20.0, "d": 30.0}
+    ordered = ordering.longest_first(projects, estimates)
+    assert [p["_id"] for p in ordered] == ["a", "b", "d", "c"]
+
+
+def test_nothing_known_keeps_finder_order():
+    projects = [sized("a"), sized("b")]
+    estimates = ordering.CostEstimator().estimate(projects)
+    assert estimates == {"a": None, "b": None}
+    assert ordering.longest_first(projects, estimates) == projects
+
+
+def test_load_durations(tmp_path):
+    """Test the duration of each project's latest completed snapshot is read"""
+    path = tmp_path / "snapshot_report.csv"
+    records = [
+        make_record(
+            "old", created="2024-01-01T00:00:00", status="complete", duration_seconds=10
+        ),
+        make_record(
+            "new",
+            created="2024-02-01T00:00:00",
+            status="complete",
+            duration_seconds=12.5,
+        ),
+        make_record(
+            "failed", created="2024-03-01T00:00:00", status="failed", duration_seconds=1
+        ),
+    ]
+    report.write_report(records, path)
+
+    durations = ordering.load_durations(path)
+    assert durations == {FAKE_RESPONSE["parents"].project: 12.5}
+
+
+def test_load_durations_from_an_earlier_report(tmp_path):
+    path = tmp_path / "snapshot_report.csv"
+    row = make_record(
+        "old", created="2024-01-01T00:00:00", status="complete", duration_seconds=None
+    ).to_row()
+    with open(path, "w", newline="") as report_file:
+        writer = csv.DictWriter(report_file, fieldnames=report.REQUIRED_COLUMNS)
+        writer.writeheader()
+        writer.writerow({k: row[k] for k in report.REQUIRED_COLUMNS})
+
+    assert ordering.load_durations(path) == {}
+
+
+def test_snapshotter_triggers_largest_projects_first():
+    """Test projects are triggered by size, with estimates and durations reported"""
+    with FakeFlywheel(projects=12, duration=0.05) as fake:
+        snapshotter = connect(
+            snapshot.Snapshotter(
+                fake.api_key,
+                max_requests_per_second=1000,
+                estimator=ordering.CostEstimator(),
+            ),
+            fake.url,
+        )
+        snapshotter.trigger_snapshots_on_filter("ALL")
+        triggered = [s["project"] for s in fake.snapshots.values()]
+        while not snapshotter.is_finished():
+            snapshotter.update_snapshots()
+
+    assert triggered == sorted(fake.sizes, key=fake.sizes.get, reverse=True)
+    rows = [s.to_row() for s in snapshotter.snapshots]
+    largest = max(fake.sizes.values())
+    assert float(rows[0]["estimated_seconds"]) == pytest.approx(
+        largest * ordering.DEFAULT_SECONDS_PER_ITEM, abs=0.1
+    )
+    assert all(float(row["duration_seconds"]) >= 0 for row in rows)
+
+
+def test_async_snapshotter_triggers_largest_projects_first():
+    async def scenario(fake):
+        async with async_snapshot.AsyncSnapshotter(
+            fake.api_key,
+            max_requests_per_second=1000,
+            estimator=ordering.CostEstimator(),
+        ) as snapshotter:
+            await snapshotter.trigger_snapshots_on_filter("ALL")
+
+    with FakeFlywheel(projects=12) as fake:
+        asyncio.run(scenario(fake))
+        triggered = [s["project"] for s in fake.snapshots.values()]
+
+    assert triggered == sorted(fake.sizes, key=fake.sizes.get, reverse=True)
@@ -0,0 +1,69 @@
+import asyncio
+import threading
+
+import pytest
+
+from fw_gear_sitewide_snapshot.snapshot import pipeline
+
+
+def test_prefetch_runs_ahead_of_the_consumer():
+    """Test items are fetched in the background, at most `maxsize` ahead"""
+    fetched = []
+
+    def pages():
+        for i in range(10):
+            fetched.append(i)
+            yield i
+
+    items = pipeline.prefetch(pages(), maxsize=3)
+    assert next(items) == 0
+    # The producer fills the queue while the consumer holds the first item
+    for _ in range(100):
+        if len(fetched) == 5:
+            break
+        threading.Event().wait(0.01)
+    assert len(fetched) == 5
+    assert list(items) == list(range(1, 10))
+
+
+def test_prefetch_raises_errors_in_order():
+    """Test an error of the iteration is raised after the items before it"""
+
+    def pages():
+        yield 1
+        raise RuntimeError("page failed")
+
+    items = pipeline.prefetch(pages())
+    assert next(items) == 1
+    with pytest.raises(RuntimeError, match="page failed"):
+        next(items)
+
+
+def test_prefetch_stops_with_the_consumer():
+    """Test the producer thread ends when the consumer stops early"""
+    items = pipeline.prefetch(iter(range(100000)), maxsize=1)
+    assert next(items) == 0
+    items.close()
+    assert not any(t.name == "Prefetch" for t in threading.enumerate())
+
+
+def test_drain_bounds_concurrency():
+    """Test every item is processed by at most `workers` tasks at once"""
+    processed = []
+    active = {"now": 0, "max": 0}
+
+    async def items():
+        for i in range(20):
+            yield i
+
+    async def func(item):
+        active["now"] += 1
+        active["max"] = max(active["max"], active["now"])
+        await asyncio.sleep(0.001)
+        processed.append(item)
+        active["now"] -= 1
+
+    asyncio.run(pipeline.drain(items(), func, workers=4, maxsize=2))
+
+    assert sorted(processed) == list(range(20))
+    assert active["max"] == 4
@@ -0,0 +1,61 @@
+import threading
+import time
+from unittest.mock import MagicMock
+
+from fw_gear_sitewide_snapshot import profiling
+
+
+def busy_worker(stop):
+    while not stop.is_set():
+        sum(range(1000))
+
+
+def test_profiler_writes_profile(tmp_path):
+    """Test the profile of every thread and the top allocators are written"""
+    stop = threading.Event()
+    worker = threading.Thread(target=busy_worker, args=(stop,), name="worker")
+    with profiling.Profiler(tmp_path, sample_interval=0.001):
+        worker.start()
+        allocated = [bytearray(1024) for _ in range(100)]
+        time.sleep(0.1)
+        stop.set()
+        worker.join()
+
+    assert (tmp_path / profiling.PSTATS_FILENAME).stat().st_size > 0
+    assert "cumulative" in (tmp_path / profiling.SUMMARY_FILENAME).read_text()
+    stacks = (tmp_path / profiling.STACKS_FILENAME).read_text().splitlines()
+    assert any(line.startswith("worker;") and "busy_worker" in line for line in stacks)
+    assert all(line.rsplit(" ", 1)[1].isdigit() for line in stacks)
+    memory = (tmp_path / profiling.MEMORY_FILENAME).read_text()
+    assert memory.startswith("Peak traced memory")
+    assert "test_profiling.py" in memory
+    assert len(allocated) == 100
+
+
+def test_profiler_reports_allocators_at_the_peak(tmp_path):
+    """Test memory freed before the end is still reported as allocated at the peak"""
+    with profiling.Profiler(tmp_path, sample_interval=0.001):
+        peak = [bytearray(2048) for _ in range(1000)]
+        time.sleep(0.1)
+        del peak
+
+    allocators = (tmp_path / profiling.MEMORY_FILENAME).read_text().split("\n\n")
+    kib = max(
+        float(allocator.split()[0])
+        for allocator in allocators
+        if "bytearray(2048)" in allocator
+    )
+    assert kib >= 2000
+
+
+def test_profiled_is_transparent_when_off(tmp_path):
+    """Test a profiled function only profiles given a profile directory"""
+    func = MagicMock(return_value=0)
+    profiled = profiling.profiled(func)
+
+    assert profiled("a", profile_dir=None) == 0
+    func.assert_called_once_with("a", profile_dir=None)
+    assert not list(tmp_path.iterdir())
+
+    assert profiled("a", profile_dir=tmp_path) == 0
+    assert (tmp_path / profiling.PSTATS_FILENAME).exists()
@@ -0,0 +1,34 @@
+from fw_gear_sitewide_snapshot.snapshot import project_cache
+
+from .snapshot_assets import (
+    FAKE_GROUP,
+    FAKE_PROJECT_ID,
+    FAKE_PROJECT_LABEL,
+    mock_project,
+)
+
+
+def test_add_and_get(mock_project):
+    cache = project_cache.ProjectCache()
+    info = cache.add(mock_project)
+
+    assert info == project_cache.ProjectInfo(
+        id=FAKE_PROJECT_ID, label=FAKE_PROJECT_LABEL, group=FAKE_GROUP
+    )
+    assert FAKE_PROJECT_ID in cache
+    assert cache.get(FAKE_PROJECT_ID) == info
+    assert cache.get("missing") is None
+
+
+def test_evicts_least_recently_used():
+    cache = project_cache.ProjectCache(max_size=2)
+    cache.add({"_id": "a", "label": "A"})
+    cache.add({"_id": "b", "label": "B"})
+    # Touch "a" so that "b" is the least recently used
+    cache.get("a")
+    cache.add({"_id": "c", "label": "C"})
+
+    assert len(cache) == 2
+    assert "a" in cache
+    assert "b" not in cache
+    assert "c" in cache
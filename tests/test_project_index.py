@@ -0,0 +1,138 @@
+import asyncio
+import datetime
+from unittest.mock import MagicMock, patch
+
+import flywheel
+import pytest
+
+from fw_gear_sitewide_snapshot.snapshot import async_snapshot, project_index, snapshot
+
+from .fake_flywheel import FakeFlywheel
+from .snapshot_assets import (
+    FAKE_GROUP,
+    FAKE_KEY,
+    FAKE_PROJECT_ID,
+    FAKE_PROJECT_LABEL,
+    mock_client,
+    mock_project,
+    mock_sdk_client,
+)
+
+MODIFIED = datetime.datetime(2024, 1, 2, 12, 0, tzinfo=datetime.timezone.utc)
+
+
+def test_record_and_load(tmp_path):
+    """Test an index is only saved once every project was recorded"""
+    path = tmp_path / project_index.PROJECT_INDEX_FILENAME
+    index = project_index.ProjectIndex(path)
+    sdk_project = flywheel.Project(
+        label=FAKE_PROJECT_LABEL,
+        id=FAKE_PROJECT_ID,
+        group=FAKE_GROUP,
+        modified=MODIFIED,
+    )
+    finder_project = {"_id": "b" * 24, "label": "other", "group": FAKE_GROUP}
+
+    recorded = index.record([sdk_project, finder_project], "group=g")
+    assert next(recorded) is sdk_project
+    assert not path.exists()
+    assert list(recorded) == [finder_project]
+
+    indexed_filter, projects = project_index.load_project_index(path)
+    assert indexed_filter == "group=g"
+    assert projects == [
+        {
+            "_id": FAKE_PROJECT_ID,
+            "label": FAKE_PROJECT_LABEL,
+            "group": FAKE_GROUP,
+            "modified": MODIFIED.isoformat(),
+        },
+        {"_id": "b" * 24, "label": "other", "group": FAKE_GROUP, "modified": None},
+    ]
+
+
+def test_interrupted_record_is_not_saved(tmp_path):
+    """Test a finder error leaves no index behind"""
+    path = tmp_path / project_index.PROJECT_INDEX_FILENAME
+
+    def found():
+        yield {"_id": FAKE_PROJECT_ID}
+        raise RuntimeError("page failed")
+
+    with pytest.raises(RuntimeError):
+        list(project_index.ProjectIndex(path).record(found(), ""))
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_interrupted_async_record_is_not_saved(tmp_path):
+    path = tmp_path / project_index.PROJECT_INDEX_FILENAME
+
+    async def found():
+        yield {"_id": FAKE_PROJECT_ID}
+        raise RuntimeError("page failed")
+
+    async def scenario():
+        index = project_index.ProjectIndex(path)
+        return [p async for p in index.record_async(found(), "")]
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(scenario())
+    assert list(tmp_path.iterdir()) == []
+
+
+@pytest.mark.parametrize(
+    "project_filter, incremental, reused",
+    [("", False, True), ("group=other", False, False), ("", True, False)],
+)
+@patch("fw_client.FWClient")
+@patch("flywheel.Client")
+def test_trigger_on_filter_reuses_index(
+    patch_client,
+    patch_sdk_client,
+    project_filter,
+    incremental,
+    reused,
+    mock_client,
+    mock_sdk_client,
+    mock_project,
+):
+    """Test indexed projects replace the finder only for the same filter"""
+    indexed = {"_id": "c" * 24, "label": "indexed", "group": FAKE_GROUP}
+    snapshotter = snapshot.Snapshotter(
+        api_key=FAKE_KEY, incremental=incremental, last_snapshots={}
+    )
+    snapshotter.sdk_client = mock_sdk_client
+    snapshotter.make_snapshot_on_project = MagicMock()
+    snapshotter.use_project_index("", [indexed])
+
+    snapshotter.trigger_snapshots_on_filter(project_filter or "ALL")
+
+    assert snapshotter.projects.get(indexed["_id"]).label == "indexed"
+    assert mock_sdk_client.projects.iter_find.called != reused
+    snapshotter.make_snapshot_on_project.assert_called_once_with(
+        indexed if reused else mock_project
+    )
+
+
+def test_async_snapshotter_indexes_lean_projects(tmp_path):
+    """Test the asyncio engine indexes the slim projects listed by the finder"""
+    path = tmp_path / project_index.PROJECT_INDEX_FILENAME
+
+    async def scenario(fake):
+        async with async_snapshot.AsyncSnapshotter(
+            fake.api_key,
+            max_workers=4,
+            max_requests_per_second=1000,
+            index=project_index.ProjectIndex(path),
+        ) as snapshotter:
+            await snapshotter.trigger_snapshots_on_filter("ALL")
+        return snapshotter
+
+    with FakeFlywheel(projects=30) as fake:
+        snapshotter = asyncio.run(scenario(fake))
+
+    assert len(snapshotter.snapshots) == 30
+    indexed_filter, projects = project_index.load_project_index(path)
+    assert indexed_filter == ""
+    assert [p["_id"] for p in projects] == list(fake.projects)
+    assert set(projects[0]) == {"_id", "label", "group", "modified"}
@@ -0,0 +1,210 @@
+import csv
+import datetime
+
+import pandas as pd
+import pytest
+
+from fw_gear_sitewide_snapshot import merge
+from fw_gear_sitewide_snapshot.snapshot import report, snapshot_utils
+
+from .snapshot_assets import (
+    FAKE_BATCH_NAME,
+    FAKE_GROUP,
+    FAKE_PROJECT_ID,
+    FAKE_PROJECT_LABEL,
+    FAKE_RECORD,
+    FAKE_RESPONSE,
+    FAKE_SNAPSHOT_ID,
+    make_record,
+)
+
+
+def test_write_report(tmp_path):
+    path = tmp_path / "snapshot_report.csv"
+    complete = snapshot_utils.SnapshotRecord(
+        **{**FAKE_RESPONSE, "_id": "other", "status": "complete"}
+    )
+
+    report.write_report([FAKE_RECORD, complete], path)
+
+    with open(path, newline="") as report_file:
+        rows = list(csv.DictReader(report_file))
+    assert list(rows[0]) == report.REPORT_COLUMNS
+    assert rows[0] == {
+        "group_label": FAKE_GROUP,
+        "project_label": FAKE_PROJECT_LABEL,
+        "project_id": FAKE_PROJECT_ID,
+        "snapshot_id": FAKE_SNAPSHOT_ID,
+        "timestamp": FAKE_RECORD.format_timestamp(),
+        "batch_label": FAKE_BATCH_NAME,
+        "status": "pending",
+        "estimated_seconds": "",
+        "duration_seconds": "",
+        "attempt": "1",
+        "snapshot_history": "",
+        "matched_filter": "",
+    }
+    assert rows[1]["status"] == "complete"
+    assert not (tmp_path / "snapshot_report.csv.tmp").exists()
+
+
+def test_write_report_matches_dataframe_report(tmp_path):
+    path = tmp_path / "snapshot_report.csv"
+    report.write_report([FAKE_RECORD], path)
+
+    expected = pd.DataFrame([FAKE_RECORD.to_series()])
+    read = pd.read_csv(path, dtype=str, keep_default_na=False)
+    pd.testing.assert_frame_equal(read, expected)
+
+
+def test_report_writer_flush_interval(tmp_path):
+    path = tmp_path / "snapshot_report.csv"
+    writer = report.ReportWriter(path, flush_interval=3600)
+
+    writer.maybe_flush([FAKE_RECORD])
+    assert not path.exists()
+
+    writer.flush_interval = 0
+    writer.maybe_flush([FAKE_RECORD])
+    assert path.exists()
+
+
+def test_merge_reports(tmp_path):
+    """Test shard reports merge into one report, without duplicate snapshots"""
+    first, second = tmp_path / "shard_0.csv", tmp_path / "shard_1.csv"
+    other = snapshot_utils.SnapshotRecord(**{**FAKE_RESPONSE, "_id": "other"})
+    complete = snapshot_utils.SnapshotRecord(**{**FAKE_RESPONSE, "status": "complete"})
+    report.write_report([FAKE_RECORD, other], first)
+    report.write_report([complete], second)
+    merged = tmp_path / "snapshot_report.csv"
+
+    assert merge.main([str(first), str(second), "-o", str(merged)]) == 0
+
+    with open(merged, newline="") as report_file:
+        rows = list(csv.DictReader(report_file))
+    assert [(r["snapshot_id"], r["status"]) for r in rows] == [
+        (FAKE_SNAPSHOT_ID, "complete"),
+        ("other", "pending"),
+    ]
+
+
+def test_merge_jsonl_reports(tmp_path):
+    """Test reports of other formats merge into a report of the output's format"""
+    first, second = tmp_path / "shard_0.jsonl", tmp_path / "shard_1.csv"
+    other = snapshot_utils.SnapshotRecord(**{**FAKE_RESPONSE, "_id": "other"})
+    complete = snapshot_utils.SnapshotRecord(**{**FAKE_RESPONSE, "status": "complete"})
+    report.write_report([FAKE_RECORD, other], first)
+    report.write_report([complete], second)
+    merged = tmp_path / "snapshot_report.jsonl"
+
+    assert merge.main([str(first), str(second), "-o", str(merged)]) == 0
+
+    rows = list(report.read_json_lines(merged))
+    assert [(r["snapshot_id"], r["status"]) for r in rows] == [
+        (FAKE_SNAPSHOT_ID, "complete"),
+        ("other", "pending"),
+    ]
+
+
+def test_merge_reports_rejects_other_files(tmp_path):
+    not_a_report = tmp_path / "other.csv"
+    not_a_report.write_text("a,b\n1,2\n")
+
+    with pytest.raises(ValueError):
+        report.merge_reports([not_a_report], tmp_path / "snapshot_report.csv")
+
+
+FORMATS = [".csv", ".jsonl", ".parquet"]
+
+
+def retried_record() -> snapshot_utils.SnapshotRecord:
+    return snapshot_utils.SnapshotRecord(
+        **{
+            **FAKE_RESPONSE,
+            "_id": "retry",
+            "status": "failed",
+            "duration_seconds": 12.25,
+            "attempt": 3,
+            "history": ["first", "second"],
+        }
+    )
+
+
+@pytest.mark.parametrize("extension", FORMATS)
+def test_read_report_of_any_format(tmp_path, extension):
+    """Test every format reads back as the rows of a CSV report"""
+    path = tmp_path / f"snapshot_report{extension}"
+    report.write_report([FAKE_RECORD, retried_record()], path)
+
+    read = report.read_report(path)
+    assert read.to_dict(orient="records") == [
+        FAKE_RECORD.to_row(),
+        retried_record().to_row(),
+    ]
+    required = report.read_report(path, columns=report.REQUIRED_COLUMNS)
+    assert list(required.columns) == report.REQUIRED_COLUMNS
+    assert list(report.iter_rows(path)) == read.to_dict(orient="records")
+
+
+def test_parquet_report_is_typed(tmp_path):
+    import pyarrow.parquet as pq
+
+    path = tmp_path / "snapshot_report.parquet"
+    report.write_report([FAKE_RECORD, retried_record()], path)
+
+    schema = pq.read_schema(path)
+    assert str(schema.field("status").type).startswith("dictionary")
+    assert str(schema.field("timestamp").type) == "timestamp[us]"
+    frame = pd.read_parquet(path)
+    assert frame["attempt"].tolist() == [1, 3]
+    assert list(frame["snapshot_history"][1]) == ["first", "second"]
+
+
+@pytest.mark.parametrize("extension", FORMATS)
+def test_report_writer_appends_changes(tmp_path, extension):
+    """Test an appending writer only writes the snapshots that changed"""
+    path = tmp_path / f"snapshot_report{extension}"
+    records = [
+        snapshot_utils.SnapshotRecord(**{**FAKE_RESPONSE, "_id": snapshot_id})
+        for snapshot_id in ("a", "b")
+    ]
+    writer = report.ReportWriter(path, append=True)
+
+    writer.flush(records)
+    records[1].status = snapshot_utils.SnapshotState.complete
+    writer.flush(records)
+    writer.flush(records)
+
+    if extension == ".jsonl":
+        assert len(path.read_text().splitlines()) == 3
+    read = report.read_report(path)
+    assert read["snapshot_id"].tolist() == ["a", "b"]
+    assert read["status"].tolist() == ["pending", "complete"]
+
+
+def test_jsonl_report_skips_truncated_line(tmp_path):
+    path = tmp_path / "snapshot_report.jsonl"
+    report.write_report([FAKE_RECORD], path)
+    with open(path, "a") as report_file:
+        report_file.write('{"snapshot_id": "trunc')
+
+    assert len(report.read_report(path)) == 1
+
+
+def test_unknown_report_format(tmp_path):
+    with pytest.raises(ValueError):
+        report.write_report([FAKE_RECORD], tmp_path / "snapshot_report.xlsx")
+
+
+@pytest.mark.parametrize("extension", [".jsonl", ".parquet"])
+def test_read_report_of_mixed_precision_timestamps(tmp_path, extension):
+    """Test timestamps with and without microseconds read back alike"""
+    path = tmp_path / f"snapshot_report{extension}"
+    records = [
+        make_record("whole", created=datetime.datetime(2024, 1, 2, 12, 30)),
+        make_record("fraction", created=datetime.datetime(2024, 1, 2, 13, 5, 7, 49638)),
+    ]
+    report.write_report(records, path)
+
+    read = report.read_report(path)
+    assert read["timestamp"].tolist() == ["2024-01-02 12:30", "2024-01-02 13:05"]
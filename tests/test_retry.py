@@ -0,0 +1,184 @@
+import asyncio
+import datetime
+import math
+from unittest.mock import AsyncMock, patch
+
+from fw_gear_sitewide_snapshot import main
+from fw_gear_sitewide_snapshot.snapshot import (
+    async_snapshot,
+    journal,
+    retry,
+    scheduler,
+    snapshot,
+    snapshot_store,
+    snapshot_utils,
+)
+
+from .fake_flywheel import FakeFlywheel, connect
+from .snapshot_assets import FAKE_KEY
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def failed(snapshot_id: str, attempt: int = 1) -> snapshot_store.CompactSnapshot:
+    return snapshot_store.CompactSnapshot(
+        snapshot_id,
+        "project",
+        datetime.datetime(2024, 1, 1),
+        status=snapshot_utils.SnapshotState.failed,
+        attempt=attempt,
+    )
+
+
+def fast_scheduler() -> scheduler.PollScheduler:
+    return scheduler.PollScheduler(
+        initial_interval=0.01, max_interval=0.02, max_polls_per_second=1000
+    )
+
+
+def check_retries(rows: list, fake: FakeFlywheel, max_retries: int) -> None:
+    """Checks every project is reported once, with each of its attempts"""
+    assert len(rows) == len(fake.projects)
+    assert sum(int(row["attempt"]) for row in rows) == len(fake.snapshots)
+    assert any(int(row["attempt"]) > 1 for row in rows)
+    for row in rows:
+        history = snapshot_utils.parse_history(row["snapshot_history"])
+        assert len(history) == int(row["attempt"]) - 1
+        for snapshot_id in history:
+            assert fake.snapshots[snapshot_id]["fails"]
+        if row["status"] == "failed":
+            assert int(row["attempt"]) == max_retries + 1
+
+
+def test_backoff_doubles_up_to_the_maximum():
+    queue = retry.RetryQueue(max_retries=5, backoff=10, max_backoff=30)
+    with patch.object(retry.random, "uniform", return_value=1.0):
+        assert [queue.delay(attempt) for attempt in (1, 2, 3, 4)] == [10, 20, 30, 30]
+
+
+def test_queue_keeps_to_the_retry_budget():
+    clock = FakeClock()
+    queue = retry.RetryQueue(max_retries=1, backoff=10, clock=clock)
+    assert queue.next_retry_in() == math.inf
+    assert queue.offer(failed("first"))
+    assert not queue.offer(failed("second", attempt=2))
+    assert len(queue) == 1
+
+    assert queue.pop_due() == []
+    clock.now = 15
+    assert [record.id for record in queue.pop_due()] == ["first"]
+    assert not queue
+
+
+def test_failed_triggers_count_as_attempts():
+    clock = FakeClock()
+    queue = retry.RetryQueue(max_retries=2, backoff=10, clock=clock)
+    record = failed("first")
+    with patch.object(retry.random, "uniform", return_value=1.0):
+        assert queue.offer(record)
+        clock.now = 10
+        assert queue.pop_due() == [record]
+        assert queue.offer_again(record)
+        assert queue.next_retry_in() == 20
+        clock.now = 30
+        assert queue.pop_due() == [record]
+        assert not queue.offer_again(record)
+    assert not queue
+
+
+def test_retry_is_queued_again_when_its_trigger_fails():
+    snapshotter = snapshot.Snapshotter(
+        FAKE_KEY, retry_queue=retry.RetryQueue(max_retries=2, backoff=0)
+    )
+    record = failed("first")
+    with patch.object(snapshotter, "trigger", side_effect=TimeoutError("timed out")):
+        snapshotter.retry_snapshot(record)
+        assert snapshotter.retry_queue.pop_due() == [record]
+        assert not snapshotter.errors
+
+        snapshotter.run_concurrently(snapshotter.retry_snapshot, [record])
+    assert not snapshotter.retry_queue
+    assert [item for item, _ in snapshotter.errors] == [record]
+
+
+def test_async_retry_is_queued_again_when_its_trigger_fails():
+    snapshotter = async_snapshot.AsyncSnapshotter(
+        FAKE_KEY, retry_queue=retry.RetryQueue(max_retries=2, backoff=0)
+    )
+    record = failed("first")
+    with patch.object(
+        snapshotter, "trigger", AsyncMock(side_effect=TimeoutError("timed out"))
+    ):
+        asyncio.run(snapshotter.retry_snapshot(record))
+        assert snapshotter.retry_queue.pop_due() == [record]
+        assert not snapshotter.errors
+
+        asyncio.run(snapshotter.run_concurrently(snapshotter.retry_snapshot, [record]))
+    assert not snapshotter.retry_queue
+    assert [item for item, _ in snapshotter.errors] == [record]
+
+
+def test_journal_drops_retried_snapshots(tmp_path):
+    path = tmp_path / journal.JOURNAL_FILENAME
+    first = snapshot_utils.SnapshotRecord(
+        _id="first", status="failed", parents={"project": "project"}
+    )
+    second = snapshot_utils.SnapshotRecord(
+        _id="second", parents={"project": "project"}, attempt=2, history=["first"]
+    )
+    with journal.Journal(path) as snapshot_journal:
+        snapshot_journal.record_snapshot(first)
+        snapshot_journal.record_snapshot(second)
+
+    records = journal.load_journal(path)
+    assert [(r.id, r.attempt, r.history) for r in records] == [("second", 2, ["first"])]
+
+
+def test_failed_snapshots_are_retried():
+    """Test failed snapshots are triggered again, replacing them in the report"""
+    with FakeFlywheel(
+        projects=20, duration=0.02, snapshot_failure_rate=0.4, seed=5
+    ) as fake:
+        snapshotter = connect(
+            snapshot.Snapshotter(
+                fake.api_key,
+                max_workers=4,
+                max_requests_per_second=1000,
+                retry_queue=retry.RetryQueue(max_retries=2, backoff=0.01),
+            ),
+            fake.url,
+        )
+        snapshotter.trigger_snapshots_on_filter("ALL")
+        assert main.wait_for_snapshots(snapshotter, fast_scheduler()) == 0
+
+    check_retries([s.to_row() for s in snapshotter.snapshots], fake, 2)
+    retried = len(fake.snapshots) - len(fake.projects)
+    assert snapshotter.metrics.counters["snapshot_retries"] == retried
+
+
+def test_async_failed_snapshots_are_retried():
+    async def scenario(fake):
+        async with async_snapshot.AsyncSnapshotter(
+            fake.api_key,
+            max_workers=4,
+            max_requests_per_second=1000,
+            retry_queue=retry.RetryQueue(max_retries=2, backoff=0.01),
+        ) as snapshotter:
+            await snapshotter.trigger_snapshots_on_filter("ALL")
+            assert (
+                await main.wait_for_snapshots_async(snapshotter, fast_scheduler()) == 0
+            )
+        return snapshotter
+
+    with FakeFlywheel(
+        projects=20, duration=0.02, snapshot_failure_rate=0.4, seed=5
+    ) as fake:
+        snapshotter = asyncio.run(scenario(fake))
+
+    check_retries([s.to_row() for s in snapshotter.snapshots], fake, 2)
@@ -0,0 +1,80 @@
+from fw_gear_sitewide_snapshot.snapshot import scheduler
+
+from .snapshot_assets import make_record
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_interval_backs_off_to_max():
+    poll_scheduler = scheduler.PollScheduler(
+        initial_interval=2, max_interval=10, backoff_factor=2, jitter=0
+    )
+    assert poll_scheduler.interval(0) == 2
+    assert poll_scheduler.interval(1) == 4
+    assert poll_scheduler.interval(2) == 8
+    assert poll_scheduler.interval(3) == 10
+
+
+def test_interval_jitter_is_bounded():
+    poll_scheduler = scheduler.PollScheduler(initial_interval=10, jitter=0.2)
+    for _ in range(100):
+        assert 8 <= poll_scheduler.interval(0) <= 12
+
+
+def test_pop_due_follows_schedule():
+    clock = FakeClock()
+    poll_scheduler = scheduler.PollScheduler(
+        initial_interval=2, backoff_factor=2, jitter=0, clock=clock
+    )
+    record = make_record("a")
+    poll_scheduler.schedule(record)
+
+    assert poll_scheduler.pop_due() == []
+    assert poll_scheduler.next_poll_in() == 2
+
+    clock.now = 2
+    assert poll_scheduler.pop_due() == [record]
+
+    # The second poll waits twice as long as the first
+    poll_scheduler.schedule(record)
+    clock.now = 5
+    assert poll_scheduler.pop_due() == []
+    clock.now = 6
+    assert poll_scheduler.pop_due() == [record]
+
+
+def test_pop_due_caps_polls_per_second():
+    clock = FakeClock()
+    poll_scheduler = scheduler.PollScheduler(
+        initial_interval=1, jitter=0, max_polls_per_second=3, clock=clock
+    )
+    for i in range(10):
+        poll_scheduler.schedule(make_record(str(i)))
+
+    clock.now = 1
+    assert len(poll_scheduler.pop_due()) == 3
+    assert poll_scheduler.pop_due() == []
+    assert 0 < poll_scheduler.next_poll_in() <= 1 / 3
+
+    clock.now = 2
+    assert len(poll_scheduler.pop_due()) == 3
+    assert len(poll_scheduler) == 4
+
+
+def test_schedule_skips_queued_snapshots():
+    """Test a snapshot already queued is not polled twice"""
+    clock = FakeClock()
+    poll_scheduler = scheduler.PollScheduler(initial_interval=1, jitter=0, clock=clock)
+    record = make_record("a")
+    poll_scheduler.schedule(record)
+    poll_scheduler.schedule(record)
+
+    clock.now = 1
+    assert poll_scheduler.pop_due() == [record]
+    assert len(poll_scheduler) == 0
@@ -0,0 +1,46 @@
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from fw_gear_sitewide_snapshot.snapshot import shard, snapshot
+
+from .snapshot_assets import FAKE_KEY, mock_client, mock_project, mock_sdk_client
+
+PROJECT_IDS = [f"{i:024x}" for i in range(1000)]
+
+
+def test_project_in_shard_partitions_projects():
+    """Test every project belongs to exactly one shard, and shards are balanced"""
+    shard_count = 4
+    shards = [
+        [p for p in PROJECT_IDS if shard.project_in_shard(p, index, shard_count)]
+        for index in range(shard_count)
+    ]
+    assert sorted(sum(shards, [])) == PROJECT_IDS
+    assert all(200 < len(projects) < 300 for projects in shards)
+
+
+def test_validate_shard():
+    shard.validate_shard(0, 1)
+    shard.validate_shard(3, 4)
+    with pytest.raises(ValueError):
+        shard.validate_shard(4, 4)
+    with pytest.raises(ValueError):
+        shard.validate_shard(0, 0)
+
+
+@patch("fw_client.FWClient")
+@patch("flywheel.Client")
+def test_trigger_snapshots_on_list_sharded(patch_client, patch_sdk_client):
+    """Test a sharded snapshotter only triggers snapshots in its shard"""
+    triggered = []
+    for index in range(3):
+        snapshotter = snapshot.Snapshotter(
+            api_key=FAKE_KEY, shard_index=index, shard_count=3
+        )
+        snapshotter.make_snapshot_on_id = MagicMock()
+        snapshotter.trigger_snapshots_on_list(PROJECT_IDS)
+        triggered.extend(
+            c.args[0] for c in snapshotter.make_snapshot_on_id.call_args_list
+        )
+    assert sorted(triggered) == PROJECT_IDS
@@ -1,6 +1,6 @@
 from unittest.mock import MagicMock, patch
 
-from fw_gear_sitewide_snapshot.snapshot import snapshot
+from fw_gear_sitewide_snapshot.snapshot import project_index, snapshot
 
 from .snapshot_assets import (
     FAKE_BATCH_NAME,
@@ -33,7 +33,9 @@ def test_trigger_snapshots_on_filter(
     test_filter = "label=Test Project"
     snapshotter.trigger_snapshots_on_filter(test_filter)
     print(mock_sdk_client.projects.find.call_args_list)
-    mock_sdk_client.projects.iter_find.assert_called_with(test_filter)
+    mock_sdk_client.projects.iter_find.assert_called_with(
+        test_filter, x_accept_feature=project_index.LEAN_FINDER_FEATURES
+    )
     snapshotter.make_snapshot_on_project.assert_called_with(mock_project)
 
 
@@ -64,7 +66,8 @@ def test_make_snapshot_on_project(
     # final call to make_snapshot_on_id should always happen
     assert snapshotter.make_snapshot_on_id.call_count == 1
 
-    # test on lookup string
+    # test on an ID string that is not cached yet
+    snapshotter.projects.clear()
     project = FAKE_PROJECT_ID
     snapshotter.make_snapshot_on_project(project)
     # Get project functions that should have been called
@@ -85,6 +88,14 @@ def test_make_snapshot_on_project(
 
     assert snapshotter.make_snapshot_on_id.call_count == 3
 
+    # test on an ID string that is already cached
+    snapshotter.make_snapshot_on_project(FAKE_PROJECT_ID)
+    # the project is not fetched again
+    snapshotter.sdk_client.get_project.assert_called_once()
+    snapshotter.make_snapshot_on_id.assert_called_with(FAKE_PROJECT_ID)
+
+    assert snapshotter.make_snapshot_on_id.call_count == 4
+
 
 @patch("fw_client.FWClient")
 @patch("flywheel.Client")
@@ -124,5 +135,130 @@ def test_log_snapshot(patch_client, patch_sdk_client, mock_client, mock_sdk_clie
     snapshotter.batch_name = FAKE_BATCH_NAME
     record = snapshot.snapshot_utils.SnapshotRecord(**FAKE_RESPONSE)
     snapshotter.log_snapshot(FAKE_RESPONSE)
-    assert snapshotter.snapshots == [record]
+    assert [s.to_record() for s in snapshotter.snapshots] == [record]
     snapshotter.sdk_client.get_project.assert_called_with(FAKE_PROJECT_ID)
+
+
+@patch("fw_client.FWClient")
+@patch("flywheel.Client")
+def test_log_snapshot_uses_project_cache(
+    patch_client, patch_sdk_client, mock_client, mock_sdk_client, mock_project
+):
+    patch_client.return_value = mock_client
+    patch_sdk_client.return_value = mock_sdk_client
+
+    snapshotter = snapshot.Snapshotter(api_key=FAKE_KEY)
+    snapshotter.sdk_client = mock_sdk_client
+    snapshotter.snapshot_client = mock_client
+    snapshotter.projects.add(mock_project)
+
+    snapshotter.log_snapshot(FAKE_RESPONSE)
+    snapshotter.log_snapshot(FAKE_RESPONSE)
+
+    assert snapshotter.sdk_client.get_project.call_count == 0
+    assert snapshotter.snapshots[0].project_label == FAKE_PROJECT_LABEL
+    assert snapshotter.snapshots[0].group_label == FAKE_GROUP
+
+
+@patch("fw_client.FWClient")
+@patch("flywheel.Client")
+def test_trigger_snapshots_on_list_concurrently(
+    patch_client, patch_sdk_client, mock_client, mock_sdk_client
+):
+    patch_client.return_value = mock_client
+    patch_sdk_client.return_value = mock_sdk_client
+
+    snapshotter = snapshot.Snapshotter(
+        api_key=FAKE_KEY, max_workers=4, max_requests_per_second=1000
+    )
+    snapshotter.sdk_client = mock_sdk_client
+    snapshotter.snapshot_client = mock_client
+
+    project_ids = [f"{i:024x}" for i in range(20)]
+    with patch(
+        "fw_gear_sitewide_snapshot.snapshot.snapshot_utils.make_snapshot"
+    ) as util_mock:
+        util_mock.side_effect = lambda client, project_id: {
+            **FAKE_RESPONSE,
+            "_id": f"snapshot_{project_id}",
+            "parents": {"project": project_id},
+        }
+        snapshotter.trigger_snapshots_on_list(project_ids)
+
+    assert util_mock.call_count == len(project_ids)
+    assert sorted(s.project_id for s in snapshotter.snapshots) == project_ids
+    assert snapshotter.errors == []
+
+
+@patch("fw_client.FWClient")
+@patch("flywheel.Client")
+def test_trigger_snapshots_records_errors(
+    patch_client, patch_sdk_client, mock_client, mock_sdk_client
+):
+    patch_client.return_value = mock_client
+    patch_sdk_client.return_value = mock_sdk_client
+
+    snapshotter = snapshot.Snapshotter(api_key=FAKE_KEY, max_workers=2)
+    snapshotter.sdk_client = mock_sdk_client
+    snapshotter.snapshot_client = mock_client
+
+    error = RuntimeError("boom")
+    snapshotter.make_snapshot_on_id = MagicMock(side_effect=[error, FAKE_RESPONSE])
+    snapshotter.trigger_snapshots_on_list(["bad", "good"])
+
+    # One failure does not stop the rest of the batch
+    assert snapshotter.make_snapshot_on_id.call_count == 2
+    assert len(snapshotter.errors) == 1
+    assert snapshotter.errors[0][1] is error
+
+
+@patch("fw_client.FWClient")
+@patch("flywheel.Client")
+def test_update_snapshots_concurrently(
+    patch_client, patch_sdk_client, mock_client, mock_sdk_client
+):
+    patch_client.return_value = mock_client
+    patch_sdk_client.return_value = mock_sdk_client
+
+    snapshotter = snapshot.Snapshotter(api_key=FAKE_KEY, max_workers=4)
+    snapshotter.snapshot_client = mock_client
+    snapshotter.snapshots = snapshot.snapshot_store.SnapshotStore(
+        snapshot.snapshot_utils.SnapshotRecord(**{**FAKE_RESPONSE, "_id": str(i)})
+        for i in range(10)
+    )
+    mock_client.get.return_value = {"status": "complete"}
+
+    snapshotter.update_snapshots()
+
+    assert mock_client.get.call_count == 10
+    assert snapshotter.is_finished()
+
+
+@patch("fw_client.FWClient")
+@patch("flywheel.Client")
+def test_update_snapshots_tolerates_errors(
+    patch_client, patch_sdk_client, mock_client, mock_sdk_client
+):
+    patch_client.return_value = mock_client
+    patch_sdk_client.return_value = mock_sdk_client
+
+    snapshotter = snapshot.Snapshotter(api_key=FAKE_KEY, max_workers=2)
+    snapshotter.snapshot_client = mock_client
+    snapshotter.snapshots = snapshot.snapshot_store.SnapshotStore(
+        snapshot.snapshot_utils.SnapshotRecord(**{**FAKE_RESPONSE, "_id": i})
+        for i in ("failing", "working")
+    )
+    failing, working = snapshotter.snapshots
+
+    def get(url, **kwargs):
+        if "failing" in url:
+            raise TimeoutError("timed out")
+        return {"status": "complete"}
+
+    mock_client.get.side_effect = get
+    snapshotter.update_snapshots()
+
+    # The error leaves the snapshot as it was, without stopping the others
+    assert failing.status == snapshot.snapshot_utils.SnapshotState.pending
+    assert working.status == snapshot.snapshot_utils.SnapshotState.complete
+    assert snapshotter.errors == []
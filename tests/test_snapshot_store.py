@@ -0,0 +1,87 @@
+import datetime
+
+from fw_gear_sitewide_snapshot.snapshot import snapshot_store, snapshot_utils
+
+from .snapshot_assets import make_record
+
+states = snapshot_utils.SnapshotState
+
+
+def test_compact_snapshot_round_trip():
+    """Test a compact snapshot keeps everything the report and journal need"""
+    record = make_record("a", status=states.in_progress)
+    compact = snapshot_store.CompactSnapshot.from_record(record)
+
+    assert compact.to_record() == record
+    assert compact.to_row() == record.to_row()
+    assert compact.project_id == record.project_id
+    assert not hasattr(compact, "__dict__")
+
+
+def test_pending_index():
+    """Test the unfinished snapshots are tracked as their statuses change"""
+    store = snapshot_store.SnapshotStore(
+        [make_record("a"), make_record("b"), make_record("c", status=states.complete)]
+    )
+    a, b, c = store
+
+    assert len(store) == 3
+    assert store.pending() == [a, b]
+    assert store.pending_count() == 2
+    assert store.get("b") is b
+
+    assert store.set_status(a, states.in_progress)
+    assert not store.set_status(a, states.in_progress)
+    assert store.pending() == [a, b]
+    assert store.set_status(a, states.failed)
+    assert store.set_status(b, states.complete)
+    assert store.pending() == []
+    assert store.pending_count() == 0
+    assert store.count(states.complete) == 2
+    assert store.count(states.failed) == 1
+    assert store.count(states.pending) == 0
+
+
+def test_duration_until_the_snapshot_finished():
+    """Test a snapshot's duration runs to when the server says it finished"""
+    created = datetime.datetime(2024, 1, 1, 12, tzinfo=datetime.timezone.utc)
+    store = snapshot_store.SnapshotStore(
+        [make_record("a", created=created), make_record("b", created=created)]
+    )
+    a, b = store
+
+    store.set_status(a, states.complete, created + datetime.timedelta(seconds=90))
+    store.set_status(b, states.failed)
+    assert a.duration_seconds == 90
+    # Without a finish time, the snapshot finished when it was seen to
+    assert b.duration_seconds > 90
+
+
+def test_set_status_of_record_outside_store():
+    """Test a record the store does not hold just has its status set"""
+    store = snapshot_store.SnapshotStore([make_record("a")])
+    outside = make_record("a")
+
+    assert store.set_status(outside, states.complete)
+    assert outside.status == states.complete
+    assert store.pending_count() == 1
+
+
+def test_replace_with_retry():
+    """Test a retry takes the place of the failed snapshot it replaces"""
+    store = snapshot_store.SnapshotStore(
+        [make_record("a", status=states.failed), make_record("b")]
+    )
+    a, b = store
+    retry = store.replace(a, make_record("c"))
+
+    assert list(store) == [retry, b]
+    assert store.get("a") is None
+    assert store.get("c") is retry
+    assert store.pending() == [b, retry]
+    assert store.count(states.failed) == 0
+    assert store.count(states.pending) == 2
+
+    # A retry of a retry takes the same place
+    second_retry = store.replace(retry, make_record("d"))
+    assert list(store) == [second_retry, b]
@@ -1,3 +1,6 @@
+import datetime
+import time
+
 from fw_gear_sitewide_snapshot.snapshot import snapshot_utils
 
 from .snapshot_assets import (
@@ -44,6 +47,15 @@ def test_SnapshotRecord_is_final():
     assert record.is_final()
 
 
+def test_SnapshotRecord_from_row():
+    """Test a snapshot record survives a round trip through a report row"""
+    record = snapshot_utils.SnapshotRecord(**FAKE_RESPONSE)
+
+    from_row = snapshot_utils.SnapshotRecord.from_row(record.to_row())
+    assert from_row.to_row() == record.to_row()
+    assert from_row.parents.project == FAKE_PROJECT_ID
+
+
 def test_string_matches_id():
     """Test string_matches_id function"""
     assert snapshot_utils.string_matches_id(FAKE_PROJECT_ID)
@@ -69,3 +81,36 @@ def test_get_snapshot(mock_client):
     )
 
     assert response == FAKE_RESPONSE
+
+
+def test_seconds_since_takes_naive_times_as_utc(monkeypatch):
+    """Test a naive report time is compared as UTC on a host in another timezone"""
+    monkeypatch.setenv("TZ", "America/New_York")
+    time.tzset()
+    try:
+        now = datetime.datetime.now(datetime.timezone.utc)
+        created = snapshot_utils.utc_naive(now - datetime.timedelta(seconds=60))
+        assert 60 <= snapshot_utils.seconds_since(created) < 120
+        assert snapshot_utils.seconds_since(created, now) == 60
+    finally:
+        monkeypatch.undo()
+        time.tzset()
+
+
+def test_snapshot_status_finished():
+    """Test a final snapshot finished when it completed, or else was modified"""
+    status = snapshot_utils.SnapshotStatus.parse_obj(
+        {
+            "status": "complete",
+            "completed": "2024-01-01T12:01:30Z",
+            "modified": "2024-01-01T12:02:00Z",
+        }
+    )
+    assert status.finished == datetime.datetime(
+        2024, 1, 1, 12, 1, 30, tzinfo=datetime.timezone.utc
+    )
+    status = snapshot_utils.SnapshotStatus(
+        status="failed", modified="2024-01-01T12:02:00Z"
+    )
+    assert status.finished.minute == 2
+    assert snapshot_utils.SnapshotStatus(status="in_progress").finished is None
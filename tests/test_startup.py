@@ -0,0 +1,70 @@
+"""Startup benchmark: import time of the gear's entry points
+
+Run `python -m tests.test_startup` to print the import time of each module.
+"""
+
+import subprocess
+import sys
+
+from fw_gear_sitewide_snapshot.snapshot import snapshot
+
+from .snapshot_assets import FAKE_KEY
+
+# Modules only some code paths need, which must not be imported at startup
+HEAVY_MODULES = ["pandas", "flywheel", "httpx"]
+
+IMPORT_SCRIPT = """
+import sys, time
+start = time.perf_counter()
+import {module}
+print(time.perf_counter() - start)
+print(",".join(m for m in {heavy!r} if m in sys.modules))
+"""
+
+
+def time_import(module: str) -> (float, list):
+    """Imports a module in a fresh interpreter
+
+    Returns:
+        the import time in seconds, and the heavy modules it loaded
+    """
+    output = subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            IMPORT_SCRIPT.format(module=module, heavy=HEAVY_MODULES),
+        ],
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout.splitlines()
+    loaded = output[1].split(",") if output[1] else []
+    return float(output[0]), loaded
+
+
+def test_main_import_is_lean():
+    _, loaded = time_import("fw_gear_sitewide_snapshot.main")
+    assert loaded == []
+
+
+def test_snapshotter_builds_clients_lazily():
+    snapshotter = snapshot.Snapshotter(api_key=FAKE_KEY)
+    assert snapshotter._snapshot_client is None
+    assert snapshotter._sdk_client is None
+
+    # Only the client that is used gets built
+    client = snapshotter.snapshot_client
+    assert snapshotter.snapshot_client is client
+    assert snapshotter._sdk_client is None
+
+
+if __name__ == "__main__":
+    for module in [
+        "fw_gear_sitewide_snapshot.main",
+        "fw_gear_sitewide_snapshot.parser",
+        "fw_gear_sitewide_snapshot.snapshot.async_snapshot",
+        "pandas",
+        "flywheel",
+    ]:
+        seconds, loaded = time_import(module)
+        print(f"{module:<52} {seconds * 1000:8.1f} ms  loads: {', '.join(loaded)}")
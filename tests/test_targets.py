@@ -0,0 +1,117 @@
+import asyncio
+
+from fw_gear_sitewide_snapshot.snapshot import (
+    async_snapshot,
+    project_index,
+    snapshot,
+    targets,
+)
+
+from .fake_flywheel import FakeFlywheel, connect
+
+# Projects 1 and 11 match both filters, project 11 is also given by ID, and
+# projects 3 and 5 are only given by ID and path
+TARGETS = (
+    "group=group1; label=~^project 1; {id_11}; {id_3}; group5/project 5; group=group1"
+)
+
+
+def batch_filter(fake: FakeFlywheel) -> str:
+    ids = list(fake.projects)
+    return TARGETS.format(id_11=ids[11], id_3=ids[3])
+
+
+def check_matches(fake: FakeFlywheel, rows: list) -> None:
+    """Checks every project was snapshotted once, for the first target matching it"""
+    ids = list(fake.projects)
+    matched = {row["project_id"]: row["matched_filter"] for row in rows}
+    assert len(rows) == len(matched) == len(fake.snapshots) == 13
+    assert matched[ids[1]] == matched[ids[11]] == "group=group1"
+    assert matched[ids[10]] == matched[ids[19]] == "label=~^project 1"
+    assert matched[ids[3]] == ids[3]
+    assert matched[ids[5]] == "group5/project 5"
+    # One query per distinct filter, and a request per project no filter found
+    assert fake.requests["get_project"] == fake.requests["lookup"] == 1
+
+
+def test_plan_targets():
+    plan = targets.plan_targets(
+        "group=a,label=b;group=a\n group/project ;label=~c; group=a; group/project"
+    )
+    assert plan.filters == ["group=a", "label=~c"]
+    assert plan.projects == ["group/project"]
+    assert plan.key == "group=a;label=~c;group/project"
+    assert plan.is_batch()
+
+    assert targets.plan_targets("group=a; ALL").filters == [""]
+    single = targets.plan_targets("label=x")
+    assert single.key == "label=x" and not single.is_batch()
+
+
+def test_targets_are_snapshotted_once():
+    """Test the projects of several targets are deduplicated before triggering"""
+    with FakeFlywheel(projects=20) as fake:
+        snapshotter = connect(
+            snapshot.Snapshotter(
+                fake.api_key, max_workers=4, max_requests_per_second=1000
+            ),
+            fake.url,
+        )
+        snapshotter.trigger_snapshots_on_filter(batch_filter(fake))
+
+    assert not snapshotter.errors
+    check_matches(fake, [s.to_row() for s in snapshotter.snapshots])
+    assert snapshotter.matches.duplicates == 3
+
+
+def test_async_targets_are_snapshotted_once():
+    async def scenario(fake):
+        async with async_snapshot.AsyncSnapshotter(
+            fake.api_key, max_workers=4, max_requests_per_second=1000
+        ) as snapshotter:
+            await snapshotter.trigger_snapshots_on_filter(batch_filter(fake))
+        return snapshotter
+
+    with FakeFlywheel(projects=20) as fake:
+        snapshotter = asyncio.run(scenario(fake))
+
+    assert not snapshotter.errors
+    check_matches(fake, [s.to_row() for s in snapshotter.snapshots])
+
+
+def test_unknown_project_is_recorded_as_an_error():
+    with FakeFlywheel(projects=3) as fake:
+        snapshotter = connect(
+            snapshot.Snapshotter(fake.api_key, max_requests_per_second=1000),
+            fake.url,
+        )
+        snapshotter.trigger_snapshots_on_filter("group=group1; group/missing")
+
+    assert len(snapshotter.snapshots) == 1
+    assert [target for target, _ in snapshotter.errors] == ["group/missing"]
+
+
+def test_index_keeps_matched_targets(tmp_path):
+    """Test an index of several targets is reused with the target of each project"""
+    path = tmp_path / project_index.PROJECT_INDEX_FILENAME
+    with FakeFlywheel(projects=20) as fake:
+        first = connect(
+            snapshot.Snapshotter(
+                fake.api_key,
+                max_requests_per_second=1000,
+                index=project_index.ProjectIndex(path),
+            ),
+            fake.url,
+        )
+        first.trigger_snapshots_on_filter(batch_filter(fake))
+
+        second = connect(
+            snapshot.Snapshotter(fake.api_key, max_requests_per_second=1000),
+            fake.url,
+        )
+        second.use_project_index(*project_index.load_project_index(path))
+        fake.requests.clear()
+        second.trigger_snapshots_on_filter(batch_filter(fake))
+
+    assert fake.requests["find"] == 0
+    assert second.matches.targets == first.matches.targets
@@ -0,0 +1,155 @@
+import asyncio
+import threading
+from unittest.mock import MagicMock, patch
+
+import pytest
+from fw_http_client.errors import ClientError, NotFound, ServerError
+
+from fw_gear_sitewide_snapshot.snapshot import throttle
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def http_error(error_class, status, headers=None):
+    error = error_class(f"{status} error")
+    error.response = MagicMock(status_code=status, headers=headers or {})
+    return error
+
+
+def test_token_bucket_reserve():
+    clock = FakeClock()
+    bucket = throttle.TokenBucket(rate=2, clock=clock)
+
+    # The burst is available immediately, then callers must wait
+    assert bucket.reserve() == 0
+    assert bucket.reserve() == 0
+    assert bucket.reserve() == pytest.approx(0.5)
+    assert bucket.reserve() == pytest.approx(1.0)
+
+    clock.now = 10
+    assert bucket.reserve() == 0
+
+
+def test_adaptive_concurrency_aimd():
+    concurrency = throttle.AdaptiveConcurrency(max_limit=8)
+    assert concurrency.try_acquire()
+    concurrency.release(throttled=True)
+    assert concurrency.limit == 4
+
+    for _ in range(4):
+        assert concurrency.try_acquire()
+    assert not concurrency.try_acquire()
+
+    for _ in range(4):
+        concurrency.release()
+    # Successes grow the limit additively, by about one per limit requests
+    assert 4.9 < concurrency.limit < 5
+
+
+def test_adaptive_concurrency_wakes_waiters_on_release():
+    """Test a thread waiting for a slot takes it as soon as one is released"""
+    concurrency = throttle.AdaptiveConcurrency(max_limit=1)
+    concurrency.acquire()
+    acquired = threading.Event()
+    waiter = threading.Thread(
+        target=lambda: (concurrency.acquire(), acquired.set()), daemon=True
+    )
+    waiter.start()
+    assert not acquired.wait(0.05)
+
+    concurrency.release()
+    assert acquired.wait(1)
+    assert concurrency.in_flight == 1
+
+
+def test_call_async_keeps_to_the_concurrency():
+    """Test coroutines waiting for a slot all run, never more than the limit"""
+    throttler = throttle.Throttle(max_requests_per_second=1000, max_concurrency=2)
+    in_flight, most_in_flight = 0, 0
+
+    async def request():
+        nonlocal in_flight, most_in_flight
+        in_flight += 1
+        most_in_flight = max(most_in_flight, in_flight)
+        await asyncio.sleep(0.01)
+        in_flight -= 1
+
+    async def scenario():
+        await asyncio.gather(*(throttler.call_async(request) for _ in range(10)))
+
+    asyncio.run(scenario())
+    assert most_in_flight == 2
+    assert throttler.concurrency.in_flight == 0
+
+
+def test_circuit_breaker_opens_and_recovers():
+    clock = FakeClock()
+    breaker = throttle.CircuitBreaker(failure_threshold=2, cooldown=30, clock=clock)
+
+    breaker.record_failure()
+    assert breaker.wait_time() == 0
+    breaker.record_failure()
+    assert breaker.wait_time() == 30
+
+    clock.now = 30
+    assert breaker.wait_time() == 0
+    breaker.record_success()
+    assert breaker.failures == 0
+
+
+def test_retry_after():
+    error = http_error(ClientError, 429, {"Retry-After": "7"})
+    assert throttle.retry_after(error) == 7
+    assert throttle.retry_after(http_error(ClientError, 429)) is None
+
+
+@patch("fw_gear_sitewide_snapshot.snapshot.throttle.time.sleep")
+def test_call_retries_throttled_requests(mock_sleep):
+    func = MagicMock(
+        side_effect=[
+            http_error(ClientError, 429, {"Retry-After": "3"}),
+            http_error(ServerError, 503),
+            "ok",
+        ]
+    )
+    limiter = throttle.Throttle(max_requests_per_second=100, max_concurrency=4)
+
+    assert limiter.call(func, "arg", key="value") == "ok"
+
+    assert func.call_count == 3
+    func.assert_called_with("arg", key="value")
+    mock_sleep.assert_any_call(3.0)
+    # Throttling halved the concurrency limit
+    assert limiter.concurrency.limit < 4
+    assert limiter.concurrency.in_flight == 0
+
+
+@patch("fw_gear_sitewide_snapshot.snapshot.throttle.time.sleep")
+def test_call_does_not_retry_other_errors(mock_sleep):
+    error = http_error(NotFound, 404)
+    func = MagicMock(side_effect=error)
+    limiter = throttle.Throttle()
+
+    with pytest.raises(NotFound):
+        limiter.call(func)
+
+    assert func.call_count == 1
+    assert limiter.concurrency.in_flight == 0
+    assert limiter.breaker.failures == 0
+
+
+@patch("fw_gear_sitewide_snapshot.snapshot.throttle.time.sleep")
+def test_call_gives_up_after_max_retries(mock_sleep):
+    func = MagicMock(side_effect=http_error(ClientError, 429))
+    limiter = throttle.Throttle(max_retries=2)
+
+    with pytest.raises(ClientError):
+        limiter.call(func)
+
+    assert func.call_count == 3
@@ -0,0 +1,78 @@
+import asyncio
+
+from fw_gear_sitewide_snapshot.snapshot import (
+    async_snapshot,
+    metrics,
+    snapshot,
+    throttle,
+    transport,
+)
+
+from .fake_flywheel import FakeFlywheel, connect
+
+
+def test_clients_share_one_pool():
+    """Test both clients reuse a few connections for every request of a run"""
+    with FakeFlywheel(projects=40, duration=60) as fake:
+        snapshotter = connect(
+            snapshot.Snapshotter(
+                fake.api_key, max_workers=4, max_requests_per_second=1000
+            ),
+            fake.url,
+        )
+        snapshotter.trigger_snapshots_on_filter("ALL")
+        snapshotter.update_snapshots()
+        adapters = [
+            snapshotter.snapshot_client.get_adapter(fake.url),
+            snapshotter.sdk_client.session.get_adapter(fake.url),
+        ]
+
+    assert adapters[0].poolmanager is adapters[1].poolmanager
+    stats = snapshotter.connection_stats()
+    # The finder pages, and a trigger and a status request per project
+    assert stats["requests"] >= 80
+    assert stats["opened"] <= transport.pool_size(4)
+    assert stats["reused"] == stats["requests"] - stats["opened"]
+
+    snapshotter.metrics.record_connections(stats)
+    lines = metrics.prometheus_lines(snapshotter.metrics)
+    opened = f"{metrics.PROMETHEUS_PREFIX}_connections_opened_total {stats['opened']}"
+    assert opened in lines
+
+
+def test_retry_after_is_left_to_the_throttle(monkeypatch):
+    """Test throttled snapshot requests are retried by the throttle, not urllib3"""
+    monkeypatch.setattr(throttle, "RETRY_BACKOFF", 0.01)
+    with FakeFlywheel(projects=20, throttle_rate=0.2, retry_after=0, seed=3) as fake:
+        snapshotter = connect(
+            snapshot.Snapshotter(
+                fake.api_key, max_workers=4, max_requests_per_second=1000
+            ),
+            fake.url,
+        )
+        snapshotter.trigger_snapshots_on_filter("ALL")
+        stats = fake.stats()
+
+    assert len(snapshotter.snapshots) == 20
+    assert stats["faults"]["trigger"] > 0
+    assert snapshotter.metrics.retries["trigger"] == stats["faults"]["trigger"]
+
+
+def test_async_snapshotter_keeps_connections_alive(monkeypatch):
+    """Test the asyncio engine counts its connections, falling back from HTTP/2"""
+    monkeypatch.setattr(transport, "http2_available", lambda: False)
+
+    async def scenario(fake):
+        async with async_snapshot.AsyncSnapshotter(
+            fake.api_key, max_workers=8, max_requests_per_second=1000, http2=True
+        ) as snapshotter:
+            await snapshotter.trigger_snapshots_on_filter("ALL")
+        return snapshotter
+
+    with FakeFlywheel(projects=50) as fake:
+        snapshotter = asyncio.run(scenario(fake))
+
+    assert len(snapshotter.snapshots) == 50
+    stats = snapshotter.connection_stats()
+    assert stats["requests"] > 50
+    assert stats["opened"] <= transport.pool_size(8)